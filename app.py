@@ -1,24 +1,117 @@
 # app.py - WhatsApp Booking Bot with Admin Panel
-from flask import Flask, request, Response
-from twilio.twiml.messaging_response import MessagingResponse
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from flask import Flask, request, Response, stream_with_context
+from urllib.parse import urlencode
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from datetime import datetime
+import io
 import os
+import time
+import logging
 from dotenv import load_dotenv
+from catalog import BusinessCatalog, normalize_number, valid_code
+from availability import AvailabilityIndex
+from calendars import SlotCalendar
+from session_store import create_session_store
+from replies import create_reply_cache
+from outbound import create_sender
+from reminders import create_scheduler
+from archive import create_housekeeper
+import transfer
+from workers import MessageWorkerPool
+from stats import ReservationStats
+from indexes import ensure_indexes, check_query_plans
+from dates import today_key, format_key
+import metrics
+import database
+from page_cache import PageCache, PageVersions, make_etag
+from events import ReservationHub, public_reservation
+from rendering import Templates
+from engine import BookingEngine
+from providers import MongoProvider
+import webhook
+from logging_setup import configure_logging, init_app as init_request_ids
 
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+init_request_ids(app)
+metrics.init_app(app)
 
-# MongoDB connection
+# MongoDB connection - one client per process, made on first use (after a
+# gunicorn --preload fork too); pool and timeouts from MONGO_* (database.py)
 MONGODB_URI = os.getenv('MONGODB_URI')
-client = MongoClient(MONGODB_URI)
-db = client['booking_systems']
+client = database.connect(MONGODB_URI, event_listeners=[metrics.mongo_listener])
+db = client[os.getenv('MONGODB_DB', 'booking_systems')]
+readiness = database.Readiness(client, ttl=float(os.getenv('READINESS_TTL', 5)),
+                               timeout=float(os.getenv('READINESS_TIMEOUT', 2)))
 reservations = db['reservations']
 clients_db = db['clients']
+calendar_days = db['calendars']
+
+# Indexes - INDEX_SELF_CHECK=true refuses to start if a hot query does a COLLSCAN
+if os.getenv('ENSURE_INDEXES', 'true') == 'true':
+    try:
+        ensure_indexes(db)
+    except PyMongoError as e:
+        logger.error("Ensuring indexes failed: %s", e)
+if os.getenv('INDEX_SELF_CHECK', 'false') == 'true':
+    check_query_plans(db)
+
+# Business catalog cache
+CATALOG_TTL = int(os.getenv('CATALOG_TTL', 300))
+catalog = BusinessCatalog(clients_db, ttl=CATALOG_TTL)
+
+# Per-day slot calendars (atomic claims) and the in-memory index over them
+slot_calendar = SlotCalendar(calendar_days, reservations)
+AVAILABILITY_TTL = int(os.getenv('AVAILABILITY_TTL', 30))
+availability = AvailabilityIndex(slot_calendar, ttl=AVAILABILITY_TTL)
+
+# "prvi slobodni" - how many free slots to offer, and how far ahead to look
+FIRST_FREE_COUNT = int(os.getenv('FIRST_FREE_COUNT', 5))
+FIRST_FREE_DAYS = int(os.getenv('FIRST_FREE_DAYS', 14))
+
+# Reservation change events - feed page versions and live dashboards
+reservation_events = ReservationHub()
+
+# Rendered pages and their versions
+page_versions = PageVersions(window=int(os.getenv('PAGE_VERSION_WINDOW', 60)), hub=reservation_events)
+reservation_events.add_listener(page_versions.on_event)
+# An open dashboard stream holds a WSGI thread for as long as the page is
+# open; asgi_app.py serves /events on its event loop instead. Only enable
+# this for workers where that is cheap (gevent, eventlet).
+SSE_SYNC_WORKERS = os.getenv('SSE_SYNC_WORKERS', 'false') == 'true'
+page_cache = PageCache(max_entries=int(os.getenv('PAGE_CACHE_SIZE', 256)))
+pages = Templates(app.jinja_env, ['home.html', 'salon.html', 'admin.html', 'admin_login.html',
+                                  'admin_add.html', 'admin_message.html'])
+
+# Admin panel counters
+reservation_stats = ReservationStats(reservations, ttl=int(os.getenv('STATS_TTL', 60)),
+                                     archived=db['archive_counts'])
 
 # User sessions
-user_sessions = {}
+sessions = create_session_store(
+    os.getenv('SESSION_BACKEND', 'memory'),
+    db=db,
+    ttl=int(os.getenv('SESSION_TTL', 86400)),
+    max_sessions=int(os.getenv('SESSION_MAX', 100000)),
+    redis_url=os.getenv('REDIS_URL')
+)
+sessions.lock_timeout = float(os.getenv('SESSION_LOCK_TIMEOUT', 30))
+sessions.lock_lease = int(os.getenv('SESSION_LOCK_LEASE', 30))
+
+# Replies by Twilio MessageSid - retried webhooks are answered from here
+replies = create_reply_cache(
+    os.getenv('REPLY_CACHE_BACKEND', 'memory'),
+    db=db,
+    ttl=int(os.getenv('REPLY_CACHE_TTL', 3600)),
+    max_entries=int(os.getenv('REPLY_CACHE_SIZE', 100000)),
+    redis_url=os.getenv('REDIS_URL')
+)
+REPLY_WAIT = float(os.getenv('REPLY_WAIT', 10))
 
 # Admin password - CHANGE THIS!
 ADMIN_PASSWORD = "admin2024"
@@ -29,380 +122,251 @@ ADMIN_PASSWORD = "admin2024"
 
 def get_business_config(business_id):
     """Get business configuration"""
-    return clients_db.find_one({'business_id': business_id})
+    return catalog.get(business_id)
 
 def get_all_businesses():
     """Get all businesses"""
+    return provider.businesses()
+
+def reservation_saved(reservation, reservation_id, day):
+    """Update stats, pages and dashboards after a reservation insert"""
+    reservation_stats.record(reservation['business_id'], reservation['date'])
+    page_versions.bump(reservation['business_id'], reservation_id)
+    reservation_events.publish_local({
+        'type': 'created',
+        'business_id': reservation['business_id'],
+        'reservation': public_reservation(dict(reservation, _id=reservation_id)),
+        'marker': str(reservation_id)
+    })
+    logger.info("Reservation saved", extra={'reservation_id': str(reservation_id),
+                                             'business_id': reservation['business_id']})
+
+# The conversation itself lives in engine.py; this app feeds it every
+# salon in MongoDB (see flask-twilio-backend.py for a single static salon)
+provider = MongoProvider(catalog, availability, slot_calendar, reservations, on_saved=reservation_saved)
+engine = BookingEngine(provider, sessions, first_free_count=FIRST_FREE_COUNT, first_free_days=FIRST_FREE_DAYS)
+process_message = engine.process_message
+
+def reply_in_background(sender, bot_number, incoming_msg):
+    """Worker pool handler for async webhook mode"""
+    metrics.begin('webhook_worker')
     try:
-        all_clients = list(clients_db.find({}))
-        print(f"Found {len(all_clients)} businesses in database")
-        for client_doc in all_clients:
-            print(f"  - {client_doc.get('name')} (active: {client_doc.get('active')})")
-        return all_clients
+        response_text = process_message(sender, incoming_msg, bot_number)
     except Exception as e:
-        print(f"ERROR fetching businesses: {e}")
-        return []
+        logger.exception("Processing message failed: %s", e)
+        response_text = "Bot greska."
+    outbound.send(sender, response_text, from_=bot_number or None)
 
-def get_available_slots(business_id, date_str):
-    """Get available time slots for a date"""
-    business = get_business_config(business_id)
-    if not business:
-        return []
-    
-    all_slots = business.get('available_slots', [])
-    
-    # Get booked slots
-    existing = list(reservations.find({
-        'business_id': business_id,
-        'date': date_str,
-        'status': {'$in': ['confirmed', 'pending']}
-    }))
-    
-    booked = [res['time'] for res in existing]
-    available = [slot for slot in all_slots if slot not in booked]
-    
-    return available
-
-def get_user_session(phone_number):
-    """Get or create user session"""
-    if phone_number not in user_sessions:
-        user_sessions[phone_number] = {
-            'step': 'select_business',
-            'data': {},
-            'business_id': None
-        }
-    return user_sessions[phone_number]
-
-def process_message(phone_number, message):
-    """Main bot logic"""
-    session = get_user_session(phone_number)
-    step = session['step']
-    data = session['data']
-    msg = message.lower().strip()
-    
-    print(f"Phone: {phone_number} | Step: {step} | Msg: {msg}")
-    
-    # STEP 0: Select business
-    if step == 'select_business':
-        businesses = get_all_businesses()
-        
-        if not businesses:
-            return "Trenutno nema dostupnih biznisa."
-        
-        if 'rezerv' in msg or 'termin' in msg or msg == 'start':
-            business_list = '\n'.join([
-                f"{i+1}. {b['name']} - {b['city']}" 
-                for i, b in enumerate(businesses)
-            ])
-            return f"Pozdrav! Za koji biznis zelite rezervirati?\n\n{business_list}\n\nOdaberite broj:"
-        
-        try:
-            business_num = int(msg)
-            if 1 <= business_num <= len(businesses):
-                selected = businesses[business_num - 1]
-                session['business_id'] = selected['business_id']
-                session['step'] = 'initial'
-                data['business_name'] = selected['name']
-                return f"Odabrali ste: {selected['name']}\n\nZa rezervaciju napisite 'termin'."
-        except ValueError:
-            pass
-        
-        business_list = '\n'.join([
-            f"{i+1}. {b['name']}" for i, b in enumerate(businesses)
-        ])
-        return f"Odaberite biznis:\n\n{business_list}"
-    
-    business_config = get_business_config(session['business_id'])
-    if not business_config:
-        session['step'] = 'select_business'
-        return "Greska. Odaberite biznis ponovno."
-    
-    # STEP 1: Initial
-    if step == 'initial':
-        if 'rezerv' in msg or 'termin' in msg:
-            session['step'] = 'service'
-            services_list = '\n'.join([
-                f"{i+1}. {s}" 
-                for i, s in enumerate(business_config['services'])
-            ])
-            return f"{business_config['name']}\n\nUsluge:\n\n{services_list}\n\nOdaberite broj:"
-        elif 'radno' in msg:
-            return f"Radno vrijeme: {business_config['working_hours']}"
-        else:
-            return f"Za rezervaciju napisite 'termin'."
-    
-    # STEP 2: Service
-    elif step == 'service':
-        try:
-            service_num = int(msg)
-            if 1 <= service_num <= len(business_config['services']):
-                data['service'] = business_config['services'][service_num - 1]
-                session['step'] = 'date'
-                return f"Usluga: {data['service']}\n\nZa koji datum?\n(npr. 15.12.2024 ili 'sutra')"
-        except ValueError:
-            pass
-        return "Molim odaberite broj usluge."
-    
-    # STEP 3: Date
-    elif step == 'date':
-        if msg == 'danas':
-            date_str = datetime.now().strftime('%d.%m.%Y')
-        elif msg == 'sutra':
-            date_str = (datetime.now() + timedelta(days=1)).strftime('%d.%m.%Y')
-        elif '.' in message:
-            date_str = message
-        else:
-            return "Molim unesite datum (npr. 15.12.2024 ili 'sutra')."
-        
-        data['date'] = date_str
-        session['step'] = 'time'
-        
-        # Check available slots
-        available_slots = get_available_slots(session['business_id'], date_str)
-        
-        if not available_slots:
-            return f"Nazalost, za {date_str} nema slobodnih termina.\n\nPokusajte s drugim datumom."
-        
-        slots_list = '\n'.join([
-            f"{i+1}. {s}" for i, s in enumerate(available_slots)
-        ])
-        
-        data['available_slots'] = available_slots
-        
-        return f"Datum: {date_str}\n\nSlobodni termini:\n\n{slots_list}\n\nOdaberite broj:"
-    
-    # STEP 4: Time
-    elif step == 'time':
-        try:
-            time_num = int(msg)
-            available_slots = data.get('available_slots', [])
-            
-            if 1 <= time_num <= len(available_slots):
-                data['time'] = available_slots[time_num - 1]
-                session['step'] = 'name'
-                return f"Vrijeme: {data['time']}\n\nKako se zovete?"
-        except ValueError:
-            pass
-        return "Molim odaberite broj termina."
-    
-    # STEP 5: Name
-    elif step == 'name':
-        if len(message.strip()) >= 2:
-            data['name'] = message.strip()
-            session['step'] = 'phone'
-            return f"Ime: {message}\n\nVas broj telefona:"
-        return "Molim unesite vase ime."
-    
-    # STEP 6: Phone
-    elif step == 'phone':
-        phone_clean = message.replace(' ', '').replace('+', '')
-        if phone_clean.isdigit() and len(phone_clean) >= 9:
-            data['phone'] = message.strip()
-            session['step'] = 'confirm'
-            
-            summary = f"""PREGLED REZERVACIJE:
-
-{business_config['name']}
-{business_config['address']}
-{data['service']}
-{data['date']}
-{data['time']}
-{data['name']}
-{data['phone']}
-
-Potvrdite: 'DA' ili 'NE'"""
-            return summary
-        return "Molim unesite ispravan broj."
-    
-    # STEP 7: Confirm
-    elif step == 'confirm':
-        if msg in ['da', 'yes', 'potvrdi']:
-            try:
-                # Double check availability
-                available_slots = get_available_slots(session['business_id'], data['date'])
-                
-                if data['time'] not in available_slots:
-                    return f"Termin {data['time']} je upravo zauzet!\n\nOdaberite drugi termin. Napisite 'termin'."
-                
-                # Save reservation
-                reservation = {
-                    'business_id': session['business_id'],
-                    'business_name': business_config['name'],
-                    'business_phone': business_config['phone'],
-                    'business_email': business_config.get('email'),
-                    'service': data['service'],
-                    'date': data['date'],
-                    'time': data['time'],
-                    'client_name': data['name'],
-                    'client_phone': data['phone'],
-                    'whatsapp_number': phone_number,
-                    'status': 'confirmed',
-                    'created_at': datetime.utcnow()
-                }
-                
-                result = reservations.insert_one(reservation)
-                print(f"Reservation saved: {result.inserted_id}")
-                
-                # Reset session
-                session['step'] = 'select_business'
-                session['business_id'] = None
-                session['data'] = {}
-                
-                return f"POTVRDJENO!\n\nRezervirali ste:\n{data['date']} u {data['time']}\n\n{business_config['name']} ce vas kontaktirati.\n\nZa novu rezervaciju napisite 'termin'."
-                
-            except Exception as e:
-                print(f"Error saving: {e}")
-                return "Greska pri spremanju. Pokusajte ponovno."
-        
-        elif msg in ['ne', 'no', 'odustani']:
-            session['step'] = 'select_business'
-            session['business_id'] = None
-            session['data'] = {}
-            return "Otkazano."
-        
-        return "Odgovorite sa 'DA' ili 'NE'."
-    
-    return "Napisite 'termin' za rezervaciju."
+# Async webhook mode - acknowledge Twilio at once, reply via REST API
+ASYNC_WEBHOOK = os.getenv('ASYNC_WEBHOOK', 'false') == 'true'
+outbound = create_sender() if ASYNC_WEBHOOK else None
+message_workers = MessageWorkerPool(
+    reply_in_background,
+    workers=int(os.getenv('WEBHOOK_WORKERS', 4)),
+    max_queue=int(os.getenv('WEBHOOK_QUEUE_SIZE', 10000))
+)
+
+# Reminders usually run as their own process (python reminders.py); this
+# runs them inside the web app instead, leased so one node sends
+reminder_scheduler = create_scheduler(db, outbound) if os.getenv('REMINDERS', 'false') == 'true' else None
+
+# Queued salon deletes and, only with ARCHIVE_DAYS set, archival of old
+# reservations (see archive.py); leased, so every node can run it
+housekeeper = create_housekeeper(db)
+tenant_deletions = housekeeper.deletions
+HOUSEKEEPING = os.getenv('HOUSEKEEPING', 'true') == 'true'
+# Exports read reservations_archive too, but not JSONL archive files
+ARCHIVE_FILES = getattr(tenant_deletions.archive, 'directory', None)
+
+def start_background():
+    """Change-stream watchers, reminders and housekeeping (idempotent).
+
+    Threads do not survive a fork, so gunicorn.conf.py sets
+    BACKGROUND_START=warm_up and every worker starts its own from
+    warm_up(); otherwise they start at import.
+    """
+    catalog.watch()
+    reservation_events.watch(reservations)
+    if reminder_scheduler is not None:
+        reminder_scheduler.start()
+    if HOUSEKEEPING:
+        housekeeper.start()
+
+if os.getenv('BACKGROUND_START', 'import') == 'import':
+    start_background()
 
 # ============================================
 # MAIN ROUTES
 # ============================================
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Twilio webhook"""
+webhook.init_app(app, engine, replies, REPLY_WAIT,
+                 submit=message_workers.submit if ASYNC_WEBHOOK else None)
+
+# Salon dashboard pages are keyed on (date, time, _id) so a page never
+# skips or repeats reservations, however many a salon has
+DASHBOARD_PAGE_SIZE = int(os.getenv('DASHBOARD_PAGE_SIZE', 100))
+DASHBOARD_FIELDS = {'date': 1, 'time': 1, 'client_name': 1, 'service': 1, 'client_phone': 1}
+
+def dashboard_query(business_id, date_from=None, date_to=None, after=None):
+    """Filter for one dashboard page; `after` is the (date, time, _id) of the last row shown"""
+    query = {'business_id': business_id}
+    date_range = {}
+    if date_from:
+        date_range['$gte'] = date_from
+    if date_to:
+        date_range['$lte'] = date_to
+    if date_range:
+        query['date'] = date_range
+    if after:
+        date, time, oid = after
+        query['$or'] = [
+            {'date': {'$gt': date}},
+            {'date': date, 'time': {'$gt': time}},
+            {'date': date, 'time': time, '_id': {'$gt': oid}}
+        ]
+    return query
+
+def parse_page_cursor(token):
+    date, time, oid = token.split('|')
+    return date, time, ObjectId(oid)
+
+def valid_date_key(value):
     try:
-        incoming_msg = request.values.get('Body', '').strip()
-        sender = request.values.get('From', '').strip()
-        
-        print(f"Received: {incoming_msg} from {sender}")
-        
-        response_text = process_message(sender, incoming_msg)
-        
-        print(f"Response: {response_text[:50]}")
-        
-        resp = MessagingResponse()
-        resp.message(response_text)
-        
-        return Response(str(resp), mimetype='text/xml')
-        
-    except Exception as e:
-        print(f"ERROR: {e}")
-        resp = MessagingResponse()
-        resp.message("Bot greska.")
-        return Response(str(resp), mimetype='text/xml')
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
 
 @app.route('/salon/<business_id>')
 def salon_dashboard(business_id):
-    """Dashboard for salon"""
+    """Dashboard for salon - streamed, one page of reservations at a time"""
     business = get_business_config(business_id)
     
     if not business:
         return "Salon nije pronaden", 404
     
-    salon_reservations = list(reservations.find({
-        'business_id': business_id
-    }).sort('created_at', -1).limit(50))
+    date_from = request.args.get('from', today_key())
+    date_to = request.args.get('to', '')
+    if any(d and not valid_date_key(d) for d in (date_from, date_to)):
+        return "Neispravan datum", 400
+    try:
+        after = parse_page_cursor(request.args['after']) if request.args.get('after') else None
+    except (ValueError, InvalidId):
+        return "Neispravna stranica", 400
     
-    reservations_by_date = {}
-    for res in salon_reservations:
-        date = res['date']
-        if date not in reservations_by_date:
-            reservations_by_date[date] = []
-        reservations_by_date[date].append(res)
+    etag = make_etag('salon', catalog.fingerprint, page_versions.business(business_id),
+                     today_key(), request.query_string)
     
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>{business['name']} - Dashboard</title>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                padding: 20px;
-                margin: 0;
-            }}
-            .container {{
-                max-width: 1200px;
-                margin: 0 auto;
-                background: white;
-                border-radius: 15px;
-                padding: 30px;
-                box-shadow: 0 10px 30px rgba(0,0,0,0.3);
-            }}
-            h1 {{ color: #667eea; }}
-            .reservation {{
-                background: #f8f9fa;
-                padding: 15px;
-                border-radius: 8px;
-                margin-bottom: 10px;
-                display: flex;
-                justify-content: space-between;
-            }}
-            .time {{ background: #667eea; color: white; padding: 10px 20px; border-radius: 8px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>{business['name']}</h1>
-            <p>{business['address']}, {business['city']}</p>
-            <p>{business['phone']}</p>
-            
-            <h2>Rezervacije</h2>
-    """
+    page = {'next': None}
     
-    if reservations_by_date:
-        for date, date_reservations in reservations_by_date.items():
-            html += f"<h3>{date}</h3>"
-            for res in date_reservations:
-                html += f"""
-                <div class="reservation">
-                    <div>
-                        <strong>{res['client_name']}</strong><br>
-                        {res['service']}<br>
-                        <small>{res['client_phone']}</small>
-                    </div>
-                    <div class="time">{res['time']}</div>
-                </div>
-                """
-    else:
-        html += "<p>Nema rezervacija</p>"
+    def rows():
+        cursor = reservations.find(
+            dashboard_query(business_id, date_from, date_to, after),
+            DASHBOARD_FIELDS
+        ).sort([('date', 1), ('time', 1), ('_id', 1)]).limit(DASHBOARD_PAGE_SIZE + 1)
+        
+        current_date = None
+        last = None
+        for shown, res in enumerate(cursor):
+            if shown == DASHBOARD_PAGE_SIZE:
+                page['next'] = urlencode({
+                    'from': date_from,
+                    'to': date_to,
+                    'after': f"{last['date']}|{last['time']}|{last['_id']}"
+                })
+                break
+            heading = None
+            if res['date'] != current_date:
+                current_date = res['date']
+                heading = format_key(current_date)
+            yield {'heading': heading, 'res': res}
+            last = res
     
-    html += """
-        </div>
-    </body>
-    </html>
-    """
+    def generate():
+        return pages.stream('salon.html', business=business, date_from=date_from, date_to=date_to,
+                            rows=rows(), page=page)
+    
+    return page_cache.respond(etag, generate)
+
+@app.route('/salon/<business_id>/events')
+def salon_events(business_id):
+    """Server-Sent Events with the salon's reservation changes"""
+    if not get_business_config(business_id):
+        return "Salon nije pronaden", 404
+    if not SSE_SYNC_WORKERS:
+        # 204 tells EventSource not to reconnect; the page works without live updates
+        return '', 204
     
-    return html
+    return Response(
+        reservation_events.stream(business_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def cache_stats(attr):
+    return lambda: {
+        ('catalog',): getattr(catalog, attr),
+        ('availability',): getattr(availability, attr),
+        ('admin_stats',): getattr(reservation_stats, attr),
+        ('pages',): getattr(page_cache, attr),
+        ('replies',): getattr(replies, attr),
+    }
+
+metrics.registry.register(metrics.Gauge(
+    'booking_cache_hits_total', 'Cache hits by cache', cache_stats('hits'), ('cache',), kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'booking_cache_misses_total', 'Cache misses by cache', cache_stats('misses'), ('cache',), kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'booking_sessions', 'Live conversation sessions', lambda: sessions.count()))
+metrics.registry.register(metrics.Gauge(
+    'booking_dashboard_subscribers', 'Connected live dashboards', reservation_events.subscriber_count))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health')
+@app.route('/health/live')
 def health():
+    """Liveness - the process answers; touches nothing"""
     return {'status': 'ok', 'message': 'Bot running'}
 
+@app.route('/health/ready')
+def health_ready():
+    """Readiness - MongoDB answers a ping (cached for READINESS_TTL seconds)"""
+    result, ready = readiness.check()
+    return result, 200 if ready else 503
+
+def warm_up():
+    """Open the MongoDB pool and load the catalog before taking traffic.
+
+    Called per worker by gunicorn.conf.py (post_worker_init) and on ASGI
+    startup; MONGO_WARM_UP_CONNECTIONS sockets, default MONGO_MIN_POOL_SIZE.
+    Also starts this process's background threads.
+    """
+    start_background()
+    start = time.perf_counter()
+    connections = os.getenv('MONGO_WARM_UP_CONNECTIONS')
+    try:
+        ping_ms = client.warm_up(int(connections) if connections else None)
+        provider.businesses()
+    except PyMongoError as e:
+        logger.error("Warm-up failed: %s", e)
+        return False
+    readiness.warm = True
+    logger.info("Warmed up", extra={'ping_ms': round(ping_ms, 2),
+                                    'duration_ms': round((time.perf_counter() - start) * 1000, 1)})
+    return True
+
 @app.route('/')
 def home():
     businesses = get_all_businesses()
-    links = '<br>'.join([
-        f'<a href="/salon/{b["business_id"]}">{b["name"]} Dashboard</a>' 
-        for b in businesses
-    ])
     
-    return f'''
-    <html>
-    <head><meta charset="UTF-8"></head>
-    <body style="font-family: Arial; padding: 40px; text-align: center;">
-        <h1>WhatsApp Booking Bot</h1>
-        <p>Bot je aktivan!</p>
-        <h2>Salon Dashboards:</h2>
-        {links if links else '<p>Nema biznisa.</p>'}
-        <br><br>
-        <a href="/admin" style="padding: 12px 24px; background: #667eea; color: white; text-decoration: none; border-radius: 8px;">Admin Panel</a>
-    </body>
-    </html>
-    '''
+    def render():
+        return pages.render('home.html', businesses=businesses)
+    
+    return page_cache.respond(make_etag('home', catalog.fingerprint), render)
 
 # ============================================
 # ADMIN PANEL
@@ -414,98 +378,20 @@ def admin_panel():
     password = request.args.get('password')
     
     if password != ADMIN_PASSWORD:
-        return '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Admin Login</title>
-            <meta charset="UTF-8">
-            <style>
-                body { font-family: Arial; display: flex; justify-content: center; align-items: center; height: 100vh; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); margin: 0; }
-                .login-box { background: white; padding: 40px; border-radius: 15px; box-shadow: 0 10px 30px rgba(0,0,0,0.3); }
-                h2 { color: #667eea; margin-bottom: 20px; }
-                input { width: 100%; padding: 12px; border: 1px solid #ddd; border-radius: 8px; margin-bottom: 15px; font-size: 14px; box-sizing: border-box; }
-                button { width: 100%; padding: 12px; background: #667eea; color: white; border: none; border-radius: 8px; cursor: pointer; font-size: 16px; font-weight: bold; }
-            </style>
-        </head>
-        <body>
-            <div class="login-box">
-                <h2>Admin Login</h2>
-                <form method="GET">
-                    <input type="password" name="password" placeholder="Admin Password" required autofocus>
-                    <button type="submit">Login</button>
-                </form>
-            </div>
-        </body>
-        </html>
-        ''', 401
+        return pages.render('admin_login.html'), 401
     
-    businesses = list(clients_db.find({}))
-    total_res = reservations.count_documents({})
-    today = datetime.now().strftime('%d.%m.%Y')
-    today_res = reservations.count_documents({'date': today})
+    businesses = get_all_businesses()
+    stats = reservation_stats.get(today_key())
+    deletions = tenant_deletions.active()
+    etag = make_etag('admin', catalog.fingerprint, stats['total'], stats['today'],
+                     sorted(stats['by_business'].items()),
+                     [(d['business_id'], sorted(d['deleted'].items())) for d in deletions])
     
-    rows = ""
-    for b in businesses:
-        count = reservations.count_documents({'business_id': b['business_id']})
-        status = "Aktivan" if b.get('active') else "Neaktivan"
-        rows += f"""
-        <tr>
-            <td><strong>{b['name']}</strong></td>
-            <td>{b['city']}</td>
-            <td>{b['phone']}</td>
-            <td>{count}</td>
-            <td>{status}</td>
-            <td><a href='/salon/{b["business_id"]}' target='_blank'>View</a></td>
-            <td><a href='/admin/delete/{b["business_id"]}?password={password}' onclick='return confirm("Sigurno?")' style='color: red;'>Delete</a></td>
-        </tr>
-        """
+    def render():
+        return pages.render('admin.html', businesses=businesses, stats=stats, deletions=deletions,
+                            archive_files=ARCHIVE_FILES, password=password)
     
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Admin Panel</title>
-        <meta charset="UTF-8">
-        <style>
-            body {{ font-family: Arial; padding: 20px; background: #f5f5f5; margin: 0; }}
-            .container {{ max-width: 1400px; margin: 0 auto; }}
-            .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 15px; margin-bottom: 30px; }}
-            .stats {{ display: grid; grid-template-columns: repeat(4, 1fr); gap: 20px; margin-bottom: 30px; }}
-            .stat-card {{ background: white; padding: 25px; border-radius: 10px; text-align: center; box-shadow: 0 5px 15px rgba(0,0,0,0.1); }}
-            .stat-card h3 {{ margin: 0; font-size: 36px; color: #667eea; }}
-            .panel {{ background: white; padding: 30px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.1); }}
-            .btn {{ padding: 12px 24px; background: #667eea; color: white; text-decoration: none; border-radius: 8px; display: inline-block; margin-bottom: 20px; }}
-            table {{ width: 100%; border-collapse: collapse; }}
-            th {{ background: #f8f9fa; padding: 15px; text-align: left; border-bottom: 2px solid #ddd; }}
-            td {{ padding: 15px; border-bottom: 1px solid #eee; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>Admin Panel</h1>
-                <p>Upravljanje klijentima i rezervacijama</p>
-            </div>
-            
-            <div class="stats">
-                <div class="stat-card"><h3>{len(businesses)}</h3><p>Klijenata</p></div>
-                <div class="stat-card"><h3>{len([b for b in businesses if b.get('active')])}</h3><p>Aktivni</p></div>
-                <div class="stat-card"><h3>{total_res}</h3><p>Rezervacija</p></div>
-                <div class="stat-card"><h3>{today_res}</h3><p>Danas</p></div>
-            </div>
-            
-            <div class="panel">
-                <a href="/admin/add?password={password}" class="btn">+ Dodaj klijenta</a>
-                <table>
-                    <tr><th>Naziv</th><th>Grad</th><th>Telefon</th><th>Rezervacije</th><th>Status</th><th>Dashboard</th><th>Akcije</th></tr>
-                    {rows if rows else '<tr><td colspan="7" style="text-align:center;padding:40px;">Nema klijenata</td></tr>'}
-                </table>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+    return page_cache.respond(etag, render, private=True)
 
 @app.route('/admin/add')
 def admin_add():
@@ -513,64 +399,7 @@ def admin_add():
     if password != ADMIN_PASSWORD:
         return "Unauthorized", 401
     
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Dodaj klijenta</title>
-        <meta charset="UTF-8">
-        <style>
-            body {{ font-family: Arial; padding: 20px; background: #f5f5f5; }}
-            .container {{ max-width: 700px; margin: 0 auto; background: white; padding: 40px; border-radius: 15px; }}
-            h1 {{ color: #667eea; }}
-            input, select, textarea {{ width: 100%; padding: 12px; margin: 8px 0 20px 0; border: 1px solid #ddd; border-radius: 8px; box-sizing: border-box; }}
-            button {{ width: 100%; padding: 14px; background: #667eea; color: white; border: none; border-radius: 8px; font-size: 16px; cursor: pointer; }}
-            label {{ font-weight: bold; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Dodaj novog klijenta</h1>
-            <form method="POST" action="/admin/save?password={password}">
-                <label>Business ID:</label>
-                <input type="text" name="business_id" required placeholder="salon_novi_zg">
-                
-                <label>Naziv:</label>
-                <input type="text" name="name" required>
-                
-                <label>Grad:</label>
-                <input type="text" name="city" required>
-                
-                <label>Adresa:</label>
-                <input type="text" name="address" required>
-                
-                <label>Telefon:</label>
-                <input type="tel" name="phone" required>
-                
-                <label>Email:</label>
-                <input type="email" name="email">
-                
-                <label>Usluge (odvojene zarezom):</label>
-                <input type="text" name="services" required placeholder="Sisanje, Farbanje">
-                
-                <label>Radno vrijeme:</label>
-                <input type="text" name="working_hours" required placeholder="09:00-20:00">
-                
-                <label>Termini (odvojeni zarezom):</label>
-                <input type="text" name="available_slots" required placeholder="09:00, 10:00, 11:00">
-                
-                <label>Aktivan:</label>
-                <select name="active">
-                    <option value="true">Da</option>
-                    <option value="false">Ne</option>
-                </select>
-                
-                <button type="submit">Spremi</button>
-            </form>
-        </div>
-    </body>
-    </html>
-    """
+    return pages.render('admin_add.html', password=password)
 
 @app.route('/admin/save', methods=['POST'])
 def admin_save():
@@ -586,18 +415,78 @@ def admin_save():
             'address': request.form.get('address'),
             'phone': request.form.get('phone'),
             'email': request.form.get('email'),
+            'whatsapp_number': normalize_number(request.form.get('whatsapp_number')),
+            'code': (request.form.get('code') or '').strip().lower() or None,
             'services': [s.strip() for s in request.form.get('services').split(',')],
             'working_hours': request.form.get('working_hours'),
-            'available_slots': [s.strip() for s in request.form.get('available_slots').split(',')],
+            'available_slots': [s.strip() for s in request.form.get('available_slots').split(',') if s.strip()],
+            'capacity': max(1, int(request.form.get('capacity') or 1)),
             'active': request.form.get('active') == 'true',
             'created_at': datetime.utcnow()
         }
+        # Slots are matched and stored as HH:MM (see calendars.slot_field)
+        bad_slots = [slot for slot in data['available_slots'] if not transfer.TIME_RE.match(slot)]
+        if bad_slots or not data['available_slots']:
+            return pages.render('admin_message.html',
+                                message=f"Neispravni termini: {', '.join(bad_slots) or 'nema termina'} (format HH:MM)",
+                                back='Nazad na admin', password=password), 400
+        if data['code'] is not None and not valid_code(data['code']):
+            return pages.render('admin_message.html',
+                                message=f"Neispravan kod: {data['code']} (jedna rijec, ne broj ni rijec "
+                                        "koju bot koristi, npr. 'termin')",
+                                back='Nazad na admin', password=password), 400
         
         clients_db.insert_one(data)
-        return f"<html><head><meta charset='UTF-8'></head><body style='text-align:center;padding:40px;font-family:Arial'><h2>Klijent dodan!</h2><a href='/admin?password={password}'>Nazad na admin</a></body></html>"
+        # Days left over from an earlier salon with this id hold its capacity
+        slot_calendar.drop_business(data['business_id'], today_key())
+        availability.drop_business(data['business_id'])
+        catalog.invalidate()
+        return pages.render('admin_message.html', message='Klijent dodan!', back='Nazad na admin',
+                            password=password)
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+@app.route('/admin/export/<kind>.<fmt>')
+def admin_export(kind, fmt):
+    """Stream businesses or reservations as CSV or JSONL"""
+    if request.args.get('password') != ADMIN_PASSWORD:
+        return "Unauthorized", 401
+    if kind not in ('businesses', 'reservations') or fmt not in ('csv', 'jsonl'):
+        return "Not found", 404
+    cursor = transfer.export_cursor(db, kind, request.args.get('business_id'),
+                                    request.args.get('from'), request.args.get('to'))
+    return Response(
+        stream_with_context(transfer.export_rows(cursor, kind, fmt)),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={kind}-{today_key()}.{fmt}'}
+    )
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+def admin_import(kind):
+    """Bulk upsert an uploaded CSV or JSONL file"""
+    password = request.args.get('password')
+    if password != ADMIN_PASSWORD:
+        return "Unauthorized", 401
+    if kind not in ('businesses', 'reservations'):
+        return "Not found", 404
+    upload = request.files.get('file')
+    if upload is None:
+        return "Missing file", 400
+    fmt = 'jsonl' if upload.filename.endswith(('.jsonl', '.json')) else 'csv'
+    lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    result = transfer.import_rows(db, kind, transfer.read_rows(lines, fmt),
+                                  dry_run=request.form.get('dry_run') == 'true')
+    for business_id in result['business_ids']:
+        availability.drop_business(business_id)
+        page_versions.bump(business_id, ObjectId())
+    catalog.invalidate()
+    logger.info("Imported %s: %d rows, %d inserted, %d updated, %d rejected",
+                kind, result['rows'], result['inserted'], result['updated'], result['rejected'])
+    message = (f"Uvezeno {result['rows']} redaka: {result['inserted']} novih, "
+               f"{result['updated']} azuriranih, {result['rejected']} odbijenih")
+    return pages.render('admin_message.html', message=message, errors=result['errors'],
+                        back='Nazad', password=password)
+
 @app.route('/admin/delete/<business_id>')
 def admin_delete(business_id):
     password = request.args.get('password')
@@ -605,16 +494,41 @@ def admin_delete(business_id):
         return "Unauthorized", 401
     
     try:
+        # The salon disappears at once; its reservations and calendar days
+        # are deleted in the background (archive.TenantDeletions)
         clients_db.delete_one({'business_id': business_id})
-        reservations.delete_many({'business_id': business_id})
-        return f"<html><head><meta charset='UTF-8'></head><body style='text-align:center;padding:40px;font-family:Arial'><h2>Klijent obrisan!</h2><a href='/admin?password={password}'>Nazad</a></body></html>"
+        tenant_deletions.enqueue(business_id)
+        page_versions.bump(business_id, ObjectId())
+        reservation_events.publish_local({'type': 'reset', 'business_id': business_id, 'reservation': None})
+        availability.drop_business(business_id)
+        reservation_stats.drop_business(business_id)
+        catalog.invalidate()
+        return pages.render('admin_message.html', message='Klijent obrisan! Podaci se brisu u pozadini.',
+                            back='Nazad', password=password)
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+@app.route('/admin/delete/<business_id>/status')
+def admin_delete_status(business_id):
+    """Progress of a background salon delete"""
+    if request.args.get('password') != ADMIN_PASSWORD:
+        return "Unauthorized", 401
+    job = tenant_deletions.status(business_id)
+    if job is None:
+        return {'error': 'not found'}, 404
+    return {
+        'business_id': business_id,
+        'status': job['status'],
+        'deleted': job.get('deleted', {}),
+        'updated_at': job['updated_at'].isoformat(),
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None,
+    }
+
 # ============================================
 # RUN APP
 # ============================================
 
 if __name__ == '__main__':
+    warm_up()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,309 @@
+# archive.py - Keep the hot reservation collection small
+#
+#   python archive.py --once                  archive once, run queued tenant deletes
+#   python archive.py --days 90 --to DIR      archive to gzipped JSONL files in DIR
+#   python archive.py                         keep running (any number of nodes)
+#
+# Reservations older than ARCHIVE_DAYS (180 for this script; the web app
+# archives only when ARCHIVE_DAYS is set) move to `reservations_archive` (or
+# to monthly reservations-YYYY-MM.jsonl.gz files) in batches: copy, then
+# delete the copied _ids, then pause. A crash in between copies a batch twice,
+# never loses one - the Mongo archive ignores the duplicate, JSONL readers
+# should keep the last line per _id. Past calendar days go with them.
+#
+# Deleting a salon is queued in `jobs` by the admin panel and carried out
+# here in throttled chunks, with per-collection progress on the job.
+# Both jobs hold a lease, so only one node works on them at a time.
+import argparse
+import gzip
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from leases import Lease
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_JOB = {'status': {'$in': ['queued', 'running']}}
+
+
+def delete_in_batches(collection, query, batch_size=1000, pause=0.0, progress=None, stop=None):
+    """Delete matching documents `batch_size` _ids at a time; returns the count.
+
+    `progress(n)` runs after every batch of n deletes and may return False to stop.
+    """
+    deleted = 0
+    while stop is None or not stop.is_set():
+        ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            break
+        n = collection.delete_many({'_id': {'$in': ids}}).deleted_count
+        deleted += n
+        if progress and progress(n) is False:
+            break
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+class MongoArchive:
+    """Archived reservations in another collection, same _ids"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def write(self, docs):
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Already archived by a run that died before deleting
+            if any(err['code'] != 11000 for err in e.details['writeErrors']):
+                raise
+
+    def delete_business(self, business_id, **kwargs):
+        return delete_in_batches(self.collection, {'business_id': business_id}, **kwargs)
+
+
+class JsonlArchive:
+    """Archived reservations as Extended JSON lines in monthly gzip files"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, docs):
+        by_month = {}
+        for doc in docs:
+            by_month.setdefault(doc['date'][:7], []).append(doc)
+        for month, month_docs in by_month.items():
+            path = os.path.join(self.directory, f'reservations-{month}.jsonl.gz')
+            with open(path, 'ab') as raw:
+                # Appending adds a gzip member; readers see one continuous stream
+                with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                    f.write(''.join(json_util.dumps(doc) + '\n' for doc in month_docs).encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def delete_business(self, business_id, **kwargs):
+        logger.warning("Archived JSONL files in %s still hold %s; remove them offline",
+                       self.directory, business_id)
+        return 0
+
+
+class Archiver:
+    """Moves reservations (and calendar days) older than `days` out of the hot collections"""
+
+    def __init__(self, reservations, calendars, counts, target, days=90, batch_size=1000, pause=0.1):
+        self.reservations = reservations
+        self.calendars = calendars
+        # Archived reservations per business, so admin totals stay whole
+        self.counts = counts
+        self.target = target
+        self.days = days
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def run_once(self, today=None, lease=None, stop=None):
+        """Archive one horizon's worth; returns the number of reservations moved"""
+        cutoff = ((today or date.today()) - timedelta(days=self.days)).isoformat()
+        query = {'date': {'$lt': cutoff}}
+        moved = 0
+        while stop is None or not stop.is_set():
+            batch = list(self.reservations.find(query).sort([('date', 1), ('time', 1)]).limit(self.batch_size))
+            if not batch:
+                break
+            self.target.write(batch)
+            ids = [doc['_id'] for doc in batch]
+            self.reservations.delete_many({'_id': {'$in': ids}})
+            per_business = {}
+            for doc in batch:
+                per_business[doc.get('business_id')] = per_business.get(doc.get('business_id'), 0) + 1
+            self.counts.bulk_write([
+                UpdateOne({'_id': business_id}, {'$inc': {'archived': n}, '$set': {'business_id': business_id}},
+                          upsert=True)
+                for business_id, n in per_business.items()
+            ], ordered=False)
+            moved += len(batch)
+            if len(batch) < self.batch_size or (lease and not lease.acquire()):
+                break
+            time.sleep(self.pause)
+        days = delete_in_batches(self.calendars, query, self.batch_size, self.pause, stop=stop)
+        if moved or days:
+            logger.info("Archived %d reservations and %d calendar days before %s", moved, days, cutoff)
+        return moved
+
+
+class TenantDeletions:
+    """Queued salon deletions, carried out in throttled chunks"""
+
+    def __init__(self, jobs, collections, archive=None, batch_size=500, pause=0.2):
+        self.jobs = jobs
+        # name -> collection holding documents with a business_id
+        self.collections = collections
+        self.archive = archive
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def enqueue(self, business_id):
+        now = datetime.utcnow()
+        self.jobs.update_one(
+            {'_id': f'delete:{business_id}'},
+            {'$set': {'kind': 'delete_business', 'business_id': business_id, 'status': 'queued',
+                      'deleted': {}, 'created_at': now, 'updated_at': now},
+             '$unset': {'finished_at': ''}},
+            upsert=True
+        )
+
+    def status(self, business_id):
+        return self.jobs.find_one({'_id': f'delete:{business_id}'}, {'_id': 0})
+
+    def active(self):
+        return list(self.jobs.find({'kind': 'delete_business', **ACTIVE_JOB}, {'_id': 0}).sort('created_at', 1))
+
+    def run_pending(self, lease=None, stop=None):
+        """Work through queued deletions; returns the business ids finished"""
+        finished = []
+        for job in self.active():
+            if (stop and stop.is_set()) or (lease and not lease.acquire()):
+                break
+            if self._run(job, lease, stop):
+                finished.append(job['business_id'])
+        return finished
+
+    def _run(self, job, lease, stop):
+        business_id = job['business_id']
+        job_id = f'delete:{business_id}'
+        self.jobs.update_one({'_id': job_id}, {'$set': {'status': 'running', 'updated_at': datetime.utcnow()}})
+
+        lost = []
+
+        def progress(name):
+            def report(n):
+                self.jobs.update_one({'_id': job_id}, {'$inc': {f'deleted.{name}': n},
+                                                       '$set': {'updated_at': datetime.utcnow()}})
+                if lease is not None and not lease.acquire():
+                    lost.append(name)
+                    return False
+            return report
+
+        def interrupted():
+            return lost or (stop is not None and stop.is_set())
+
+        for name, collection in self.collections.items():
+            if interrupted():
+                break
+            delete_in_batches(collection, {'business_id': business_id}, self.batch_size, self.pause,
+                              progress(name), stop)
+        if self.archive is not None and not interrupted():
+            self.archive.delete_business(business_id, batch_size=self.batch_size, pause=self.pause,
+                                         progress=progress('archive'), stop=stop)
+        if interrupted():
+            # Picked up again by the next run (on whichever node holds the lease)
+            return False
+        self.jobs.update_one({'_id': job_id}, {'$set': {
+            'status': 'done', 'updated_at': datetime.utcnow(), 'finished_at': datetime.utcnow()}})
+        logger.info("Deleted business %s", business_id)
+        return True
+
+
+class Housekeeper:
+    """Background thread: queued tenant deletes often, archival every `archive_interval`"""
+
+    def __init__(self, deletions, archiver, leases, poll=5, archive_interval=3600):
+        self.deletions = deletions
+        self.archiver = archiver
+        self.poll = poll
+        self.archive_interval = archive_interval
+        self._delete_lease = Lease(leases, 'tenant-deletes', ttl=120)
+        self._archive_lease = Lease(leases, 'archive', ttl=300)
+        self._archived_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, archive=True):
+        if self._delete_lease.acquire():
+            self.deletions.run_pending(self._delete_lease, self._stop)
+        if archive and self.archiver is not None and self._archive_lease.acquire():
+            self.archiver.run_once(lease=self._archive_lease, stop=self._stop)
+            self._archived_at = time.monotonic()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='housekeeping', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._delete_lease.release()
+        self._archive_lease.release()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            due = self._archived_at is None or time.monotonic() - self._archived_at >= self.archive_interval
+            try:
+                self.run_once(archive=due)
+            except PyMongoError as e:
+                logger.warning("Housekeeping failed: %s", e)
+            except Exception as e:
+                logger.exception("Housekeeping failed: %s", e)
+            self._stop.wait(self.poll)
+
+
+def create_archive(db, target=None):
+    """ARCHIVE_TARGET: 'mongo' (default) or a directory for JSONL files"""
+    target = target or os.getenv('ARCHIVE_TARGET', 'mongo')
+    if target == 'mongo':
+        return MongoArchive(db['reservations_archive'])
+    return JsonlArchive(target)
+
+
+def create_housekeeper(db, days=None, target=None):
+    """Housekeeper configured from the environment; archival only with ARCHIVE_DAYS set"""
+    archive = create_archive(db, target)
+    days = int(os.getenv('ARCHIVE_DAYS', 0)) if days is None else days
+    batch_size = int(os.getenv('ARCHIVE_BATCH', 1000))
+    archiver = Archiver(db['reservations'], db['calendars'], db['archive_counts'], archive,
+                        days=days, batch_size=batch_size,
+                        pause=float(os.getenv('ARCHIVE_PAUSE', 0.1))) if days else None
+    deletions = TenantDeletions(
+        db['jobs'],
+        {'reservations': db['reservations'], 'calendars': db['calendars'], 'archive_counts': db['archive_counts']},
+        archive=archive,
+        batch_size=int(os.getenv('DELETE_BATCH', 500)),
+        pause=float(os.getenv('DELETE_PAUSE', 0.2))
+    )
+    return Housekeeper(deletions, archiver, db['leases'],
+                       archive_interval=int(os.getenv('ARCHIVE_INTERVAL', 3600)))
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from logging_setup import configure_logging
+
+    parser = argparse.ArgumentParser(description='Archive old reservations and run queued tenant deletes')
+    parser.add_argument('--db', default='booking_systems')
+    parser.add_argument('--days', type=int, default=None,
+                        help='archive reservations older than this (default ARCHIVE_DAYS, else 180)')
+    parser.add_argument('--to', default=None, help="'mongo' or a directory for JSONL files")
+    parser.add_argument('--once', action='store_true', help='one pass, then exit')
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    days = args.days if args.days is not None else int(os.getenv('ARCHIVE_DAYS', 180))
+    housekeeper = create_housekeeper(MongoClient(os.getenv('MONGODB_URI'))[args.db], days, args.to)
+    if args.once:
+        housekeeper.run_once()
+        housekeeper.stop()
+    else:
+        housekeeper._loop()
@@ -0,0 +1,351 @@
+# asgi_app.py - asyncio entry point for the booking bot
+#
+# Run with:  uvicorn asgi_app:application --workers 1
+#
+# /webhook and /health (liveness) are served natively on the event loop
+# with motor, as are the dashboards' live /salon/<id>/events streams;
+# every other route (dashboards, admin, /health/ready) is handed to the
+# Flask app. Startup opens both connection pools first.
+import asyncio
+import copy
+import time
+import logging
+import os
+import re
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+import app as booking
+import calendars
+import database
+import metrics
+from events import SSE_HELLO, SSE_KEEPALIVE, sse_message
+from engine import slot_taken_message
+from keyed_lock import AsyncKeyedLock
+from prefetch import CacheMiss, cache_only, deferred_writes
+from rendering import TWIML_EMPTY, twiml
+from replies import PENDING, MemoryReplyCache
+from session_store import create_async_session_store
+from webhook import ERROR_TEXT
+
+logger = logging.getLogger(__name__)
+
+# A step needs at most the catalog and one day of availability
+MAX_ATTEMPTS = 4
+
+EVENTS_PATH = re.compile(r'^/salon/([^/]+)/events$')
+SSE_KEEPALIVE_SECONDS = 15
+
+flask_app = WsgiToAsgi(booking.app)
+
+# Messages from one number are handled one at a time, in arrival order
+sender_locks = AsyncKeyedLock()
+
+# Retried MessageSids are recognised in-process only; a shared reply backend
+# would block the event loop (run a single uvicorn worker, as above)
+replies = booking.replies if isinstance(booking.replies, MemoryReplyCache) else MemoryReplyCache(
+    ttl=booking.replies.ttl)
+
+motor_client = None
+db = None
+sessions = None
+
+
+def connect():
+    """Create the motor client; must run inside the event loop"""
+    global motor_client, db, sessions
+    motor_client = AsyncIOMotorClient(booking.MONGODB_URI, event_listeners=[metrics.mongo_listener],
+                                      **database.client_options())
+    db = motor_client[booking.db.name]
+    sessions = create_async_session_store(
+        os.getenv('SESSION_BACKEND', 'memory'),
+        db=db,
+        ttl=int(os.getenv('SESSION_TTL', 86400)),
+        redis_url=os.getenv('REDIS_URL'),
+        memory_store=booking.sessions
+    )
+
+
+async def load_day(business, date_str):
+    """calendars.SlotCalendar.day() with motor"""
+    collection = db[booking.calendar_days.name]
+    key = calendars.day_key(business['business_id'], date_str)
+    day = await collection.find_one({'_id': key})
+    if day is not None:
+        return day
+    query, projection = calendars.booked_query(business['business_id'], date_str)
+    booked = await db[booking.reservations.name].find(query, projection).to_list(None)
+    day = calendars.new_day(business, date_str, [r.get('time') for r in booked])
+    try:
+        await collection.insert_one(day)
+    except DuplicateKeyError:
+        day = await collection.find_one({'_id': key})
+    return day
+
+
+async def load_days(business, dates):
+    """calendars.SlotCalendar.days() with motor"""
+    collection = db[booking.calendar_days.name]
+    found = {day['date']: day for day in await collection.find({
+        'business_id': business['business_id'],
+        'date': {'$gte': dates[0], '$lte': dates[-1]}
+    }).to_list(None)}
+    missing = [d for d in dates if d not in found]
+    if missing:
+        pipeline = calendars.booked_pipeline(business['business_id'], missing[0], missing[-1])
+        groups = await db[booking.reservations.name].aggregate(pipeline).to_list(None)
+        days = calendars.days_from_groups(business, missing, groups)
+        try:
+            await collection.insert_many(days, ordered=False)
+        except BulkWriteError:
+            days = await collection.find({'_id': {'$in': [day['_id'] for day in days]}}).to_list(None)
+        found.update((day['date'], day) for day in days)
+    return {d: found[d] for d in dates}
+
+
+async def claim(business, date_str, time_str):
+    """calendars.SlotCalendar.claim() with motor; None if the slot is taken.
+
+    A slot added to the business after its day was created is left to the
+    sync path (SlotCalendar.add_slot) - here it simply counts as taken.
+    """
+    if time_str not in calendars.slot_capacity(business):
+        return None
+    collection = db[booking.calendar_days.name]
+    query, update = calendars.claim_update(business['business_id'], date_str, time_str)
+    day = await collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    if day is None:
+        await load_day(business, date_str)
+        day = await collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    return day
+
+
+async def load_missing(miss):
+    """Fill the cache that raised CacheMiss"""
+    if miss.source == 'catalog':
+        docs = await db[booking.clients_db.name].find({}).sort('_id', 1).to_list(None)
+        booking.catalog.load(docs)
+    elif miss.source == 'availability':
+        business, date_str = miss.args_needed
+        booking.availability.fill(business, date_str, await load_day(business, date_str))
+    elif miss.source == 'availability_range':
+        business, dates = miss.args_needed
+        for date_str, day in (await load_days(business, dates)).items():
+            booking.availability.fill(business, date_str, day)
+    else:
+        raise RuntimeError(f"No async loader for {miss.source}")
+
+
+async def process_message_async(phone_number, message, to_number=None):
+    """Serialise messages per sender around _process_message_async()"""
+    async with sender_locks.hold(phone_number, booking.sessions.lock_timeout):
+        return await _process_message_async(phone_number, message, to_number)
+
+
+async def _process_message_async(phone_number, message, to_number=None):
+    """Same conversation flow as BookingEngine.process_message, without blocking I/O.
+
+    handle_step runs against the in-memory caches only. When it needs
+    something that is not cached it raises CacheMiss; we load it with
+    motor and rerun the step on a fresh copy of the session. Reservations
+    are collected and their slots claimed here once the step has finished;
+    if a claim fails the stored session is kept, as in the sync flow.
+    """
+    stored = await sessions.load(phone_number)
+    session = stored if stored is not None else booking.engine.new_session()
+    metrics.set_step(session['step'])
+
+    for _ in range(MAX_ATTEMPTS):
+        attempt = copy.deepcopy(session)
+        writes = []
+        only_token = cache_only.set(True)
+        writes_token = deferred_writes.set(writes)
+        try:
+            response_text = booking.engine.handle_step(attempt, phone_number, message, to_number)
+            # Still cache-only: the catalog may have been invalidated meanwhile
+            businesses = [booking.get_business_config(r['business_id']) for r in writes]
+        except CacheMiss as miss:
+            await load_missing(miss)
+            continue
+        finally:
+            cache_only.reset(only_token)
+            deferred_writes.reset(writes_token)
+
+        try:
+            for reservation, business in zip(writes, businesses):
+                day = await claim(business, reservation['date'], reservation['time'])
+                if day is None:
+                    return slot_taken_message(reservation['time'])
+                try:
+                    result = await db[booking.reservations.name].insert_one(reservation)
+                except PyMongoError:
+                    query, update = calendars.release_update(
+                        reservation['business_id'], reservation['date'], reservation['time'])
+                    await db[booking.calendar_days.name].update_one(query, update)
+                    raise
+                booking.provider.saved(business, reservation, result.inserted_id, day)
+        except PyMongoError as e:
+            logger.exception("Saving reservation failed: %s", e)
+            return "Greska pri spremanju. Pokusajte ponovno."
+
+        await sessions.save(phone_number, attempt)
+        return response_text
+
+    raise RuntimeError("Step kept missing the cache")
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        event = await receive()
+        body += event.get('body', b'')
+        if not event.get('more_body'):
+            return body
+
+
+async def respond(send, status, content_type, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body.encode()})
+
+
+async def claim_reply(message_sid):
+    """replies.claim_reply() without blocking the loop while waiting"""
+    deadline = time.monotonic() + booking.REPLY_WAIT
+    while True:
+        reply = replies.claim(message_sid)
+        if reply is not PENDING or time.monotonic() >= deadline:
+            return reply
+        await asyncio.sleep(0.05)
+
+
+async def webhook(receive, send):
+    """Twilio webhook, timed and labelled like the Flask one"""
+    # Motor runs commands with a copy of this task's context, so the
+    # listener sees these labels
+    metrics.begin('webhook')
+    started = time.perf_counter()
+    try:
+        await _webhook(receive, send)
+    finally:
+        metrics.finish(started, webhook=True)
+
+
+async def _webhook(receive, send):
+    """Twilio webhook - a retried MessageSid gets the first reply again"""
+    form = parse_qs((await read_body(receive)).decode())
+    message_sid = form.get('MessageSid', [''])[0]
+    if message_sid:
+        cached = await claim_reply(message_sid)
+        if cached is not None:
+            await respond(send, 200, 'text/xml', TWIML_EMPTY if cached is PENDING else cached)
+            return
+
+    try:
+        incoming_msg = form.get('Body', [''])[0].strip()
+        sender = form.get('From', [''])[0].strip()
+        bot_number = form.get('To', [''])[0].strip()
+
+        logger.debug("Received: %s", incoming_msg, extra={'phone': sender, 'sampled': True})
+
+        response_text = await process_message_async(sender, incoming_msg, bot_number)
+
+        logger.debug("Response: %s", response_text[:50], extra={'sampled': True})
+
+        body = twiml(response_text)
+    except Exception as e:
+        logger.exception("Webhook failed: %s", e)
+        if message_sid:
+            # Not cached: a retry gets another attempt, not the error
+            replies.release(message_sid)
+        return await respond(send, 200, 'text/xml', twiml(ERROR_TEXT))
+
+    if message_sid:
+        replies.store(message_sid, body)
+    await respond(send, 200, 'text/xml', body)
+
+
+async def salon_events(receive, send, business_id):
+    """Server-Sent Events with the salon's reservation changes, until the client leaves"""
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, booking.get_business_config, business_id):
+        return await respond(send, 404, 'text/plain; charset=utf-8', 'Salon nije pronaden')
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    hub = booking.reservation_events
+    subscriber = hub.subscribe(business_id, loop=loop)
+    gone = asyncio.ensure_future(disconnected())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+        chunk = SSE_HELLO
+        while True:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            event = asyncio.ensure_future(subscriber.get())
+            await asyncio.wait({event, gone}, timeout=SSE_KEEPALIVE_SECONDS,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if gone.done():
+                event.cancel()
+                return
+            if event.done():
+                chunk = sse_message(event.result())
+            else:
+                event.cancel()
+                chunk = SSE_KEEPALIVE
+    finally:
+        gone.cancel()
+        hub.unsubscribe(business_id, subscriber)
+
+
+async def warm_up():
+    """Open the motor pool and the Flask app's pymongo pool before serving"""
+    try:
+        await motor_client.admin.command('ping')
+    except PyMongoError as e:
+        logger.error("Motor warm-up failed: %s", e)
+    await asyncio.get_running_loop().run_in_executor(None, booking.warm_up)
+
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            connect()
+            await warm_up()
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            motor_client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if motor_client is None:
+        connect()
+
+    if scope['type'] == 'http' and scope['path'] == '/webhook' and scope['method'] == 'POST':
+        return await webhook(receive, send)
+    events = EVENTS_PATH.match(scope['path']) if scope['type'] == 'http' else None
+    if events and scope['method'] == 'GET':
+        return await salon_events(receive, send, events.group(1))
+    if scope['type'] == 'http' and scope['path'] in ('/health', '/health/live'):
+        return await respond(send, 200, 'application/json', '{"status": "ok", "message": "Bot running"}')
+
+    await flask_app(scope, receive, send)
@@ -0,0 +1,112 @@
+# availability.py - In-memory index of full slots
+import threading
+import time
+from collections import OrderedDict
+
+from calendars import free_count
+from prefetch import CacheMiss, cache_only
+
+class AvailabilityIndex:
+    """Full slots per (business_id, date), kept as a bitmap over the
+    business's available_slots (bit i set = no place left at available_slots[i]).
+
+    Entries are filled from the day's calendar document on a miss and then
+    replaced by update() with the document a claim or release returned,
+    so repeated lookups for the same day are pure memory reads. The TTL
+    bounds staleness when other workers write.
+    """
+
+    def __init__(self, calendar, ttl=30, max_entries=20000):
+        self.calendar = calendar
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, slots):
+        """Fresh entry for key, or None; caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == slots and time.monotonic() - entry[2] < self.ttl:
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def _entry(self, business, date_str):
+        key = (business['business_id'], date_str)
+        slots = tuple(business.get('available_slots', []))
+        with self._lock:
+            entry = self._cached(key, slots)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        if cache_only.get():
+            raise CacheMiss('availability', business, date_str)
+        return self.fill(business, date_str, self.calendar.day(business, date_str))
+
+    def fill(self, business, date_str, day):
+        """Cache one day from its calendar document"""
+        key = (business['business_id'], date_str)
+        slots = tuple(business.get('available_slots', []))
+        bitmap = 0
+        for i, slot in enumerate(slots):
+            if free_count(business, day, slot) <= 0:
+                bitmap |= 1 << i
+        entry = [slots, bitmap, time.monotonic()]
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def first_free(self, business, dates, limit, not_before=None):
+        """First `limit` free (date, slot) pairs over the given ascending dates.
+
+        Days that are not cached are read together with one range query.
+        not_before is a (date, time) pair; slots up to it are skipped.
+        """
+        slots = tuple(business.get('available_slots', []))
+        entries = {}
+        with self._lock:
+            for date_str in dates:
+                entry = self._cached((business['business_id'], date_str), slots)
+                if entry is not None:
+                    entries[date_str] = entry
+        missing = [d for d in dates if d not in entries]
+        if missing:
+            self.misses += 1
+            if cache_only.get():
+                raise CacheMiss('availability_range', business, missing)
+            for date_str, day in self.calendar.days(business, missing).items():
+                entries[date_str] = self.fill(business, date_str, day)
+        else:
+            self.hits += 1
+
+        free = []
+        for date_str in dates:
+            day_slots, bitmap, _ = entries[date_str]
+            for i, slot in enumerate(day_slots):
+                if bitmap >> i & 1 or (not_before and (date_str, slot) <= not_before):
+                    continue
+                free.append((date_str, slot))
+                if len(free) == limit:
+                    return free
+        return free
+
+    def available(self, business, date_str):
+        """Free slots for a business on a date, in configured order"""
+        slots, bitmap, _ = self._entry(business, date_str)
+        return [slot for i, slot in enumerate(slots) if not bitmap >> i & 1]
+
+    def update(self, business, day):
+        """Record the calendar document returned by a claim or release"""
+        self.fill(business, day['date'], day)
+
+    def drop_business(self, business_id):
+        """Forget every cached day of a business"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == business_id]:
+                del self._entries[key]
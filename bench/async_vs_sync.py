@@ -0,0 +1,261 @@
+# bench/async_vs_sync.py - Compare the Flask and asyncio entry points
+#
+# Drives complete booking conversations through both apps in-process
+# against the MongoDB in MONGODB_URI and prints requests/second and
+# traced memory per concurrent conversation as JSON. Every conversation
+# books its own (day, time); confirms that still fail are reported.
+#
+#   python bench/async_vs_sync.py --conversations 500 --concurrency 100
+#   python bench/async_vs_sync.py --mongomock     # in-memory, no server needed
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Imported in main(), after the arguments: importing app connects
+booking = None
+asgi_app = None
+
+BUSINESS_ID = 'bench_salon'
+SLOTS = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
+
+
+def use_mongomock():
+    """Replace MongoClient with an in-memory stand-in before app is imported"""
+    import mongomock
+    import pymongo
+
+    shared = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: shared
+
+
+class MongomockCursor:
+    """The part of a motor cursor asgi_app uses, over a mongomock cursor"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    async def to_list(self, length):
+        return list(self.cursor)
+
+
+class MongomockCollection:
+    """Awaitable methods over a mongomock collection, like a motor one"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return MongomockCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return MongomockCursor(self.collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class MongomockDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return MongomockCollection(self.db[name])
+
+
+def use_async_mongomock():
+    """Point asgi_app's motor database at the mongomock one the sync app uses"""
+    connect = asgi_app.connect
+
+    def connect_mongomock():
+        connect()
+        asgi_app.db = MongomockDatabase(booking.db)
+    asgi_app.connect = connect_mongomock
+
+
+def seed():
+    # Leftovers of an interrupted run would make slots look taken
+    cleanup()
+    booking.clients_db.insert_one({
+        'business_id': BUSINESS_ID,
+        'name': 'Bench Salon',
+        'city': 'Zagreb',
+        'address': 'Ilica 1',
+        'phone': '0910000000',
+        'services': ['Sisanje'],
+        'working_hours': '08:00-20:00',
+        'available_slots': SLOTS,
+        'active': True,
+        'created_at': datetime.utcnow()
+    })
+    booking.catalog.invalidate()
+
+
+def clear_bookings():
+    booking.reservations.delete_many({'business_id': BUSINESS_ID})
+    booking.calendar_days.delete_many({'business_id': BUSINESS_ID})
+    booking.availability.drop_business(BUSINESS_ID)
+
+
+def cleanup():
+    clear_bookings()
+    booking.clients_db.delete_many({'business_id': BUSINESS_ID})
+    booking.catalog.invalidate()
+
+
+def slot_number(menu, wanted):
+    """Number of `wanted` ('09:30') in the free slot list reply"""
+    match = re.search(rf'^(\d+)\. {wanted}$', menu, re.MULTILINE)
+    return match.group(1) if match else '1'
+
+
+def reply_text(xml):
+    node = ElementTree.fromstring(xml).find('Message')
+    return node.text if node is not None and node.text else ''
+
+
+def script(i):
+    """Messages of conversation i, each its own (day, time); the time is
+    picked from the previous reply"""
+    business_num = str(1 + [b['business_id'] for b in booking.get_all_businesses()].index(BUSINESS_ID))
+    day = (datetime.now() + timedelta(days=30 + i // len(SLOTS))).strftime('%d.%m.%Y')
+    wanted = SLOTS[i % len(SLOTS)]
+    return ['termin', business_num, 'termin', '1', day, lambda menu: slot_number(menu, wanted),
+            f'Bench {i}', '0911234567', 'DA']
+
+
+def outcome(text, outcomes):
+    if text.startswith('POTVRDJENO'):
+        outcomes['confirmed'] += 1
+    elif 'upravo zauzet' in text:
+        outcomes['slot_taken'] += 1
+    else:
+        outcomes['failed'] += 1
+
+
+def run_sync(conversations, concurrency, outcomes):
+    client = booking.app.test_client()
+    lock = threading.Lock()
+
+    def conversation(i):
+        text = ''
+        for body in script(i):
+            body = body(text) if callable(body) else body
+            text = reply_text(client.post('/webhook', data={'Body': body, 'From': f'whatsapp:+sync{i}'}).data)
+        with lock:
+            outcome(text, outcomes)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(conversation, range(conversations)))
+
+
+async def run_async(conversations, concurrency, outcomes):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def post(phone, body):
+        scope = {'type': 'http', 'path': '/webhook', 'method': 'POST'}
+        events = [{'type': 'http.request', 'body': urlencode({'Body': body, 'From': phone}).encode()}]
+        reply = []
+
+        async def receive():
+            return events.pop(0)
+
+        async def send(event):
+            if event['type'] == 'http.response.body':
+                reply.append(event['body'])
+
+        await asgi_app.application(scope, receive, send)
+        return reply_text(b''.join(reply))
+
+    async def conversation(i):
+        async with limit:
+            text = ''
+            for body in script(i):
+                text = await post(f'whatsapp:+async{i}', body(text) if callable(body) else body)
+            outcome(text, outcomes)
+
+    await asyncio.gather(*[conversation(i) for i in range(conversations)])
+
+
+def measure(name, run, conversations, concurrency):
+    # Both modes book the same slots
+    clear_bookings()
+    outcomes = {'confirmed': 0, 'slot_taken': 0, 'failed': 0}
+    tracemalloc.start()
+    start = time.perf_counter()
+    run(outcomes)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    requests = conversations * len(script(0))
+    return {
+        'mode': name,
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'peak_traced_bytes': peak,
+        'bytes_per_concurrent_conversation': peak // concurrency,
+        # Each concurrent sync conversation also pins one OS thread stack
+        'threads_used': concurrency if name == 'sync' else 1,
+        'thread_stack_bytes': threading.stack_size() or 8 * 1024 * 1024,
+        'reservations_saved': booking.reservations.count_documents({'business_id': BUSINESS_ID}),
+        # Lost the atomic slot claim / anything else - both should be 0
+        **outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async webhook throughput")
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory Mongo stand-in')
+    args = parser.parse_args()
+
+    global booking, asgi_app
+    if args.mongomock:
+        use_mongomock()
+    import app as booking
+    import asgi_app
+    if args.mongomock:
+        use_async_mongomock()
+
+    seed()
+    try:
+        results = [
+            measure('sync', lambda outcomes: run_sync(args.conversations, args.concurrency, outcomes),
+                    args.conversations, args.concurrency),
+            measure('async', lambda outcomes: asyncio.run(run_async(args.conversations, args.concurrency, outcomes)),
+                    args.conversations, args.concurrency),
+        ]
+    finally:
+        cleanup()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
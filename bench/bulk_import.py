@@ -0,0 +1,163 @@
+# bench/bulk_import.py - Bulk reservation import/export vs. one insert per row
+#
+# Writes --rows reservation rows for --businesses salons to a CSV file, then:
+#   per_row   one insert_one per row, as admin_save does for businesses
+#             (run on the first --per-row rows only - it is the slow one)
+#   bulk      transfer.import_rows(): validated, one bulk_write per --batch
+#   export    transfer.export_rows() back to CSV, with the peak Python
+#             memory it needed (tracemalloc) to show it does not grow
+#             with the row count (mongomock materialises the whole cursor
+#             itself, so there the peak does grow; against mongod it does not)
+#
+# mongomock has no network, so --rtt-ms adds a simulated round trip to
+# every write call; against a real mongod leave it at 0.
+#
+#   python bench/bulk_import.py --mongomock --rtt-ms 0.5
+#   MONGODB_URI=mongodb://localhost python bench/bulk_import.py --rows 100000
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import transfer  # noqa: E402
+
+
+class CountingCollection:
+    """Counts write round trips, optionally sleeping `rtt` seconds for each"""
+
+    def __init__(self, collection, rtt=0.0):
+        self.collection = collection
+        self.rtt = rtt
+        self.round_trips = 0
+
+    def insert_one(self, *args, **kwargs):
+        self.round_trips += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+        return self.collection.insert_one(*args, **kwargs)
+
+    def bulk_write(self, *args, **kwargs):
+        self.round_trips += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+        return self.collection.bulk_write(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class BenchDb:
+    """db[...] with the reservations collection counted"""
+
+    def __init__(self, db, reservations):
+        self.db = db
+        self.reservations = reservations
+
+    def __getitem__(self, name):
+        return self.reservations if name == 'reservations' else self.db[name]
+
+
+def write_rows(path, rows, businesses):
+    start = date.today()
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['business_id', 'service', 'date', 'time', 'client_name', 'client_phone', 'status'])
+        for i in range(rows):
+            writer.writerow([f'bench_{i % businesses}', 'Sisanje', (start + timedelta(days=i % 365)).isoformat(),
+                             f'{8 + i % 12:02d}:{(i // 12) % 2 * 30:02d}', f'Klijent {i}', f'09{i:08d}',
+                             'confirmed'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bulk reservation import and export')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--per-row', type=int, default=10000, help='rows for the insert_one baseline')
+    parser.add_argument('--businesses', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory Mongo stand-in')
+    parser.add_argument('--rtt-ms', type=float, default=0.0, help='simulated network round trip per write')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGODB_URI'))
+    db = client['booking_bench']
+    for name in ('clients', 'reservations', 'calendars'):
+        db[name].drop()
+    db['clients'].insert_many([{'business_id': f'bench_{i}', 'name': f'Salon {i}', 'phone': '01'}
+                               for i in range(args.businesses)])
+
+    path = os.path.join(tempfile.mkdtemp(), 'reservations.csv')
+    write_rows(path, args.rows, args.businesses)
+    results = {}
+    try:
+        # Baseline: validate like the bulk path, then one insert_one per row
+        counting = CountingCollection(db['reservations'], args.rtt_ms / 1000)
+        businesses = {doc['business_id']: doc for doc in db['clients'].find()}
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = transfer.read_rows(f, 'csv')
+            start = time.perf_counter()
+            inserted = 0
+            for _, row in rows:
+                if inserted >= args.per_row:
+                    break
+                counting.insert_one(transfer.clean_reservation(row, businesses))
+                inserted += 1
+            elapsed = time.perf_counter() - start
+        # The file may hold fewer than --per-row rows
+        results['per_row'] = {'rows': inserted, 'seconds': round(elapsed, 3),
+                              'rows_per_second': round(inserted / elapsed),
+                              'round_trips': counting.round_trips}
+        db['reservations'].delete_many({})
+
+        counting = CountingCollection(db['reservations'], args.rtt_ms / 1000)
+        with open(path, newline='', encoding='utf-8') as f:
+            start = time.perf_counter()
+            imported = transfer.import_rows(BenchDb(db, counting), 'reservations',
+                                            transfer.read_rows(f, 'csv'), args.batch)
+            elapsed = time.perf_counter() - start
+        results['bulk'] = {'rows': imported['rows'], 'inserted': imported['inserted'],
+                           'rejected': imported['rejected'], 'seconds': round(elapsed, 3),
+                           'rows_per_second': round(imported['rows'] / elapsed),
+                           'round_trips': counting.round_trips}
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = 0
+        exported = -1  # header
+        for chunk in transfer.export_rows(transfer.export_cursor(db, 'reservations', batch_size=args.batch),
+                                          'reservations', 'csv', args.batch):
+            size += len(chunk)
+            exported += chunk.count('\n')
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['export'] = {'rows': exported, 'megabytes': round(size / 1e6, 1), 'seconds': round(elapsed, 3),
+                             'rows_per_second': round(exported / elapsed),
+                             'peak_python_memory_mb': round(peak / 1e6, 1)}
+    finally:
+        os.remove(path)
+        for name in ('clients', 'reservations', 'calendars'):
+            db[name].drop()
+
+    print(json.dumps({
+        'backend': 'mongomock' if args.mongomock else 'mongod',
+        'batch': args.batch,
+        'rtt_ms': args.rtt_ms,
+        **results,
+        'bulk_speedup': round(results['bulk']['rows_per_second'] / results['per_row']['rows_per_second'], 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
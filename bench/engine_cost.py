@@ -0,0 +1,159 @@
+# bench/engine_cost.py - Per-message cost of the booking engine per config provider
+#
+# Runs --conversations complete bookings (one sender each, dates spread
+# over --days days) straight through BookingEngine.process_message with
+# in-memory sessions, once per provider:
+#   static   StaticProvider - one salon from a dict, local slot ledger,
+#            no database at all (reservations not stored)
+#   mongo    MongoProvider - --tenants salons in `clients`, calendars,
+#            reservations; caches warm as in a running app
+# and reports time and database operations per message.
+#
+#   python bench/engine_cost.py --mongomock
+#   MONGODB_URI=mongodb://localhost python bench/engine_cost.py
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from availability import AvailabilityIndex  # noqa: E402
+from calendars import SlotCalendar  # noqa: E402
+from catalog import BusinessCatalog  # noqa: E402
+from engine import BookingEngine  # noqa: E402
+from providers import MongoProvider, StaticProvider  # noqa: E402
+from session_store import MemorySessionStore  # noqa: E402
+
+SLOTS = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
+TENANT_PREFIX = 'bench_engine_'
+_current = threading.local()
+
+
+class OpCounter:
+    """Database operations, from a pymongo CommandListener or patched mongomock"""
+
+    def __init__(self):
+        self.ops = 0
+
+    def started(self, event):
+        self.ops += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def count_mongomock(counter):
+    import mongomock
+
+    for name in ('find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'delete_many',
+                 'aggregate', 'bulk_write', 'find_one_and_update'):
+        original = getattr(mongomock.collection.Collection, name)
+
+        def counted(self, *args, _original=original, **kwargs):
+            # mongomock builds some operations from others; count the outer call only
+            if getattr(_current, 'in_op', False):
+                return _original(self, *args, **kwargs)
+            counter.ops += 1
+            _current.in_op = True
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                _current.in_op = False
+
+        setattr(mongomock.collection.Collection, name, counted)
+
+
+def business(i):
+    return {'business_id': f'{TENANT_PREFIX}{i}', 'name': f'Salon {i}', 'city': 'Zagreb', 'address': 'Ilica 1',
+            'phone': '01', 'services': ['Sisanje', 'Farbanje'], 'working_hours': '08-20',
+            'available_slots': SLOTS, 'active': True}
+
+
+def conversation(days, n, multi_tenant, tenants):
+    day = (date.today() + timedelta(days=1 + n % days)).strftime('%d.%m.%Y')
+    pick = [str(1 + n % tenants)] if multi_tenant else []
+    return ['termin'] + pick + ['termin', '1', day, '1', 'Ana Anic', '091234567', 'da']
+
+
+def run(engine, counter, args, multi_tenant):
+    timings = []
+    ops = counter.ops
+    confirmed = 0
+    for n in range(args.conversations):
+        phone = f'whatsapp:+3859{n:08d}'
+        for message in conversation(args.days, n, multi_tenant, args.tenants):
+            start = time.perf_counter()
+            reply = engine.process_message(phone, message)
+            timings.append(time.perf_counter() - start)
+        confirmed += reply.startswith('POTVRDJENO')
+    timings.sort()
+    messages = len(timings)
+    return {
+        'messages': messages,
+        'confirmed': confirmed,
+        'us_per_message': round(sum(timings) / messages * 1e6, 1),
+        'p50_us': round(timings[messages // 2] * 1e6, 1),
+        'p99_us': round(timings[int(messages * 0.99)] * 1e6, 1),
+        'db_ops_per_message': round((counter.ops - ops) / messages, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-message cost of StaticProvider vs MongoProvider')
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--days', type=int, default=90, help='booking dates spread over this many days')
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory Mongo stand-in')
+    args = parser.parse_args()
+
+    counter = OpCounter()
+    if args.mongomock:
+        import mongomock
+        count_mongomock(counter)
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGODB_URI'), event_listeners=[counter])
+    db = client['booking_bench']
+    clients, reservations, calendar_days = db['clients'], db['reservations'], db['calendars']
+
+    def cleanup():
+        query = {'business_id': {'$regex': f'^{TENANT_PREFIX}'}}
+        for collection in (clients, reservations, calendar_days):
+            collection.delete_many(query)
+
+    cleanup()
+    clients.insert_many([business(i) for i in range(args.tenants)])
+    try:
+        static = BookingEngine(StaticProvider(business(0)), MemorySessionStore())
+        calendar = SlotCalendar(calendar_days, reservations)
+        catalog = BusinessCatalog(clients)
+        mongo = BookingEngine(
+            MongoProvider(catalog, AvailabilityIndex(calendar), calendar, reservations),
+            MemorySessionStore()
+        )
+        results = {
+            'static': run(static, counter, args, multi_tenant=False),
+            'mongo': run(mongo, counter, args, multi_tenant=True),
+        }
+    finally:
+        cleanup()
+
+    print(json.dumps({
+        'backend': 'mongomock' if args.mongomock else 'mongod',
+        'conversations': args.conversations,
+        'tenants': args.tenants,
+        **results,
+        'mongo_vs_static': round(results['mongo']['us_per_message'] / results['static']['us_per_message'], 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# bench/first_free.py - "Prvi slobodni" search: one range query vs per-date lookups
+#
+# Seeds one salon whose next --full-days days are fully booked and creates
+# its calendar days, then finds the first --count free slots in the next
+# --days days two ways, each starting from a cold availability index:
+#   per_date   one calendar lookup per day until enough slots are found
+#              (what a user guessing dates one message at a time costs us)
+#   range      AvailabilityIndex.first_free(): one query for the whole range
+#
+#   python bench/first_free.py --mongomock
+#   MONGODB_URI=mongodb://localhost python bench/first_free.py --full-days 10
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from availability import AvailabilityIndex  # noqa: E402
+from calendars import SlotCalendar  # noqa: E402
+
+SLOTS = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
+BUSINESS = {'business_id': 'bench_first_free', 'available_slots': SLOTS}
+
+
+class CountingCollection:
+    """Counts round trips made through find() and find_one()"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.round_trips = 0
+
+    def find(self, *args, **kwargs):
+        self.round_trips += 1
+        return list(self.collection.find(*args, **kwargs))
+
+    def find_one(self, *args, **kwargs):
+        self.round_trips += 1
+        return self.collection.find_one(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def seed(collection, calendar_days, full_days, days):
+    collection.delete_many({'business_id': BUSINESS['business_id']})
+    calendar_days.delete_many({'business_id': BUSINESS['business_id']})
+    start = date.today()
+    docs = []
+    for d in range(days):
+        day = (start + timedelta(days=d)).isoformat()
+        # Fully booked days, then every other slot taken
+        taken = SLOTS if d < full_days else SLOTS[::2]
+        docs.extend({'business_id': BUSINESS['business_id'], 'date': day, 'time': t,
+                     'status': 'confirmed'} for t in taken)
+    collection.insert_many(docs)
+
+
+def per_date(calendar, dates, count):
+    index = AvailabilityIndex(calendar)
+    free = []
+    for day in dates:
+        free.extend((day, slot) for slot in index.available(BUSINESS, day))
+        if len(free) >= count:
+            break
+    return free[:count]
+
+
+def range_query(calendar, dates, count):
+    return AvailabilityIndex(calendar).first_free(BUSINESS, dates, count)
+
+
+def measure(strategy, calendar_days, reservations, dates, count, repeat):
+    counting = CountingCollection(calendar_days)
+    calendar = SlotCalendar(counting, reservations)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = strategy(calendar, dates, count)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'found': len(result),
+        'first': list(result[0]) if result else None,
+        'round_trips': counting.round_trips // repeat,
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+    }, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the first free slot search')
+    parser.add_argument('--days', type=int, default=14, help='search window')
+    parser.add_argument('--full-days', type=int, default=7, help='fully booked days at the start')
+    parser.add_argument('--count', type=int, default=5, help='free slots to find')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory Mongo stand-in')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGODB_URI'))
+    collection = client['booking_bench']['reservations']
+    calendar_days = client['booking_bench']['calendars']
+
+    seed(collection, calendar_days, args.full_days, args.days)
+    dates = [(date.today() + timedelta(days=d)).isoformat() for d in range(args.days)]
+    SlotCalendar(calendar_days, collection).days(BUSINESS, dates)
+    try:
+        results = {}
+        answers = []
+        for name, strategy in (('per_date', per_date), ('range', range_query)):
+            results[name], answer = measure(strategy, calendar_days, collection, dates, args.count, args.repeat)
+            answers.append(answer)
+        if answers[0] != answers[1]:
+            raise SystemExit(f"Strategies disagree: {answers}")
+    finally:
+        collection.delete_many({'business_id': BUSINESS['business_id']})
+        calendar_days.delete_many({'business_id': BUSINESS['business_id']})
+
+    print(json.dumps({
+        'backend': 'mongomock' if args.mongomock else 'mongod',
+        'days': args.days,
+        'full_days': args.full_days,
+        'count': args.count,
+        **results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# bench/session_stress.py - Interleaved messages from many senders vs. session state
+#
+# Fires --messages messages for each of --senders phone numbers from a
+# pool of --threads threads, all interleaved. Each message runs the real
+# BookingEngine.process_message() (session load -> step -> save) with a
+# step that adds the message's number to the session, sleeping in between
+# to widen any race. Afterwards every session must hold exactly its sender's numbers,
+# no two messages of one sender may have overlapped, and different
+# senders must have overlapped.
+#
+#   python bench/session_stress.py --mongomock
+#   python bench/session_stress.py --mongomock --backend mongo
+#   python bench/session_stress.py --mongomock --backend mongo --stores 4   # 4 "processes"
+#   python bench/session_stress.py --mongomock --backend redis --fakeredis --stores 4
+#   python bench/session_stress.py --mongomock --no-lock      # shows the race
+#
+# Exits non-zero when a check fails.
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def use_mongomock():
+    import mongomock
+    import pymongo
+
+    shared = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: shared
+
+
+def use_fakeredis():
+    """Every Redis.from_url() connects to one in-memory server (needs fakeredis and lupa)"""
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+    redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server))
+
+
+class PerThreadStore:
+    """Spreads threads over several store instances, like gunicorn processes
+    sharing one database: only the backend's lease keeps them apart"""
+
+    def __init__(self, stores):
+        self.stores = stores
+
+    def __getattr__(self, name):
+        return getattr(self.stores[threading.get_ident() % len(self.stores)], name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress per-sender serialisation of session updates')
+    parser.add_argument('--senders', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20, help='messages per sender')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--step-ms', type=float, default=2.0, help='time spent inside a step')
+    parser.add_argument('--backend', default='memory', choices=['memory', 'mongo', 'redis'])
+    parser.add_argument('--stores', type=int, default=1, help='session store instances (mongo, redis)')
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory Mongo stand-in')
+    parser.add_argument('--fakeredis', action='store_true', help='use an in-memory Redis stand-in')
+    parser.add_argument('--no-lock', action='store_true', help='disable the sender lock')
+    args = parser.parse_args()
+
+    os.environ['SESSION_BACKEND'] = args.backend
+    if args.mongomock:
+        use_mongomock()
+    if args.fakeredis:
+        use_fakeredis()
+    import app as booking
+
+    # The engine holds its own reference to the store; swap that one
+    sessions = booking.engine.sessions
+    if args.stores > 1 and args.backend != 'memory':
+        from session_store import create_session_store
+        sessions = PerThreadStore([sessions] + [
+            create_session_store(args.backend, db=booking.db, ttl=sessions.ttl, redis_url=os.getenv('REDIS_URL'))
+            for _ in range(args.stores - 1)
+        ])
+
+    if args.no_lock:
+        sessions.lock = lambda phone_number: contextlib.nullcontext()
+    booking.engine.sessions = sessions
+
+    active = defaultdict(int)
+    active_lock = threading.Lock()
+    overlaps = {'same_sender': 0, 'max_parallel': 0}
+    running = [0]
+
+    def counting_step(session, phone_number, message, to_number=None):
+        with active_lock:
+            active[phone_number] += 1
+            running[0] += 1
+            if active[phone_number] > 1:
+                overlaps['same_sender'] += 1
+            overlaps['max_parallel'] = max(overlaps['max_parallel'], running[0])
+        try:
+            seen = session['data'].get('seen', [])
+            time.sleep(args.step_ms / 1000 * random.random())
+            session['data']['seen'] = seen + [int(message)]
+            return 'ok'
+        finally:
+            with active_lock:
+                active[phone_number] -= 1
+                running[0] -= 1
+
+    booking.engine.handle_step = counting_step
+    phones = [f'whatsapp:+3859900{i:05d}' for i in range(args.senders)]
+    for phone in phones:
+        sessions.delete(phone)
+
+    # Round-robin over senders so each sender's messages are interleaved with everyone's
+    work = [(phone, n) for n in range(args.messages) for phone in phones]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(lambda item: booking.process_message(item[0], str(item[1])), work))
+    elapsed = time.perf_counter() - start
+
+    lost = {}
+    for phone in phones:
+        seen = (sessions.load(phone) or {}).get('data', {}).get('seen', [])
+        if sorted(seen) != list(range(args.messages)):
+            lost[phone] = args.messages - len(seen)
+        sessions.delete(phone)
+
+    result = {
+        'backend': args.backend,
+        'locked': not args.no_lock,
+        'stores': len(sessions.stores) if isinstance(sessions, PerThreadStore) else 1,
+        'senders': args.senders,
+        'messages': len(work),
+        'threads': args.threads,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(len(work) / elapsed, 1),
+        'sessions_with_lost_updates': len(lost),
+        'lost_updates': sum(lost.values()),
+        'same_sender_overlaps': overlaps['same_sender'],
+        'max_parallel_steps': overlaps['max_parallel'],
+        # Every session was deleted above
+        'sessions_left': sessions.count(),
+    }
+    print(json.dumps(result, indent=2))
+
+    failed = (lost or overlaps['same_sender'] or result['sessions_left']
+              or (args.threads > 1 and overlaps['max_parallel'] < 2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
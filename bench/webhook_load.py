@@ -0,0 +1,295 @@
+# bench/webhook_load.py - End-to-end load test of the /webhook conversation flow
+#
+# Runs complete select_business -> confirm bookings for many concurrent
+# phone numbers spread over several synthetic tenants and reports
+# throughput, p50/p95/p99 latency and database operations per step.
+# Every conversation books its own (tenant, day, time), so confirms only
+# fail when something is wrong; failed ones are counted, not hidden.
+#
+#   python bench/webhook_load.py --tenants 20 --conversations 1000 --concurrency 50
+#   python bench/webhook_load.py --mongomock            # no mongod needed
+#   python bench/webhook_load.py --url http://localhost:5000/webhook
+#   python bench/webhook_load.py --mongomock --routed   # salons on their own numbers
+#
+# With --url the tenants are seeded through MONGODB_URI; the server only
+# sees them once its catalog reloads (change stream or CATALOG_TTL).
+#
+# Results are printed and, with --out, written as JSON for comparison
+# between releases.
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+STEPS = ['select_business', 'select_business', 'initial', 'service', 'date',
+         'time', 'name', 'phone', 'confirm']
+# With --routed the To number picks the salon, so the first message opens the service list
+ROUTED_STEPS = ['initial', 'service', 'date', 'time', 'name', 'phone', 'confirm']
+SLOTS = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
+TENANT_PREFIX = 'bench_tenant_'
+
+_current = threading.local()
+
+
+class OpCounter:
+    """Counts database operations per conversation step, per thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = defaultdict(int)
+
+    def hit(self):
+        step = getattr(_current, 'step', None)
+        if step:
+            with self.lock:
+                self.ops[step] += 1
+
+    # pymongo CommandListener interface
+    def started(self, event):
+        self.hit()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def use_mongomock(counter):
+    """Replace MongoClient with an in-memory stand-in before app is imported"""
+    import mongomock
+    import pymongo
+
+    for name in ('find', 'find_one', 'insert_one', 'insert_many', 'replace_one', 'update_one',
+                 'delete_one', 'delete_many', 'aggregate', 'count_documents', 'bulk_write',
+                 'find_one_and_update'):
+        original = getattr(mongomock.collection.Collection, name)
+
+        def counted(self, *args, _original=original, **kwargs):
+            # mongomock builds some operations from others; count the outer call only
+            if getattr(_current, 'in_op', False):
+                return _original(self, *args, **kwargs)
+            counter.hit()
+            _current.in_op = True
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                _current.in_op = False
+
+        setattr(mongomock.collection.Collection, name, counted)
+
+    shared = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: shared
+
+
+def tenant_number(i):
+    return f'whatsapp:+3851{i:08d}'
+
+
+def seed(booking, tenants):
+    # Leftovers of an interrupted run would make slots look taken
+    cleanup(booking)
+    booking.clients_db.insert_many([{
+        'business_id': f'{TENANT_PREFIX}{i}',
+        'name': f'Bench Tenant {i}',
+        'city': 'Zagreb',
+        'address': f'Ilica {i}',
+        'phone': '0910000000',
+        'email': None,
+        'services': ['Sisanje', 'Farbanje', 'Feniranje'],
+        'working_hours': '08:00-20:00',
+        'available_slots': SLOTS,
+        'active': True,
+        'whatsapp_number': tenant_number(i)[len('whatsapp:'):],
+        'created_at': datetime.utcnow()
+    } for i in range(tenants)])
+    booking.catalog.invalidate()
+
+
+def cleanup(booking):
+    tenant_filter = {'business_id': {'$regex': f'^{TENANT_PREFIX}'}}
+    for doc in booking.clients_db.find(tenant_filter, {'business_id': 1}):
+        booking.availability.drop_business(doc['business_id'])
+    booking.reservations.delete_many(tenant_filter)
+    booking.calendar_days.delete_many(tenant_filter)
+    booking.clients_db.delete_many(tenant_filter)
+    booking.catalog.invalidate()
+
+
+def flask_driver(booking):
+    client = booking.app.test_client()
+
+    def post(phone, body, to=''):
+        return client.post('/webhook', data={'Body': body, 'From': phone, 'To': to}).data
+
+    return post
+
+
+def http_driver(url):
+    def post(phone, body, to=''):
+        with urlopen(url, data=urlencode({'Body': body, 'From': phone, 'To': to}).encode(), timeout=30) as resp:
+            return resp.read()
+
+    return post
+
+
+def reply_text(xml):
+    node = ElementTree.fromstring(xml).find('Message')
+    return node.text if node is not None and node.text else ''
+
+
+def business_number(menu, tenant):
+    """Find 'N. Bench Tenant k - City' in the business list reply"""
+    match = re.search(rf'^(\d+)\. Bench Tenant {tenant} ', menu, re.MULTILINE)
+    return match.group(1) if match else '1'
+
+
+def slot_number(menu, wanted):
+    """Number of `wanted` ('09:30') in the free slot list reply"""
+    match = re.search(rf'^(\d+)\. {wanted}$', menu, re.MULTILINE)
+    return match.group(1) if match else '1'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 3)
+
+
+def run(post, conversations, concurrency, tenants, routed=False):
+    latencies = defaultdict(list)
+    lock = threading.Lock()
+    outcomes = defaultdict(int)
+
+    def timed(phone, body, step, to=''):
+        _current.step = step
+        start = time.perf_counter()
+        try:
+            text = reply_text(post(phone, body, to))
+        finally:
+            _current.step = None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies[step].append(elapsed)
+        return text
+
+    def conversation(i):
+        tenant = i % tenants
+        phone = f'whatsapp:+385{i:09d}'
+        # Conversations of one tenant walk its slots, then the next day
+        n = i // tenants
+        day = (date.today() + timedelta(days=1 + n // len(SLOTS))).strftime('%d.%m.%Y')
+        wanted = SLOTS[n % len(SLOTS)]
+        if routed:
+            to, steps, bodies = tenant_number(tenant), ROUTED_STEPS, ['termin']
+        else:
+            to, steps, bodies = '', STEPS, ['termin', lambda menu: business_number(menu, tenant), 'termin']
+        bodies += [str(1 + i % 3), day, lambda menu: slot_number(menu, wanted), f'Bench {i}', '0911234567', 'DA']
+        text = ''
+        for body, step in zip(bodies, steps):
+            text = timed(phone, body(text) if callable(body) else body, step, to)
+        if text.startswith('POTVRDJENO'):
+            outcome = 'confirmed'
+        elif 'upravo zauzet' in text:
+            outcome = 'slot_taken'
+        else:
+            outcome = 'failed'
+        with lock:
+            outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(conversation, range(conversations)))
+    return time.perf_counter() - start, latencies, outcomes
+
+
+def report(elapsed, latencies, outcomes, counter, args):
+    messages = sum(len(v) for v in latencies.values())
+    steps = {}
+    for step in dict.fromkeys(STEPS):
+        values = sorted(latencies[step])
+        steps[step] = {
+            'messages': len(values),
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+            'db_ops_per_message': round(counter.ops[step] / len(values), 3) if counter and values else None,
+        }
+    everything = sorted(v for values in latencies.values() for v in values)
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'driver': 'http' if args.url else 'flask',
+        'backend': 'mongomock' if args.mongomock else ('remote' if args.url else 'mongod'),
+        'tenants': args.tenants,
+        'conversations': args.conversations,
+        'concurrency': args.concurrency,
+        'routed': args.routed,
+        'messages_per_booking': round(messages / args.conversations, 2),
+        'confirmed': outcomes['confirmed'],
+        # Lost the atomic slot claim / anything else - both should be 0
+        'slot_taken': outcomes['slot_taken'],
+        'failed': outcomes['failed'],
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(messages / elapsed, 1),
+        'p50_ms': percentile(everything, 50),
+        'p95_ms': percentile(everything, 95),
+        'p99_ms': percentile(everything, 99),
+        'db_ops_per_message': round(sum(counter.ops.values()) / messages, 3) if counter else None,
+        'steps': steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the /webhook conversation flow')
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--conversations', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory Mongo stand-in')
+    parser.add_argument('--url', help='drive a running server over HTTP instead of the test client')
+    parser.add_argument('--routed', action='store_true', help='route by the salon WhatsApp number (To)')
+    parser.add_argument('--out', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    counter = None
+    if args.url:
+        # Still needs MONGODB_URI to seed the tenants the server will see
+        import app as booking
+        post = http_driver(args.url)
+    else:
+        counter = OpCounter()
+        if args.mongomock:
+            use_mongomock(counter)
+        else:
+            from pymongo import monitoring
+            monitoring.register(counter)
+        import app as booking
+        post = flask_driver(booking)
+
+    seed(booking, args.tenants)
+    try:
+        elapsed, latencies, outcomes = run(post, args.conversations, args.concurrency, args.tenants, args.routed)
+    finally:
+        cleanup(booking)
+
+    result = report(elapsed, latencies, outcomes, counter, args)
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
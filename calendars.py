@@ -0,0 +1,187 @@
+# calendars.py - Per-day slot calendars with atomic claims
+#
+# One document per (business_id, date):
+#   {'_id': 'salon_x|2025-03-14', 'business_id': ..., 'date': ...,
+#    'capacity': {'09:00': 2, ...}, 'free': {'09:00': 1, ...}}
+#
+# A booking claims a slot with a single conditional $inc on `free`, so two
+# users can never take the last chair at the same time. Days are created
+# on first use from the reservations that already exist for them. Slot
+# names become field names through slot_field(), which escapes the
+# characters MongoDB reads as path separators or operators.
+import logging
+from collections import Counter
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ['confirmed', 'pending']
+
+
+class SlotTaken(Exception):
+    """The slot was claimed by someone else (or is not offered at all)"""
+
+
+def day_key(business_id, date_str):
+    return f"{business_id}|{date_str}"
+
+
+def slot_field(time_str):
+    """Field name of a slot in a day's `capacity` and `free` ('09:00' stays '09:00')"""
+    return time_str.replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+
+def slot_capacity(business):
+    """Bookings per slot: business 'capacity' (chairs or staff, default 1),
+    overridden per time by 'slot_capacity'"""
+    default = int(business.get('capacity') or 1)
+    overrides = business.get('slot_capacity') or {}
+    return {slot: int(overrides.get(slot, default)) for slot in business.get('available_slots', [])}
+
+
+def booked_query(business_id, date_str):
+    """Filter and projection for the booked times of one day in reservations"""
+    return {
+        'business_id': business_id,
+        'date': date_str,
+        'status': {'$in': ACTIVE_STATUSES}
+    }, {'time': 1, '_id': 0}
+
+
+def booked_pipeline(business_id, date_from, date_to):
+    """Aggregation: booked times per day over an inclusive date range"""
+    return [
+        {'$match': {
+            'business_id': business_id,
+            'date': {'$gte': date_from, '$lte': date_to},
+            'status': {'$in': ACTIVE_STATUSES}
+        }},
+        {'$group': {'_id': '$date', 'times': {'$push': '$time'}}}
+    ]
+
+
+def new_day(business, date_str, booked_times):
+    """Calendar document for a day that already has these bookings"""
+    capacity = slot_capacity(business)
+    taken = Counter(booked_times)
+    return {
+        '_id': day_key(business['business_id'], date_str),
+        'business_id': business['business_id'],
+        'date': date_str,
+        'capacity': {slot_field(slot): cap for slot, cap in capacity.items()},
+        'free': {slot_field(slot): max(0, cap - taken[slot]) for slot, cap in capacity.items()},
+    }
+
+
+def days_from_groups(business, dates, groups):
+    """new_day() for each date, from the documents returned by booked_pipeline()"""
+    booked = {group['_id']: group['times'] for group in groups}
+    return [new_day(business, d, booked.get(d, ())) for d in dates]
+
+
+def free_count(business, day, slot):
+    """Free places in a slot; slots added to the business after the day
+    document was created count with their full capacity"""
+    free = day['free'].get(slot_field(slot))
+    if free is None:
+        return slot_capacity(business).get(slot, 0)
+    return free
+
+
+def claim_update(business_id, date_str, time_str):
+    """(filter, update) taking one place in a slot, matching only while one is free"""
+    field = 'free.' + slot_field(time_str)
+    return ({'_id': day_key(business_id, date_str), field: {'$gt': 0}},
+            {'$inc': {field: -1}})
+
+
+def release_update(business_id, date_str, time_str):
+    """(filter, update) giving a place back"""
+    field = 'free.' + slot_field(time_str)
+    return ({'_id': day_key(business_id, date_str), field: {'$exists': True}},
+            {'$inc': {field: 1}})
+
+
+class SlotCalendar:
+    """Day documents in `collection`, seeded from `reservations`"""
+
+    def __init__(self, collection, reservations):
+        self.collection = collection
+        self.reservations = reservations
+
+    def day(self, business, date_str):
+        """The day's document, created from existing reservations if missing"""
+        key = day_key(business['business_id'], date_str)
+        doc = self.collection.find_one({'_id': key})
+        if doc is not None:
+            return doc
+        query, projection = booked_query(business['business_id'], date_str)
+        doc = new_day(business, date_str, [r.get('time') for r in self.reservations.find(query, projection)])
+        try:
+            self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            # Created by another worker in the meantime
+            doc = self.collection.find_one({'_id': key})
+        return doc
+
+    def days(self, business, dates):
+        """{date: document} for ascending dates, creating the missing ones together"""
+        found = {doc['date']: doc for doc in self.collection.find({
+            'business_id': business['business_id'],
+            'date': {'$gte': dates[0], '$lte': dates[-1]}
+        })}
+        missing = [d for d in dates if d not in found]
+        if missing:
+            pipeline = booked_pipeline(business['business_id'], missing[0], missing[-1])
+            docs = days_from_groups(business, missing, self.reservations.aggregate(pipeline))
+            try:
+                self.collection.insert_many(docs, ordered=False)
+            except BulkWriteError:
+                # Some days were created concurrently - use the stored versions
+                docs = self.collection.find({'_id': {'$in': [doc['_id'] for doc in docs]}})
+            found.update((doc['date'], doc) for doc in docs)
+        return {d: found[d] for d in dates}
+
+    def claim(self, business, date_str, time_str):
+        """Take one place in a slot; returns the updated day or raises SlotTaken"""
+        if time_str not in slot_capacity(business):
+            raise SlotTaken(time_str)
+        query, update = claim_update(business['business_id'], date_str, time_str)
+        day = self.collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if day is None:
+            # Day not created yet, or the slot was added to the business later
+            self.add_slot(business, self.day(business, date_str), time_str)
+            day = self.collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if day is None:
+            raise SlotTaken(time_str)
+        return day
+
+    def add_slot(self, business, day, time_str):
+        """Bring a day document up to date with a slot it does not have yet"""
+        field = slot_field(time_str)
+        if field in day['capacity']:
+            return
+        query, projection = booked_query(business['business_id'], day['date'])
+        query['time'] = time_str
+        taken = self.reservations.count_documents(query)
+        capacity = slot_capacity(business)[time_str]
+        self.collection.update_one(
+            {'_id': day['_id'], f'capacity.{field}': {'$exists': False}},
+            {'$set': {f'capacity.{field}': capacity, f'free.{field}': max(0, capacity - taken)}}
+        )
+
+    def release(self, business_id, date_str, time_str):
+        """Give a claimed place back (cancelled or failed reservation)"""
+        query, update = release_update(business_id, date_str, time_str)
+        return self.collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+
+    def drop_business(self, business_id, from_date=None):
+        """Delete the business's days (from `from_date` on); a day still in
+        use is rebuilt from reservations, with the current capacity, when
+        next read"""
+        query = {'business_id': business_id}
+        if from_date:
+            query['date'] = {'$gte': from_date}
+        self.collection.delete_many(query)
@@ -0,0 +1,155 @@
+# catalog.py - In-process cache of business configurations
+import hashlib
+import logging
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from prefetch import CacheMiss, cache_only
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_number(number):
+    """'whatsapp:+385 91 123' -> '+38591123' (None for empty input)"""
+    if not number:
+        return None
+    number = number.replace('whatsapp:', '')
+    digits = ''.join(c for c in number if c.isdigit())
+    return '+' + digits if digits else None
+
+
+# Words the bot reacts to (engine.py matches most of them anywhere in a
+# message); a deep-link code containing one would swallow ordinary replies
+CODE_KEYWORDS = ('rezerv', 'termin', 'slobod', 'radno')
+RESERVED_CODES = {'start', 'da', 'ne'}
+CODE_PUNCTUATION = '#.,:;!?'
+
+
+def valid_code(code):
+    """A deep-link code is one word that is not a number or a bot keyword"""
+    code = (code or '').strip().lower()
+    return bool(code) and len(code.split()) == 1 and code.strip(CODE_PUNCTUATION) == code \
+        and not code.isdigit() and code not in RESERVED_CODES \
+        and not any(keyword in code for keyword in CODE_KEYWORDS)
+
+
+class BusinessCatalog:
+    """Snapshot of the clients collection, reloaded on TTL expiry or invalidation.
+
+    Readers always get an immutable tuple snapshot, so the numbered business
+    list shown to a user stays the same between their messages even if the
+    catalog is reloaded in between (new businesses are appended at the end).
+    """
+
+    def __init__(self, collection, ttl=300):
+        self.collection = collection
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._by_id = {}
+        self._by_number = {}
+        self._by_code = {}
+        self._loaded_at = 0.0
+        self._invalidations = 0
+        self._watcher = None
+        self.version = 0
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self):
+        return self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def _ensure_loaded(self):
+        """The current snapshot, reloading it first if stale"""
+        if self._is_fresh():
+            # Never None once loaded - invalidate() only marks it stale
+            self.hits += 1
+            return self._snapshot
+        self.misses += 1
+        if cache_only.get():
+            raise CacheMiss('catalog')
+        with self._lock:
+            if not self._is_fresh():
+                invalidations = self._invalidations
+                self.load(self.collection.find({}).sort('_id', 1))
+                if self._invalidations != invalidations:
+                    # Changed while we were reading; the next access reloads
+                    self._loaded_at = float('-inf')
+            return self._snapshot
+
+    def load(self, docs):
+        """Replace the snapshot with the given business documents"""
+        snapshot = tuple(docs)
+        self._by_id = {doc['business_id']: doc for doc in snapshot}
+        # Routing table: a salon's own WhatsApp number, or a deep-link code.
+        # A number shared by several businesses routes nowhere.
+        by_number = {}
+        for doc in snapshot:
+            number = normalize_number(doc.get('whatsapp_number'))
+            if number:
+                by_number.setdefault(number, []).append(doc)
+        self._by_number = {n: docs[0] for n, docs in by_number.items() if len(docs) == 1}
+        # Codes saved before they were validated may clash with the bot's words
+        self._by_code = {doc['code'].lower(): doc for doc in snapshot if valid_code(doc.get('code'))}
+        self._snapshot = snapshot
+        self._loaded_at = time.monotonic()
+        self.version += 1
+        # Same contents -> same fingerprint in every process (used in ETags)
+        self.fingerprint = hashlib.sha1(repr(snapshot).encode()).hexdigest()
+        logger.info("Catalog loaded %d businesses (v%d)", len(snapshot), self.version)
+        if logger.isEnabledFor(logging.DEBUG):
+            for doc in snapshot:
+                logger.debug("  - %s (active: %s)", doc.get('name'), doc.get('active'))
+
+    def all(self):
+        """All businesses, in stable insertion order"""
+        return self._ensure_loaded()
+
+    def get(self, business_id):
+        """Business config by id, or None"""
+        self._ensure_loaded()
+        return self._by_id.get(business_id)
+
+    def route(self, to_number, message=''):
+        """Business a conversation belongs to, from the number the user wrote
+        to or a code opening their message; None if it has to be chosen"""
+        self._ensure_loaded()
+        business = self._by_number.get(normalize_number(to_number))
+        words = message.lower().split()
+        if business is None and self._by_code and words:
+            business = self._by_code.get(words[0].strip(CODE_PUNCTUATION))
+        return business
+
+    def invalidate(self):
+        """Force a reload on next access; readers keep the old snapshot until then"""
+        self._invalidations += 1
+        self._loaded_at = float('-inf')
+
+    def watch(self):
+        """Invalidate on every clients change, if change streams are available"""
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, name='catalog-watch', daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            try:
+                with self.collection.watch() as stream:
+                    # Anything may have changed while we were not watching
+                    self.invalidate()
+                    for _ in stream:
+                        self.invalidate()
+            except OperationFailure as e:
+                # Standalone mongod - no change streams, rely on TTL
+                logger.info("Catalog change stream unavailable: %s", e)
+                return
+            except PyMongoError as e:
+                logger.warning("Catalog change stream error: %s", e)
+                time.sleep(5)
+            except Exception as e:
+                logger.info("Catalog change stream unsupported: %s", e)
+                return
@@ -0,0 +1,209 @@
+# database.py - MongoDB clients per process, created on first use
+#
+# A MongoClient owns sockets and monitor threads, so one made before a
+# fork (gunicorn --preload) must not be used in the children. LazyClient
+# builds the client on first use and again in every forked child;
+# database and collection handles from it are proxies that resolve to
+# the current process's client, so modules can keep holding
+# `db['reservations']` from import time.
+#
+# Client options come from MONGO_* environment variables (client_options),
+# warm_up() opens the pool before a worker takes traffic and Readiness
+# answers /health/ready from a cached ping.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from pymongo.errors import ConfigurationError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Environment variable -> MongoClient option (integers)
+INT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+READ_PREFERENCES = ('primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest')
+
+
+def client_options(env=None):
+    """MongoClient keyword arguments from MONGO_* environment variables.
+
+    MONGO_COMPRESSORS      e.g. "zstd,snappy,zlib" - the server picks the
+                           first it supports (zstd/snappy need their packages)
+    MONGO_READ_PREFERENCE  primary (default) ... nearest; slot claims and
+                           inserts always go to the primary
+    """
+    env = os.environ if env is None else env
+    options = {}
+    for var, option in INT_OPTIONS.items():
+        if env.get(var):
+            options[option] = int(env[var])
+    if env.get('MONGO_COMPRESSORS'):
+        options['compressors'] = env['MONGO_COMPRESSORS']
+    if env.get('MONGO_READ_PREFERENCE'):
+        if env['MONGO_READ_PREFERENCE'] not in READ_PREFERENCES:
+            raise ConfigurationError(f"MONGO_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCES)}")
+        options['readPreference'] = env['MONGO_READ_PREFERENCE']
+    if env.get('MONGO_APP_NAME'):
+        options['appname'] = env['MONGO_APP_NAME']
+    return options
+
+
+class LazyClient:
+    """One MongoClient per process, made on first use and again after fork"""
+
+    def __init__(self, uri=None, **options):
+        self.uri = uri
+        self.options = options
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent's client stays with the parent; the lock may have been
+        # held by a thread that does not exist here
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+
+    def get(self):
+        """The MongoClient of this process"""
+        client = self._client
+        if client is not None and self._pid == os.getpid():
+            return client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = pymongo.MongoClient(self.uri, **self.options)
+                self._pid = os.getpid()
+                logger.info("MongoDB client created",
+                            extra={'pid': self._pid, 'max_pool_size': self.options.get('maxPoolSize', 100)})
+            return self._client
+
+    @property
+    def connected(self):
+        """True once this process has a client"""
+        return self._client is not None and self._pid == os.getpid()
+
+    def __getitem__(self, name):
+        return LazyDatabase(self, name)
+
+    def ping(self):
+        """Round trip to the server in milliseconds"""
+        start = time.perf_counter()
+        self.get().admin.command('ping')
+        return (time.perf_counter() - start) * 1000
+
+    def warm_up(self, connections=None):
+        """Connect and open `connections` pooled sockets (default minPoolSize).
+
+        Concurrent pings each check out their own socket, so the pool holds
+        that many when this returns. Returns the first ping in milliseconds.
+        """
+        first = self.ping()
+        connections = self.options.get('minPoolSize', 1) if connections is None else connections
+        if connections > 1:
+            with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='mongo-warm-up') as pool:
+                list(pool.map(lambda _: self.ping(), range(connections)))
+        return first
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+
+
+class LazyDatabase:
+    """Database handle that resolves to the current process's client"""
+
+    def __init__(self, lazy, name):
+        self.lazy = lazy
+        self.name = name
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+    def __getattr__(self, attr):
+        return getattr(self.lazy.get()[self.name], attr)
+
+
+class LazyCollection:
+    """Collection handle that resolves to the current process's client"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._client = None
+        self._collection = None
+
+    def _target(self):
+        client = self.database.lazy.get()
+        if client is not self._client:
+            self._collection = client[self.database.name][self.name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+
+
+class Readiness:
+    """Readiness from a MongoDB ping, cached for `ttl` seconds.
+
+    Probes arriving while a ping is running get the previous answer, so a
+    slow database costs at most one thread at a time.
+    """
+
+    def __init__(self, lazy, ttl=5.0, timeout=2.0):
+        self.lazy = lazy
+        self.ttl = ttl
+        self.timeout = timeout
+        self.warm = False
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked = 0.0
+
+    def check(self):
+        """{'status': 'ready'|'unavailable', 'mongo_ping_ms', ...} and whether it is ready"""
+        if self._stale():
+            if self._lock.acquire(blocking=self._result is None):
+                try:
+                    if self._stale():
+                        self._result = self._ping()
+                        self._checked = time.monotonic()
+                finally:
+                    self._lock.release()
+        result = self._result
+        return dict(result, warm=self.warm, age_s=round(time.monotonic() - self._checked, 1)), \
+            result['status'] == 'ready'
+
+    def _stale(self):
+        return self._result is None or time.monotonic() - self._checked >= self.ttl
+
+    def _ping(self):
+        try:
+            with pymongo.timeout(self.timeout):
+                ping_ms = self.lazy.ping()
+        except PyMongoError as e:
+            logger.warning("Readiness ping failed: %s", e)
+            return {'status': 'unavailable', 'mongo_ping_ms': None, 'error': type(e).__name__}
+        return {'status': 'ready', 'mongo_ping_ms': round(ping_ms, 2)}
+
+
+def connect(uri=None, event_listeners=None):
+    """LazyClient for `uri` (default MONGODB_URI) with options from the environment"""
+    options = client_options()
+    if event_listeners:
+        options['event_listeners'] = event_listeners
+    return LazyClient(uri or os.getenv('MONGODB_URI'), **options)
@@ -0,0 +1,83 @@
+# dates.py - Parsing user-typed dates into canonical keys
+#
+# Reservations store dates as ISO keys ('2025-01-05'), which sort and
+# range-scan correctly; users see them as '05.01.2025'.
+import re
+from datetime import date, datetime, timedelta
+
+DATE_RE = re.compile(r'^(\d{1,2})\s*[./-]\s*(\d{1,2})(?:\s*[./-]\s*(\d{4}|\d{2}))?\.?$')
+
+# A year-less date at most this many days back is a date in the past (the
+# caller rejects it), not the same day next year
+PAST_GRACE_DAYS = 31
+
+RELATIVE_DAYS = {
+    'danas': 0,
+    'sutra': 1,
+    'prekosutra': 2,
+}
+
+WEEKDAYS = {
+    'ponedjeljak': 0, 'pon': 0,
+    'utorak': 1, 'uto': 1,
+    'srijeda': 2, 'srijedu': 2, 'sri': 2,
+    'četvrtak': 3, 'cetvrtak': 3, 'čet': 3, 'cet': 3,
+    'petak': 4, 'pet': 4,
+    'subota': 5, 'subotu': 5, 'sub': 5,
+    'nedjelja': 6, 'nedjelju': 6, 'ned': 6,
+}
+
+
+def parse_date(text, today=None, past_grace_days=PAST_GRACE_DAYS):
+    """Turn 'dd.mm[.yyyy]', 'danas', 'sutra', 'prekosutra' or a weekday
+    name into a date, or None if the text is not a valid date.
+
+    Without a year the next occurrence of that day is used, unless it
+    was at most `past_grace_days` ago - then the past date is returned. A
+    weekday means its next occurrence, today included.
+    """
+    today = today or date.today()
+    msg = text.lower().strip()
+    if msg.startswith('u '):
+        msg = msg[2:].strip()
+
+    if msg in RELATIVE_DAYS:
+        return today + timedelta(days=RELATIVE_DAYS[msg])
+    if msg in WEEKDAYS:
+        return today + timedelta(days=(WEEKDAYS[msg] - today.weekday()) % 7)
+
+    match = DATE_RE.match(msg)
+    if not match:
+        return None
+    day, month, year = match.groups()
+    try:
+        if year:
+            year = int(year)
+            return date(year + 2000 if year < 100 else year, int(month), int(day))
+        grace = timedelta(days=past_grace_days)
+        parsed = date(today.year, int(month), int(day))
+        if parsed < today:
+            return parsed if today - parsed <= grace else date(today.year + 1, int(month), int(day))
+        # Early January: '30.12.' is last week, not the end of this year
+        if today.month == 1 and int(month) == 12 and today - date(today.year - 1, 12, int(day)) <= grace:
+            return date(today.year - 1, 12, int(day))
+        return parsed
+    except ValueError:
+        return None
+
+
+def to_key(d):
+    """Storage key for a date"""
+    return d.isoformat()
+
+
+def today_key():
+    return date.today().isoformat()
+
+
+def format_key(key):
+    """'2025-01-05' -> '05.01.2025'; anything else is returned unchanged"""
+    try:
+        return datetime.strptime(key, '%Y-%m-%d').strftime('%d.%m.%Y')
+    except (TypeError, ValueError):
+        return key
@@ -0,0 +1,252 @@
+# engine.py - The booking conversation, shared by every deployment
+#
+# BookingEngine runs one message through a sender's session. Where the
+# businesses, their free slots and new reservations live is up to the
+# config provider (providers.py): MongoProvider for the multi-tenant app,
+# StaticProvider for a single salon with no database lookups.
+import logging
+from datetime import datetime, timedelta
+
+import metrics
+from calendars import SlotTaken
+from dates import parse_date, to_key, today_key, format_key
+from rendering import MenuTexts, slot_menu
+
+logger = logging.getLogger(__name__)
+
+
+def slot_taken_message(time_str):
+    return f"Termin {time_str} je upravo zauzet!\n\nOdaberite drugi termin. Napisite 'termin'."
+
+
+class BookingEngine:
+    """Conversation steps over a config provider and a session store"""
+
+    def __init__(self, provider, sessions, first_free_count=5, first_free_days=14):
+        self.provider = provider
+        self.sessions = sessions
+        self.menus = MenuTexts(provider)
+        # "prvi slobodni" - how many free slots to offer, and how far ahead to look
+        self.first_free_count = first_free_count
+        self.first_free_days = first_free_days
+
+    def new_session(self):
+        """Session for a phone number we have not seen yet"""
+        business = self.provider.default_business()
+        if business:
+            # Single salon: nothing to choose
+            return {'step': 'initial', 'data': {'business_name': business['name']},
+                    'business_id': business['business_id']}
+        return {'step': 'select_business', 'data': {}, 'business_id': None}
+
+    def get_user_session(self, phone_number):
+        """Get or create user session"""
+        session = self.sessions.load(phone_number)
+        if session is None:
+            session = self.new_session()
+        return session
+
+    def process_message(self, phone_number, message, to_number=None):
+        """Load the session, run one bot step and store the session once.
+
+        Messages from the same number are serialised by the session store's
+        lock, so threaded workers can handle different senders in parallel.
+        """
+        with self.sessions.lock(phone_number):
+            session = self.get_user_session(phone_number)
+            metrics.set_step(session['step'])
+            try:
+                return self.handle_step(session, phone_number, message, to_number)
+            finally:
+                self.sessions.save(phone_number, session)
+
+    def first_free_slots(self, business):
+        """First free (date, time) pairs from now over the next first_free_days days"""
+        now = datetime.now()
+        start = now.date()
+        dates = [(start + timedelta(days=i)).isoformat() for i in range(self.first_free_days)]
+        return self.provider.first_free(business, dates, self.first_free_count,
+                                        not_before=(dates[0], now.strftime('%H:%M')))
+
+    def handle_step(self, session, phone_number, message, to_number=None):
+        """Main bot logic"""
+        provider = self.provider
+        menus = self.menus
+        step = session['step']
+        data = session['data']
+        msg = message.lower().strip()
+
+        logger.debug("Step %s: %s", step, msg, extra={'phone': phone_number, 'sampled': True})
+
+        # Salon's own number or deep-link code - skip the business list
+        routed = None
+        if step == 'select_business':
+            routed = provider.route(to_number, msg)
+            if routed:
+                session['business_id'] = routed['business_id']
+                session['step'] = step = 'initial'
+                data['business_name'] = routed['name']
+
+        # STEP 0: Select business
+        if step == 'select_business':
+            businesses = provider.businesses()
+
+            if not businesses:
+                return "Trenutno nema dostupnih biznisa."
+
+            if 'rezerv' in msg or 'termin' in msg or msg == 'start':
+                return menus.business_menu(businesses)
+
+            try:
+                business_num = int(msg)
+                if 1 <= business_num <= len(businesses):
+                    selected = businesses[business_num - 1]
+                    session['business_id'] = selected['business_id']
+                    session['step'] = 'initial'
+                    data['business_name'] = selected['name']
+                    return f"Odabrali ste: {selected['name']}\n\nZa rezervaciju napisite 'termin'."
+            except ValueError:
+                pass
+
+            return menus.business_picker(businesses)
+
+        business_config = provider.business(session['business_id'])
+        if not business_config:
+            session.update(self.new_session())
+            return "Greska. Odaberite biznis ponovno."
+
+        # STEP 1: Initial
+        if step == 'initial':
+            if 'rezerv' in msg or 'termin' in msg:
+                session['step'] = 'service'
+                return menus.service_menu(business_config)
+            elif 'radno' in msg:
+                return menus.working_hours(business_config)
+            elif routed:
+                return f"Dobrodosli u {business_config['name']}!\n\nZa rezervaciju napisite 'termin'."
+            else:
+                return "Za rezervaciju napisite 'termin'."
+
+        # STEP 2: Service
+        elif step == 'service':
+            try:
+                service_num = int(msg)
+                if 1 <= service_num <= len(business_config['services']):
+                    data['service'] = business_config['services'][service_num - 1]
+                    session['step'] = 'date'
+                    return f"Usluga: {data['service']}\n\nZa koji datum?\n(npr. 15.12.2024, 'sutra' ili 'prvi slobodni')"
+            except ValueError:
+                pass
+            return "Molim odaberite broj usluge."
+
+        # STEP 3: Date
+        elif step == 'date':
+            if 'slobod' in msg:
+                choices = self.first_free_slots(business_config)
+                if not choices:
+                    return f"Nazalost, u sljedecih {self.first_free_days} dana nema slobodnih termina."
+                data['slot_choices'] = [list(c) for c in choices]
+                data.pop('available_slots', None)
+                session['step'] = 'time'
+                choices_list = '\n'.join(f"{i+1}. {format_key(d)} u {t}" for i, (d, t) in enumerate(choices))
+                return f"Prvi slobodni termini:\n\n{choices_list}\n\nOdaberite broj:"
+
+            parsed = parse_date(message)
+            if not parsed:
+                return "Molim unesite datum (npr. 15.12.2024 ili 'sutra')."
+
+            date_str = to_key(parsed)
+            if date_str < today_key():
+                return "Taj datum je prosao. Unesite drugi datum."
+
+            date_label = format_key(date_str)
+            data['date'] = date_str
+            data.pop('slot_choices', None)
+
+            # Check available slots
+            available_slots = provider.available_slots(business_config, date_str)
+
+            if not available_slots:
+                # Stay on this step so the next message can be another date
+                return f"Nazalost, za {date_label} nema slobodnih termina.\n\nPokusajte s drugim datumom ili napisite 'prvi slobodni'."
+
+            data['available_slots'] = available_slots
+            session['step'] = 'time'
+
+            return f"Datum: {date_label}\n\nSlobodni termini:\n\n{slot_menu(tuple(available_slots))}\n\nOdaberite broj:"
+
+        # STEP 4: Time
+        elif step == 'time':
+            try:
+                time_num = int(msg)
+                choices = data.get('slot_choices')
+                available_slots = choices or data.get('available_slots', [])
+
+                if 1 <= time_num <= len(available_slots):
+                    session['step'] = 'name'
+                    if choices:
+                        data['date'], data['time'] = choices[time_num - 1]
+                        return f"Termin: {format_key(data['date'])} u {data['time']}\n\nKako se zovete?"
+                    data['time'] = available_slots[time_num - 1]
+                    return f"Vrijeme: {data['time']}\n\nKako se zovete?"
+            except ValueError:
+                pass
+            return "Molim odaberite broj termina."
+
+        # STEP 5: Name
+        elif step == 'name':
+            if len(message.strip()) >= 2:
+                data['name'] = message.strip()
+                session['step'] = 'phone'
+                return f"Ime: {message}\n\nVas broj telefona:"
+            return "Molim unesite vase ime."
+
+        # STEP 6: Phone
+        elif step == 'phone':
+            phone_clean = message.replace(' ', '').replace('+', '')
+            if phone_clean.isdigit() and len(phone_clean) >= 9:
+                data['phone'] = message.strip()
+                session['step'] = 'confirm'
+                return menus.summary(business_config, data)
+            return "Molim unesite ispravan broj."
+
+        # STEP 7: Confirm
+        elif step == 'confirm':
+            if msg in ['da', 'yes', 'potvrdi']:
+                try:
+                    # Claim the slot and save the reservation
+                    reservation = {
+                        'business_id': session['business_id'],
+                        'business_name': business_config['name'],
+                        'business_phone': business_config.get('phone'),
+                        'business_email': business_config.get('email'),
+                        'service': data['service'],
+                        'date': data['date'],
+                        'time': data['time'],
+                        'client_name': data['name'],
+                        'client_phone': data['phone'],
+                        'whatsapp_number': phone_number,
+                        'status': 'confirmed',
+                        'created_at': datetime.utcnow()
+                    }
+
+                    try:
+                        provider.book(business_config, reservation)
+                    except SlotTaken:
+                        return slot_taken_message(data['time'])
+
+                    session.update(self.new_session())
+
+                    return f"POTVRDJENO!\n\nRezervirali ste:\n{format_key(data['date'])} u {data['time']}\n\n{business_config['name']} ce vas kontaktirati.\n\nZa novu rezervaciju napisite 'termin'."
+
+                except Exception as e:
+                    logger.exception("Saving reservation failed: %s", e)
+                    return "Greska pri spremanju. Pokusajte ponovno."
+
+            elif msg in ['ne', 'no', 'odustani']:
+                session.update(self.new_session())
+                return "Otkazano."
+
+            return "Odgovorite sa 'DA' ili 'NE'."
+
+        return "Napisite 'termin' za rezervaciju."
@@ -0,0 +1,238 @@
+# events.py - Fan-out of reservation changes to live dashboards (SSE)
+#
+# An SSE stream stays open as long as the dashboard does, so it is served
+# on the asyncio driver (asgi_app.py, AsyncSubscriber); a thread per
+# dashboard would starve the WSGI workers.
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from dates import format_key
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_FIELDS = ('date', 'time', 'client_name', 'service', 'client_phone', 'status')
+
+# Bookkeeping fields no dashboard shows (reminders.py marks sent reminders)
+INTERNAL_FIELDS = {'reminders_sent'}
+
+SSE_HELLO = 'retry: 5000\n\n'
+SSE_KEEPALIVE = ': keepalive\n\n'
+
+
+def sse_message(event):
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+
+def public_reservation(doc):
+    """The part of a reservation a dashboard may show"""
+    data = {'_id': str(doc['_id'])}
+    for field in PUBLIC_FIELDS:
+        if field in doc:
+            data[field] = doc[field]
+    if 'date' in data:
+        data['date_label'] = format_key(data['date'])
+    return data
+
+
+class AsyncSubscriber:
+    """asyncio.Queue on `loop`, fed by publishing threads"""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Loop already closed; unsubscribe follows
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class ReservationHub:
+    """One reservations watcher per process, fanned out to every subscriber.
+
+    Events come from a change stream when the deployment has one. Without
+    it, the app publishes its own writes with publish_local(), which then
+    only reach dashboards connected to the same process.
+
+    Event: {'type': 'created' | 'updated' | 'confirmed' | 'deleted' | 'reset',
+            'business_id': str or None (None = every business),
+            'reservation': public_reservation() or None,
+            'marker': id of the write, same in every process}
+
+    A delete carries only the _id, so its business comes from the change
+    stream's pre-image (when the collection has changeStreamPreAndPostImages
+    enabled) or from the last `max_known` reservations this hub has seen.
+    Deletes of reservations it cannot attribute - archived history, a
+    deleted salon's bookings - are not published: sending them to every
+    business would flood all dashboards and reset every page version.
+    """
+
+    def __init__(self, max_queue=100, max_known=100000):
+        self.max_queue = max_queue
+        self.max_known = max_known
+        self.watching = False
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._listeners = []
+        self._watcher = None
+        self._known = OrderedDict()
+
+    def add_listener(self, callback):
+        """callback(event) for every event, on the publishing thread"""
+        self._listeners.append(callback)
+
+    def subscribe(self, business_id, loop=None):
+        """Queue of the business's events; an AsyncSubscriber when `loop` is given"""
+        q = AsyncSubscriber(loop, self.max_queue) if loop is not None else queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers[business_id].add(q)
+        return q
+
+    def unsubscribe(self, business_id, q):
+        with self._lock:
+            self._subscribers[business_id].discard(q)
+            if not self._subscribers[business_id]:
+                del self._subscribers[business_id]
+
+    def subscriber_count(self):
+        return sum(len(qs) for qs in self._subscribers.values())
+
+    def _remember(self, event):
+        reservation = event.get('reservation')
+        if not event.get('business_id') or not reservation:
+            return
+        with self._lock:
+            if event['type'] == 'deleted':
+                self._known.pop(reservation['_id'], None)
+                return
+            self._known[reservation['_id']] = event['business_id']
+            self._known.move_to_end(reservation['_id'])
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def owner(self, reservation_id):
+        """Business of a reservation seen by this hub, or None"""
+        return self._known.get(str(reservation_id))
+
+    def publish(self, event):
+        self._remember(event)
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.exception("Reservation event listener failed: %s", e)
+        with self._lock:
+            if event.get('business_id'):
+                targets = list(self._subscribers.get(event['business_id'], ()))
+            else:
+                targets = [q for qs in self._subscribers.values() for q in qs]
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # A stuck client only loses its own events
+                pass
+
+    def publish_local(self, event):
+        """Publish a write made by this process, unless the stream will"""
+        if not self.watching:
+            self.publish(event)
+
+    def stream(self, business_id, keepalive=15):
+        """Server-Sent Events for one dashboard - holds a thread while open"""
+        q = self.subscribe(business_id)
+        try:
+            yield SSE_HELLO
+            while True:
+                try:
+                    event = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield SSE_KEEPALIVE
+                    continue
+                yield sse_message(event)
+        finally:
+            self.unsubscribe(business_id, q)
+
+    def watch(self, collection):
+        if self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch_loop, args=(collection,), name='reservation-events', daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self, collection):
+        options = {'full_document': 'updateLookup', 'full_document_before_change': 'whenAvailable'}
+        while True:
+            try:
+                with collection.watch(**options) as stream:
+                    self.watching = True
+                    # Writes may have happened while we were not watching. Processes
+                    # that start on the same data agree on this marker.
+                    last = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+                    marker = f"{last['_id'] if last else ''}:{collection.estimated_document_count()}"
+                    self.publish({'type': 'reset', 'business_id': None, 'reservation': None,
+                                  'marker': marker})
+                    for change in stream:
+                        event = self._event(change)
+                        if event is not None:
+                            self.publish(event)
+            except OperationFailure as e:
+                if 'full_document_before_change' in options:
+                    # Servers before 6.0 know no pre-images
+                    options.pop('full_document_before_change')
+                    continue
+                logger.info("Reservations change stream unavailable: %s", e)
+                self.watching = False
+                return
+            except PyMongoError as e:
+                logger.warning("Reservations change stream error: %s", e)
+                self.watching = False
+                time.sleep(5)
+            except Exception as e:
+                logger.info("Reservations change stream unsupported: %s", e)
+                self.watching = False
+                return
+
+    def _event(self, change):
+        """Hub event for a change stream document; None if no dashboard cares"""
+        op = change['operationType']
+        doc = change.get('fullDocument')
+        marker = change['_id']['_data']
+        if op == 'update':
+            description = change.get('updateDescription') or {}
+            fields = {f.split('.')[0] for f in description.get('updatedFields', {})}
+            fields.update(f.split('.')[0] for f in description.get('removedFields', ()))
+            if fields and fields <= INTERNAL_FIELDS:
+                return None
+        if op in ('insert', 'update', 'replace') and doc:
+            kind = {'insert': 'created'}.get(op, 'confirmed' if doc.get('status') == 'confirmed' else 'updated')
+            return {'type': kind, 'business_id': doc.get('business_id'),
+                    'reservation': public_reservation(doc),
+                    'marker': str(doc['_id']) if op == 'insert' else marker}
+        if op == 'delete':
+            reservation_id = str(change['documentKey']['_id'])
+            before = change.get('fullDocumentBeforeChange') or {}
+            business_id = before.get('business_id') or self.owner(reservation_id)
+            if not business_id:
+                logger.debug("Unattributed reservation delete %s ignored", reservation_id)
+                return None
+            return {'type': 'deleted', 'business_id': business_id,
+                    'reservation': {'_id': reservation_id}, 'marker': marker}
+        return {'type': 'reset', 'business_id': None, 'reservation': None, 'marker': marker}
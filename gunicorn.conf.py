@@ -0,0 +1,60 @@
+# gunicorn.conf.py - Worker settings and start-up hooks (read by gunicorn from this directory)
+#
+#   gunicorn app:app
+#   gunicorn 'flask-twilio-backend:app' --workers 1
+#
+# Every worker makes its own MongoDB client (database.py); post_worker_init
+# opens its pool, loads the catalog and starts the worker's background
+# threads (change-stream watchers, REMINDERS, HOUSEKEEPING) before it
+# accepts requests, so a freshly scaled-out worker does not pay connection
+# setup on its first message. GUNICORN_PRELOAD=true imports the app once in
+# the master and forks it; nothing the workers need runs in the master.
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Background threads start per worker in warm_up(), not at import (app.py)
+os.environ.setdefault('BACKGROUND_START', 'warm_up')
+
+# Sessions and replies to retried webhooks live in the worker unless a
+# shared backend is configured; a sender's next message may reach another
+# worker, so without one there is a single worker
+SHARED_STATE = (os.getenv('SESSION_BACKEND', 'memory') != 'memory'
+                and os.getenv('REPLY_CACHE_BACKEND', 'memory') != 'memory')
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2 if SHARED_STATE else 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false') == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+
+def app_module(app):
+    return sys.modules.get(app.app_uri.split(':')[0])
+
+
+def on_starting(server):
+    """Refuse several workers when conversation state is per process"""
+    if server.cfg.workers <= 1:
+        return
+    per_process = []
+    if os.getenv('SESSION_BACKEND', 'memory') == 'memory':
+        per_process.append('SESSION_BACKEND=memory')
+    if os.getenv('REPLY_CACHE_BACKEND', 'memory') == 'memory':
+        per_process.append('REPLY_CACHE_BACKEND=memory')
+    if server.app.app_uri.split(':')[0] == 'flask-twilio-backend':
+        per_process.append('the single-salon slot ledger')
+    if per_process:
+        raise RuntimeError(f"{server.cfg.workers} workers with per-process state ({', '.join(per_process)}); "
+                           "use one worker or shared backends (mongo/redis)")
+
+
+def post_worker_init(worker):
+    """Run the app module's warm_up() before the worker takes traffic"""
+    module = app_module(worker.app)
+    warm_up = getattr(module, 'warm_up', None)
+    if warm_up is not None:
+        warm_up()
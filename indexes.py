@@ -0,0 +1,115 @@
+# indexes.py - Index declarations and query plan self-check
+#
+#   python indexes.py           create missing indexes
+#   python indexes.py --check   create them, then explain() every hot query
+import logging
+import os
+import sys
+from datetime import date
+
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# collection -> [(keys, options)]
+INDEXES = {
+    'clients': [
+        ([('business_id', ASCENDING)], {'name': 'business_id_unique', 'unique': True}),
+    ],
+    'reservations': [
+        # new calendar days are seeded from here; covers the time-only projection
+        ([('business_id', ASCENDING), ('date', ASCENDING), ('status', ASCENDING), ('time', ASCENDING)],
+         {'name': 'business_date_status_time'}),
+        # salon_dashboard pages, sorted by (date, time, _id)
+        ([('business_id', ASCENDING), ('date', ASCENDING), ('time', ASCENDING), ('_id', ASCENDING)],
+         {'name': 'business_date_time'}),
+        # admin "today" counts and reminder windows, sorted by (date, time)
+        ([('date', ASCENDING), ('time', ASCENDING)], {'name': 'date_time'}),
+    ],
+    'calendars': [
+        # first free slot ranges and business deletes (single days are read by _id)
+        ([('business_id', ASCENDING), ('date', ASCENDING)], {'name': 'business_date'}),
+        # past days dropped by archival
+        ([('date', ASCENDING)], {'name': 'date'}),
+    ],
+    'reservations_archive': [
+        # background salon deletes
+        ([('business_id', ASCENDING), ('date', ASCENDING)], {'name': 'business_date'}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create every declared index; existing ones are left untouched"""
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        for keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+            except OperationFailure as e:
+                logger.error("Creating index %s.%s failed: %s", collection_name, options['name'], e)
+
+
+def hot_queries(db):
+    """(label, cursor) for every query on the message and dashboard paths"""
+    today = date.today().isoformat()
+    reservations = db['reservations']
+    return [
+        ('get_business_config', db['clients'].find({'business_id': 'x'})),
+        ('get_available_slots', db['calendars'].find({'_id': f'x|{today}'})),
+        ('new_calendar_day', reservations.find(
+            {'business_id': 'x', 'date': today, 'status': {'$in': ['confirmed', 'pending']}},
+            {'time': 1, '_id': 0})),
+        ('first_free_slots', db['calendars'].find({'business_id': 'x', 'date': {'$gte': today, '$lte': today}})),
+        ('salon_dashboard', reservations.find(
+            {'business_id': 'x', 'date': {'$gte': today}},
+            {'date': 1, 'time': 1, 'client_name': 1, 'service': 1, 'client_phone': 1}
+        ).sort([('date', 1), ('time', 1), ('_id', 1)]).limit(101)),
+        ('admin_delete', reservations.find({'business_id': 'x'}, {'_id': 1}).limit(500)),
+        ('export_business', reservations.find({'business_id': 'x'}).sort([('date', 1), ('time', 1), ('_id', 1)])),
+        ('archive_batch', reservations.find({'date': {'$lt': today}}).sort([('date', 1), ('time', 1)]).limit(1000)),
+        ('archive_calendar_days', db['calendars'].find({'date': {'$lt': today}}, {'_id': 1}).limit(1000)),
+        ('today_count', reservations.find({'date': today})),
+        ('reminder_window', reservations.find(
+            {'date': today, 'time': {'$gt': '08:00', '$lte': '10:00'}, 'status': 'confirmed'}
+        ).sort([('date', 1), ('time', 1), ('_id', 1)]).limit(500)),
+    ]
+
+
+def _stages(plan):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _stages(child)
+
+
+def check_query_plans(db):
+    """Raise RuntimeError if any hot query would do a collection scan"""
+    failures = []
+    for label, cursor in hot_queries(db):
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(_stages(plan))
+        logger.info("%s: %s", label, ' <- '.join(s for s in stages if s))
+        if 'COLLSCAN' in stages:
+            failures.append(label)
+    if failures:
+        raise RuntimeError(f"COLLSCAN in hot queries: {', '.join(failures)}")
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    client = MongoClient(os.getenv('MONGODB_URI'))
+    database = client['booking_systems']
+    ensure_indexes(database)
+    if '--check' in sys.argv:
+        try:
+            check_query_plans(database)
+        except RuntimeError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+    print("Indexes OK")
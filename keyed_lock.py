@@ -0,0 +1,98 @@
+# keyed_lock.py - Per-key mutual exclusion for messages from the same sender
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+
+class _Turnstile:
+    """Ticket queue for one key: tickets are served strictly in issue order"""
+
+    __slots__ = ('cond', 'issued', 'serving', 'abandoned', 'users')
+
+    def __init__(self, mutex):
+        self.cond = threading.Condition(mutex)
+        self.issued = 0
+        self.serving = 0
+        self.abandoned = set()
+        self.users = 0
+
+    def advance(self):
+        self.serving += 1
+        while self.serving in self.abandoned:
+            self.abandoned.discard(self.serving)
+            self.serving += 1
+        self.cond.notify_all()
+
+
+class KeyedLock:
+    """One FIFO lock per key, e.g. per WhatsApp number.
+
+    Holders of the same key run one at a time, in the order they asked;
+    different keys never wait for each other. A key's state is dropped
+    as soon as nobody holds or waits for it, so memory follows the
+    number of concurrently active senders.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._keys = {}
+
+    @contextmanager
+    def hold(self, key, timeout=None):
+        """Raises TimeoutError if the key is not ours within `timeout` seconds"""
+        with self._mutex:
+            turnstile = self._keys.get(key)
+            if turnstile is None:
+                turnstile = self._keys[key] = _Turnstile(self._mutex)
+            turnstile.users += 1
+            ticket = turnstile.issued
+            turnstile.issued += 1
+            if not turnstile.cond.wait_for(lambda: turnstile.serving == ticket, timeout):
+                turnstile.abandoned.add(ticket)
+                self._leave(key, turnstile)
+                raise TimeoutError(f"Lock for {key!r} not acquired in {timeout}s")
+        try:
+            yield
+        finally:
+            with self._mutex:
+                turnstile.advance()
+                self._leave(key, turnstile)
+
+    def _leave(self, key, turnstile):
+        turnstile.users -= 1
+        if not turnstile.users:
+            del self._keys[key]
+
+    def __len__(self):
+        """Keys currently held or waited for"""
+        return len(self._keys)
+
+
+class AsyncKeyedLock:
+    """KeyedLock for coroutines on one event loop (asyncio.Lock is FIFO)"""
+
+    def __init__(self):
+        self._keys = {}
+
+    @asynccontextmanager
+    async def hold(self, key, timeout=None):
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            try:
+                await asyncio.wait_for(entry[0].acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Lock for {key!r} not acquired in {timeout}s") from None
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._keys[key]
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,43 @@
+# leases.py - Named leases in MongoDB, for background jobs that run on several nodes
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    """Exclusive, expiring right to run the job `name`.
+
+    acquire() both takes a free (or expired) lease and renews one we
+    already hold; a node that dies simply stops renewing and another
+    takes over after `ttl` seconds.
+    """
+
+    def __init__(self, collection, name, ttl=60, owner=None):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self):
+        now = datetime.utcnow()
+        try:
+            self.collection.update_one(
+                {'_id': self.name, '$or': [{'owner': self.owner}, {'expires_at': {'$lte': now}}]},
+                {'$set': {'owner': self.owner, 'expires_at': now + timedelta(seconds=self.ttl)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def release(self):
+        self.collection.update_one(
+            {'_id': self.name, 'owner': self.owner},
+            {'$set': {'expires_at': datetime.utcnow()}}
+        )
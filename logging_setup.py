@@ -0,0 +1,157 @@
+# logging_setup.py - Non-blocking structured logging
+#
+# Records are handed to a bounded queue on the request thread and written
+# to stdout by a single background listener, so a slow stdout never
+# stalls a WhatsApp turn. Configured with:
+#   LOG_LEVEL        INFO (DEBUG shows per-message lines and tenant dumps)
+#   LOG_FORMAT       json | text
+#   LOG_SAMPLE_RATE  share of per-message debug lines kept (default 0.01)
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+PHONE_RE = re.compile(r'\+?\d[\d \-]{6,}(\d{3})\b')
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_queue_handler = None
+
+
+def redact(text):
+    """Mask phone numbers, keeping the last three digits"""
+    return PHONE_RE.sub(lambda m: '***' + m.group(1), text)
+
+
+class RedactFilter(logging.Filter):
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and isinstance(value, str):
+                setattr(record, key, redact(value))
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Keeps only a share of records logged with extra={'sampled': True}.
+
+    The decision is made per request id, so a sampled message keeps all
+    of its lines.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.threshold = int(rate * 10000)
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        rid = request_id.get()
+        bucket = zlib.crc32(rid.encode()) if rid else random.randrange(10000)
+        return bucket % 10000 < self.threshold
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'sampled':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of blocking when the queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # Keep exc_info - formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _start_listener():
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    if os.getenv('LOG_FORMAT', 'json') == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+def configure_logging():
+    """Install the queue handler on the root logger (idempotent)"""
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000))))
+    _queue_handler.addFilter(SampleFilter(float(os.getenv('LOG_SAMPLE_RATE', 0.01))))
+    _queue_handler.addFilter(RequestIdFilter())
+    _queue_handler.addFilter(RedactFilter())
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    _start_listener()
+    # The listener thread does not survive a gunicorn --preload fork
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork():
+    _queue_handler.queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+    _start_listener()
+
+
+def init_app(app):
+    """Give every Flask request an id (X-Request-Id, Twilio MessageSid or random)"""
+    from flask import request
+
+    @app.before_request
+    def _assign_request_id():
+        request_id.set(
+            request.headers.get('X-Request-Id')
+            or request.values.get('MessageSid')
+            or uuid.uuid4().hex
+        )
+
+    @app.after_request
+    def _echo_request_id(response):
+        response.headers['X-Request-Id'] = request_id.get()
+        return response
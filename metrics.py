@@ -0,0 +1,212 @@
+# metrics.py - Per-request MongoDB instrumentation in Prometheus text format
+#
+# Metrics are per process; with several gunicorn workers, scrape each one
+# (or let the Prometheus server sum them per instance).
+import contextvars
+import logging
+import threading
+import time
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Route and conversation step of the code that is running right now
+_labels = contextvars.ContextVar('metric_labels', default=None)
+
+
+def begin(route):
+    """Start attributing database work to a route"""
+    _labels.set({'route': route or 'unknown', 'step': 'none'})
+
+
+def set_step(step):
+    labels = _labels.get()
+    if labels is not None:
+        labels['step'] = step
+
+
+def current_labels():
+    labels = _labels.get()
+    if labels is None:
+        return 'background', 'none'
+    return labels['route'], labels['step']
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, total in self._values.items():
+                lines.append(f'{self.name}{_format_labels(self.labels, values)} {total}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # per-bucket counts, then +Inf count and sum
+                counts = self._values[label_values] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for values, counts in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(names, values + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(names, values + ("+Inf",))} {counts[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, values)} {counts[-2]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, values)} {counts[-1]}')
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; the callback returns a
+    number or a {label_values_tuple: number} dict. kind='counter' exposes
+    totals that are kept elsewhere (e.g. cache hit counts)."""
+
+    def __init__(self, name, help_text, callback, labels=(), kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.labels = labels
+        self.kind = kind
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning("Metric %s failed: %s", self.name, e)
+            return lines
+        if isinstance(value, dict):
+            for values, number in value.items():
+                lines.append(f'{self.name}{_format_labels(self.labels, values)} {number}')
+        elif value is not None:
+            lines.append(f'{self.name} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+mongo_commands = registry.register(Counter(
+    'booking_mongo_commands_total', 'MongoDB commands by route, step and command',
+    ('route', 'step', 'command')))
+mongo_failures = registry.register(Counter(
+    'booking_mongo_command_failures_total', 'Failed MongoDB commands by route, step and command',
+    ('route', 'step', 'command')))
+mongo_duration = registry.register(Histogram(
+    'booking_mongo_command_duration_seconds', 'MongoDB command latency by route and step',
+    ('route', 'step')))
+http_duration = registry.register(Histogram(
+    'booking_http_request_duration_seconds', 'Request latency by route', ('route',)))
+webhook_duration = registry.register(Histogram(
+    'booking_webhook_duration_seconds', 'Webhook latency by conversation step', ('step',)))
+reminders_sent = registry.register(Counter(
+    'booking_reminders_sent_total', 'Reservation reminders sent by lead time', ('lead',)))
+reminders_failed = registry.register(Counter(
+    'booking_reminders_failed_total', 'Reservation reminders that failed to send by lead time', ('lead',)))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attributes every command to the route/step that issued it.
+
+    pymongo publishes these events on the thread that runs the command,
+    so the context variable set for the request is visible here.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        route, step = current_labels()
+        mongo_commands.inc(route, step, event.command_name)
+        mongo_duration.observe(event.duration_micros / 1e6, route, step)
+
+    def failed(self, event):
+        route, step = current_labels()
+        mongo_commands.inc(route, step, event.command_name)
+        mongo_failures.inc(route, step, event.command_name)
+        mongo_duration.observe(event.duration_micros / 1e6, route, step)
+
+
+mongo_listener = MongoCommandListener()
+
+
+def init_app(app):
+    """Time every Flask request and label its database work by endpoint"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        begin(request.endpoint)
+        g.metrics_started = time.perf_counter()
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            finish(started, webhook=request.endpoint == 'webhook')
+
+
+def finish(started, webhook=False):
+    """Observe a request begun at perf_counter() `started` under its labels"""
+    route, step = current_labels()
+    elapsed = time.perf_counter() - started
+    http_duration.observe(elapsed, route)
+    if webhook:
+        webhook_duration.observe(elapsed, step)
@@ -0,0 +1,69 @@
+# migrate_dates.py - Rewrite free-text reservation dates as ISO keys
+#
+#   python migrate_dates.py [--db booking_systems] [--batch 1000] [--dry-run]
+#
+# Dates are parsed relative to the reservation's created_at, so 'sutra'
+# or '5.1.' resolve to the day the client actually meant. Documents that
+# cannot be parsed are left alone and listed at the end.
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from dates import parse_date, to_key
+
+logger = logging.getLogger(__name__)
+
+# Anything that is not already 'YYYY-MM-DD'
+NOT_ISO = {'date': {'$type': 'string', '$not': {'$regex': r'^\d{4}-\d{2}-\d{2}$'}}}
+
+
+def migrate(collection, batch_size=1000, dry_run=False):
+    """Returns (updated, unparseable_ids); progress is logged per batch"""
+    updated = 0
+    unparseable = []
+    batch = []
+
+    def flush():
+        nonlocal updated
+        if batch and not dry_run:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+        elif batch:
+            updated += len(batch)
+        batch.clear()
+
+    cursor = collection.find(NOT_ISO, {'date': 1, 'created_at': 1}).batch_size(batch_size)
+    for doc in cursor:
+        created = doc.get('created_at')
+        # A booked date was never in the past when it was booked
+        parsed = parse_date(doc['date'], today=created.date() if created else None, past_grace_days=0)
+        if not parsed:
+            unparseable.append(doc['_id'])
+            continue
+        batch.append(UpdateOne({'_id': doc['_id'], 'date': doc['date']}, {'$set': {'date': to_key(parsed)}}))
+        if len(batch) >= batch_size:
+            flush()
+            logger.info("%d updated", updated)
+    flush()
+    return updated, unparseable
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rewrite reservation dates as ISO keys')
+    parser.add_argument('--db', default='booking_systems')
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='  %(message)s')
+    client = MongoClient(os.getenv('MONGODB_URI'))
+    updated, unparseable = migrate(client[args.db]['reservations'], args.batch, args.dry_run)
+
+    print(f"{'Would update' if args.dry_run else 'Updated'} {updated} reservations")
+    if unparseable:
+        print(f"Could not parse {len(unparseable)} dates:")
+        for _id in unparseable:
+            print(f"  - {_id}")
@@ -0,0 +1,79 @@
+# outbound.py - Sending WhatsApp messages outside of a webhook reply
+import os
+import threading
+import time
+
+
+class TwilioSender:
+    """Sends messages through the Twilio REST API"""
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        from twilio.rest import Client
+        self.client = Client(
+            account_sid or os.getenv('TWILIO_ACCOUNT_SID'),
+            auth_token or os.getenv('TWILIO_AUTH_TOKEN')
+        )
+        self.from_number = from_number or os.getenv('TWILIO_WHATSAPP_NUMBER')
+
+    def send(self, to, body, from_=None):
+        message = self.client.messages.create(from_=from_ or self.from_number, to=to, body=body)
+        return message.sid
+
+
+class FakeSender:
+    """Records messages instead of sending them - for local runs and tests"""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, body, from_=None):
+        with self._lock:
+            self.sent.append({'to': to, 'body': body, 'from': from_})
+            return f"FAKE{len(self.sent)}"
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedSender:
+    """Wraps any sender so bulk sends stay under the provider's rate limit"""
+
+    def __init__(self, sender, rate, burst=None):
+        self.sender = sender
+        self.bucket = TokenBucket(rate, burst)
+
+    def send(self, to, body, from_=None):
+        self.bucket.acquire()
+        return self.sender.send(to, body, from_=from_)
+
+
+def create_sender(kind=None):
+    """Build the sender selected by OUTBOUND_SENDER (twilio or fake)"""
+    kind = kind or os.getenv('OUTBOUND_SENDER', 'twilio')
+    if kind == 'twilio':
+        return TwilioSender()
+    if kind == 'fake':
+        return FakeSender()
+    raise ValueError(f"Unknown outbound sender: {kind}")
@@ -0,0 +1,110 @@
+# page_cache.py - Versioned, conditionally served HTML pages
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import Response, request, stream_with_context
+
+
+def make_etag(*parts):
+    return hashlib.sha1('\x1f'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+class PageVersions:
+    """Version markers for per-business pages, derived from reservation writes.
+
+    A business's marker is the id of the last reservation write for it,
+    fed by on_event() from the ReservationHub. When the hub follows a
+    change stream every process sees the same writes and so computes the
+    same ETags; without one, versions also roll over every `window`
+    seconds to bound how long another worker's write can go unnoticed.
+    """
+
+    def __init__(self, window=60, hub=None):
+        self.window = window
+        self.hub = hub
+        self._global = uuid.uuid4().hex
+        self._markers = {}
+
+    def bump(self, business_id, marker):
+        """A reservation of this business was written"""
+        self._markers[business_id] = str(marker)
+
+    def bump_all(self, marker):
+        """Something changed that we can't attribute to one business"""
+        self._global = str(marker)
+        self._markers = {}
+
+    def on_event(self, event):
+        """ReservationHub listener"""
+        marker = event.get('marker') or uuid.uuid4().hex
+        if event.get('business_id'):
+            self.bump(event['business_id'], marker)
+        else:
+            self.bump_all(marker)
+
+    def business(self, business_id):
+        version = f"{self._global}:{self._markers.get(business_id, '')}"
+        if self.hub is None or not self.hub.watching:
+            version += f":{int(time.time() // self.window)}"
+        return version
+
+
+class PageCache:
+    """Bounded LRU of rendered page bodies keyed by ETag"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag):
+        with self._lock:
+            body = self._pages.get(etag)
+            if body is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(etag)
+            self.hits += 1
+            return body
+
+    def put(self, etag, body):
+        with self._lock:
+            self._pages[etag] = body
+            self._pages.move_to_end(etag)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def respond(self, etag, render, private=False):
+        """Serve render() under a strong ETag.
+
+        If-None-Match hits get an empty 304; cached bodies are served
+        without calling render. render may return a string or a generator
+        of chunks - generators are streamed and stored once complete.
+        """
+        cache_control = 'private, no-cache' if private else 'no-cache'
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            body = self.get(etag)
+            if body is None:
+                body = render()
+                if isinstance(body, str):
+                    self.put(etag, body)
+                else:
+                    body = stream_with_context(self._tee(etag, body))
+            response = Response(body, mimetype='text/html')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    def _tee(self, etag, chunks):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.put(etag, ''.join(parts))
@@ -0,0 +1,21 @@
+# prefetch.py - Cache-only execution of the bot logic for the asyncio entry point
+import contextvars
+
+# While set, caches raise CacheMiss instead of running a blocking query
+cache_only = contextvars.ContextVar('cache_only', default=False)
+
+# While set to a list, new reservations are collected there instead of inserted
+deferred_writes = contextvars.ContextVar('deferred_writes', default=None)
+
+
+class CacheMiss(BaseException):
+    """Data the bot needs is not cached yet.
+
+    Derives from BaseException so the bot's broad `except Exception` error
+    replies don't swallow it; the async driver loads the data and retries.
+    """
+
+    def __init__(self, source, *args):
+        super().__init__(source, *args)
+        self.source = source
+        self.args_needed = args
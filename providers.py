@@ -0,0 +1,203 @@
+# providers.py - Where the booking engine gets businesses and slots from
+#
+# A provider answers the engine's questions (which businesses, which slots
+# are free) and books reservations. Both keep the answers in memory:
+#   MongoProvider   every salon in `clients`, per-day calendar documents
+#                   with atomic claims - any number of app nodes
+#   StaticProvider  one salon from a dict, slots in a local ledger - no
+#                   database reads at all, one process per salon
+import logging
+import threading
+
+from pymongo.errors import PyMongoError
+
+from calendars import SlotTaken, slot_capacity
+from prefetch import deferred_writes
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigProvider:
+    """Interface the BookingEngine talks to"""
+
+    # Bumped whenever business configuration changes; keys the menu texts
+    version = 0
+
+    def default_business(self):
+        """The business every conversation starts with, or None to ask"""
+        return None
+
+    def businesses(self):
+        raise NotImplementedError
+
+    def business(self, business_id):
+        raise NotImplementedError
+
+    def route(self, to_number, message=''):
+        """Business addressed by the bot number or a link code, else None"""
+        return None
+
+    def available_slots(self, business, date_str):
+        raise NotImplementedError
+
+    def first_free(self, business, dates, limit, not_before=None):
+        """First `limit` free (date, time) pairs over `dates`"""
+        raise NotImplementedError
+
+    def book(self, business, reservation):
+        """Claim the slot and store the reservation; SlotTaken if it is gone"""
+        raise NotImplementedError
+
+
+class MongoProvider(ConfigProvider):
+    """Multi-tenant: BusinessCatalog, AvailabilityIndex and SlotCalendar over MongoDB"""
+
+    def __init__(self, catalog, availability, calendar, reservations, on_saved=None):
+        self.catalog = catalog
+        self.availability = availability
+        self.calendar = calendar
+        self.reservations = reservations
+        # on_saved(reservation, reservation_id, day) - stats, pages, events
+        self.on_saved = on_saved
+
+    @property
+    def version(self):
+        return self.catalog.version
+
+    def businesses(self):
+        try:
+            return self.catalog.all()
+        except Exception as e:
+            logger.exception("Fetching businesses failed: %s", e)
+            return []
+
+    def business(self, business_id):
+        return self.catalog.get(business_id)
+
+    def route(self, to_number, message=''):
+        return self.catalog.route(to_number, message)
+
+    def available_slots(self, business, date_str):
+        return self.availability.available(business, date_str)
+
+    def first_free(self, business, dates, limit, not_before=None):
+        return self.availability.first_free(business, dates, limit, not_before=not_before)
+
+    def book(self, business, reservation):
+        pending = deferred_writes.get()
+        if pending is not None:
+            # The asyncio driver claims and inserts these itself
+            pending.append(reservation)
+            return None
+        day = self.calendar.claim(business, reservation['date'], reservation['time'])
+        try:
+            result = self.reservations.insert_one(reservation)
+        except PyMongoError:
+            self.calendar.release(reservation['business_id'], reservation['date'], reservation['time'])
+            raise
+        self.saved(business, reservation, result.inserted_id, day)
+        return result.inserted_id
+
+    def saved(self, business, reservation, reservation_id, day):
+        """After a claim and insert: refresh availability, then notify on_saved"""
+        self.availability.update(business, day)
+        if self.on_saved:
+            self.on_saved(reservation, reservation_id, day)
+
+
+class AvailabilityLedger:
+    """Free places per (date, time) for one business, held in this process"""
+
+    def __init__(self, business):
+        self.business = business
+        self.capacity = slot_capacity(business)
+        self.slots = [slot for slot in business['available_slots'] if slot in self.capacity]
+        self._lock = threading.Lock()
+        self._taken = {}
+
+    def available(self, date_str):
+        taken = self._taken.get(date_str, {})
+        return [slot for slot in self.slots if taken.get(slot, 0) < self.capacity[slot]]
+
+    def first_free(self, dates, limit, not_before=None):
+        free = []
+        for date_str in dates:
+            for slot in self.available(date_str):
+                if not_before and (date_str, slot) <= not_before:
+                    continue
+                free.append((date_str, slot))
+                if len(free) >= limit:
+                    return free
+        return free
+
+    def claim(self, date_str, time_str):
+        """True if a place was free and is now ours"""
+        with self._lock:
+            taken = self._taken.setdefault(date_str, {})
+            if time_str not in self.capacity or taken.get(time_str, 0) >= self.capacity[time_str]:
+                return False
+            taken[time_str] = taken.get(time_str, 0) + 1
+            return True
+
+    def release(self, date_str, time_str):
+        with self._lock:
+            taken = self._taken.get(date_str, {})
+            if taken.get(time_str):
+                taken[time_str] -= 1
+
+    def load(self, booked):
+        """Count already booked (date, time) pairs, e.g. after a restart"""
+        with self._lock:
+            for date_str, time_str in booked:
+                taken = self._taken.setdefault(date_str, {})
+                taken[time_str] = taken.get(time_str, 0) + 1
+
+
+class StaticProvider(ConfigProvider):
+    """Single salon from a config dict; never reads a `clients` collection.
+
+    Reservations go to `reservations` when given (and the ledger is seeded
+    from its upcoming confirmed bookings), else they are only logged. The
+    ledger is per process, so run one process for the salon.
+    """
+
+    def __init__(self, config, reservations=None, today=None):
+        self.config = dict({'business_id': 'default', 'address': '', 'phone': None, 'email': None}, **config)
+        self.config.setdefault('available_slots', [])
+        self.reservations = reservations
+        self.ledger = AvailabilityLedger(self.config)
+        if reservations is not None and today is not None:
+            self.ledger.load(
+                (doc['date'], doc['time']) for doc in reservations.find(
+                    {'business_id': self.config['business_id'], 'date': {'$gte': today},
+                     'status': {'$in': ['confirmed', 'pending']}},
+                    {'date': 1, 'time': 1, '_id': 0})
+            )
+
+    def default_business(self):
+        return self.config
+
+    def businesses(self):
+        return [self.config]
+
+    def business(self, business_id):
+        return self.config if business_id == self.config['business_id'] else None
+
+    def available_slots(self, business, date_str):
+        return self.ledger.available(date_str)
+
+    def first_free(self, business, dates, limit, not_before=None):
+        return self.ledger.first_free(dates, limit, not_before)
+
+    def book(self, business, reservation):
+        if not self.ledger.claim(reservation['date'], reservation['time']):
+            raise SlotTaken(reservation['time'])
+        if self.reservations is None:
+            logger.info("Reservation %s %s for %s", reservation['date'], reservation['time'],
+                        reservation['client_name'])
+            return None
+        try:
+            return self.reservations.insert_one(reservation).inserted_id
+        except PyMongoError:
+            self.ledger.release(reservation['date'], reservation['time'])
+            raise
@@ -0,0 +1,211 @@
+# reminders.py - WhatsApp reminders for upcoming reservations
+#
+#   python reminders.py            keep running (any number of nodes)
+#   python reminders.py --once     one pass over every lead time, then exit
+#
+# Each lead time (REMINDER_LEADS, default "24h,2h") owns a window of start
+# times: the 2h reminder covers (now, now+2h], the 24h one (now+2h, now+24h],
+# so a late booking gets only the nearest reminder. Reservations in a
+# window are read in keyset-paginated batches off the (date, time) index,
+# sent through a rate-limited sender and marked in reminders_sent with one
+# bulk write per batch. A lease per lead time keeps two nodes from
+# working the same window; a crash between sending and marking can repeat
+# at most one batch.
+#
+# Run it as its own process (or set REMINDERS=true to start it as a thread
+# in the web app) - sends are throttled by REMINDER_RATE messages/second.
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+import metrics
+from dates import format_key
+from leases import Lease
+from outbound import RateLimitedSender, create_sender
+
+logger = logging.getLogger(__name__)
+
+LEAD_RE = re.compile(r'^(\d+)([hm])$')
+REMINDER_FIELDS = {'business_id': 1, 'business_name': 1, 'date': 1, 'time': 1,
+                   'service': 1, 'whatsapp_number': 1}
+
+
+def parse_leads(text):
+    """'24h,2h,30m' -> [('30m', 1800), ('2h', 7200), ('24h', 86400)], shortest first"""
+    leads = []
+    for label in (part.strip() for part in text.split(',')):
+        match = LEAD_RE.match(label)
+        if not match:
+            raise ValueError(f"Bad reminder lead: {label!r} (use e.g. 24h or 30m)")
+        leads.append((label, int(match.group(1)) * (3600 if match.group(2) == 'h' else 60)))
+    return sorted(leads, key=lambda lead: lead[1])
+
+
+def start_between(start, end):
+    """Filter for reservations with start time in (start, end]"""
+    d1, t1 = start.date().isoformat(), start.strftime('%H:%M')
+    d2, t2 = end.date().isoformat(), end.strftime('%H:%M')
+    if d1 == d2:
+        return {'date': d1, 'time': {'$gt': t1, '$lte': t2}}
+    return {'$or': [
+        {'date': d1, 'time': {'$gt': t1}},
+        {'date': {'$gt': d1, '$lt': d2}},
+        {'date': d2, 'time': {'$lte': t2}},
+    ]}
+
+
+def reminder_text(reservation):
+    return (f"Podsjetnik: {reservation.get('business_name', '')}\n\n"
+            f"{reservation.get('service', '')}\n"
+            f"{format_key(reservation['date'])} u {reservation['time']}\n\n"
+            f"Ako ne mozete doci, javite se salonu.")
+
+
+class ReminderScheduler:
+    """Scans reservation windows and sends one reminder per lead time"""
+
+    def __init__(self, reservations, clients, leases, sender, leads='24h,2h',
+                 batch_size=500, interval=60):
+        self.reservations = reservations
+        self.clients = clients
+        self.sender = sender
+        self.leads = parse_leads(leads)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._leases = {label: Lease(leases, f'reminders:{label}', ttl=max(120, interval * 2))
+                        for label, _ in self.leads}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def window(self, label, now):
+        """Query for reservations due a `label` reminder at `now`"""
+        shorter = 0
+        for lead_label, seconds in self.leads:
+            if lead_label == label:
+                query = start_between(now + timedelta(seconds=shorter), now + timedelta(seconds=seconds))
+                break
+            shorter = seconds
+        return {'$and': [
+            query,
+            {'status': 'confirmed', 'whatsapp_number': {'$exists': True},
+             'reminders_sent': {'$ne': label}},
+        ]}
+
+    def run_once(self, now=None):
+        """One pass over every lead time we hold the lease for; returns {label: sent}"""
+        now = now or datetime.now()
+        sent = {}
+        for label, _ in self.leads:
+            lease = self._leases[label]
+            if not lease.acquire():
+                continue
+            try:
+                sent[label] = self._remind(label, self.window(label, now), lease)
+            except PyMongoError as e:
+                logger.warning("Reminder pass for %s failed: %s", label, e)
+        return sent
+
+    def _remind(self, label, query, lease):
+        sent = 0
+        after = None
+        while not self._stop.is_set():
+            page = query if after is None else {'$and': [query, {'$or': [
+                {'date': {'$gt': after[0]}},
+                {'date': after[0], 'time': {'$gt': after[1]}},
+                {'date': after[0], 'time': after[1], '_id': {'$gt': after[2]}},
+            ]}]}
+            batch = list(self.reservations.find(page, REMINDER_FIELDS)
+                         .sort([('date', 1), ('time', 1), ('_id', 1)]).limit(self.batch_size))
+            if not batch:
+                break
+            last = batch[-1]
+            after = (last['date'], last['time'], last['_id'])
+
+            senders = self._business_numbers({r['business_id'] for r in batch})
+            done = []
+            for reservation in batch:
+                try:
+                    self.sender.send(reservation['whatsapp_number'], reminder_text(reservation),
+                                     from_=senders.get(reservation['business_id']))
+                    done.append(UpdateOne({'_id': reservation['_id']},
+                                          {'$addToSet': {'reminders_sent': label}}))
+                    metrics.reminders_sent.inc(label)
+                except Exception as e:
+                    # Left unmarked: retried next pass until the window moves past it
+                    logger.warning("Reminder failed: %s", e, extra={'reservation_id': str(reservation['_id'])})
+                    metrics.reminders_failed.inc(label)
+            if done:
+                self.reservations.bulk_write(done, ordered=False)
+                sent += len(done)
+            if len(batch) < self.batch_size or not lease.acquire():
+                break
+        if sent:
+            logger.info("Sent %d %s reminders", sent, label)
+        return sent
+
+    def _business_numbers(self, business_ids):
+        """Salons with their own WhatsApp number send their own reminders"""
+        numbers = {}
+        for doc in self.clients.find({'business_id': {'$in': list(business_ids)}},
+                                     {'business_id': 1, 'whatsapp_number': 1}):
+            if doc.get('whatsapp_number'):
+                numbers[doc['business_id']] = f"whatsapp:{doc['whatsapp_number']}"
+        return numbers
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='reminders', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for lease in self._leases.values():
+            lease.release()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception("Reminder pass failed: %s", e)
+            self._stop.wait(max(0, self.interval - (time.monotonic() - started)))
+
+
+def create_scheduler(db, sender=None):
+    """Scheduler configured from the environment (REMINDER_*)"""
+    sender = RateLimitedSender(sender or create_sender(), rate=float(os.getenv('REMINDER_RATE', 10)))
+    return ReminderScheduler(
+        db['reservations'], db['clients'], db['leases'], sender,
+        leads=os.getenv('REMINDER_LEADS', '24h,2h'),
+        batch_size=int(os.getenv('REMINDER_BATCH', 500)),
+        interval=int(os.getenv('REMINDER_INTERVAL', 60))
+    )
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from logging_setup import configure_logging
+
+    parser = argparse.ArgumentParser(description='Send reminders for upcoming reservations')
+    parser.add_argument('--db', default='booking_systems')
+    parser.add_argument('--once', action='store_true', help='one pass, then exit')
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    scheduler = create_scheduler(MongoClient(os.getenv('MONGODB_URI'))[args.db])
+    if args.once:
+        print(scheduler.run_once())
+        scheduler.stop()
+    else:
+        scheduler._loop()
@@ -0,0 +1,89 @@
+# rendering.py - Precomputed bot texts, TwiML and compiled HTML templates
+from functools import lru_cache
+from xml.sax.saxutils import escape as xml_escape
+
+from dates import format_key
+
+TWIML_EMPTY = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+_TWIML_MESSAGE = '<?xml version="1.0" encoding="UTF-8"?><Response><Message>{}</Message></Response>'
+
+
+def twiml(text):
+    """<Response><Message>text</Message></Response>, as MessagingResponse renders it"""
+    return _TWIML_MESSAGE.format(xml_escape(text))
+
+
+@lru_cache(maxsize=4096)
+def slot_menu(slots):
+    """Numbered list of a day's free slots (slots must be a tuple)"""
+    return '\n'.join(f"{i+1}. {s}" for i, s in enumerate(slots))
+
+
+class MenuTexts:
+    """Bot menus per business, rebuilt only when the catalog reloads.
+
+    A text is reused only for the very document (or snapshot) it was built
+    from, and everything is dropped when catalog.version moves on, so an
+    admin edit or a change stream event never leaves a stale menu behind.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._version = None
+        self._texts = {}
+
+    def _get(self, key, source, build):
+        if self._version != self.catalog.version:
+            self._texts = {}
+            self._version = self.catalog.version
+        entry = self._texts.get(key)
+        if entry is None or entry[0] is not source:
+            entry = self._texts[key] = (source, build())
+        return entry[1]
+
+    def business_menu(self, businesses):
+        """Greeting with the numbered business list"""
+        return self._get('business_menu', businesses, lambda: (
+            "Pozdrav! Za koji biznis zelite rezervirati?\n\n"
+            + '\n'.join(f"{i+1}. {b['name']} - {b['city']}" for i, b in enumerate(businesses))
+            + "\n\nOdaberite broj:"
+        ))
+
+    def business_picker(self, businesses):
+        """Short business list shown after an unrecognised reply"""
+        return self._get('business_picker', businesses, lambda: (
+            "Odaberite biznis:\n\n"
+            + '\n'.join(f"{i+1}. {b['name']}" for i, b in enumerate(businesses))
+        ))
+
+    def service_menu(self, business):
+        return self._get(('services', business['business_id']), business, lambda: (
+            f"{business['name']}\n\nUsluge:\n\n"
+            + '\n'.join(f"{i+1}. {s}" for i, s in enumerate(business['services']))
+            + "\n\nOdaberite broj:"
+        ))
+
+    def working_hours(self, business):
+        return self._get(('hours', business['business_id']), business,
+                         lambda: f"Radno vrijeme: {business['working_hours']}")
+
+    def summary(self, business, data):
+        """Reservation summary before confirmation"""
+        header = self._get(('summary', business['business_id']), business,
+                           lambda: f"PREGLED REZERVACIJE:\n\n{business['name']}\n{business['address']}\n")
+        return (f"{header}{data['service']}\n{format_key(data['date'])}\n{data['time']}\n"
+                f"{data['name']}\n{data['phone']}\n\nPotvrdite: 'DA' ili 'NE'")
+
+
+class Templates:
+    """Jinja templates compiled once at startup"""
+
+    def __init__(self, env, names):
+        self._compiled = {name: env.get_template(name) for name in names}
+
+    def render(self, name, **context):
+        return self._compiled[name].render(**context)
+
+    def stream(self, name, **context):
+        """Lazily rendered chunks - iterables in the context are consumed as they stream"""
+        return self._compiled[name].generate(**context)
@@ -0,0 +1,187 @@
+# replies.py - Idempotent webhooks: the reply sent for each Twilio MessageSid
+#
+# Twilio retries a webhook that timed out with the same MessageSid. The
+# first request claims the sid, processes the message and stores its TwiML;
+# a retry gets that TwiML back without touching sessions or reservations.
+# A retry that arrives while the first request is still running waits for
+# its reply.
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+# Returned by claim() while another request is processing the message
+PENDING = object()
+
+
+class ReplyCache:
+    """Interface: claim() a MessageSid before processing it, then store() the reply"""
+
+    def __init__(self, ttl=3600, lease=60):
+        self.ttl = ttl
+        # A claim with no reply after this long is assumed dead and can be retaken
+        self.lease = lease
+        self.hits = 0
+        self.misses = 0
+
+    def claim(self, message_sid):
+        """None if the caller now owns the message; else its reply or PENDING"""
+        raise NotImplementedError
+
+    def store(self, message_sid, body):
+        raise NotImplementedError
+
+    def release(self, message_sid):
+        """Drop our claim without a reply, so a retry processes the message"""
+        raise NotImplementedError
+
+
+class MemoryReplyCache(ReplyCache):
+    """Per-process LRU with TTL - retries reach the same worker only with one worker"""
+
+    def __init__(self, ttl=3600, lease=60, max_entries=100000):
+        super().__init__(ttl, lease)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._replies = OrderedDict()
+
+    def claim(self, message_sid):
+        now = time.monotonic()
+        with self._lock:
+            item = self._replies.get(message_sid)
+            if item is not None:
+                body, stamp = item
+                if body is not None and now - stamp < self.ttl:
+                    self.hits += 1
+                    return body
+                if body is None and now - stamp < self.lease:
+                    self.hits += 1
+                    return PENDING
+            self.misses += 1
+            self._put(message_sid, None, now)
+            return None
+
+    def store(self, message_sid, body):
+        with self._lock:
+            self._put(message_sid, body, time.monotonic())
+
+    def release(self, message_sid):
+        with self._lock:
+            item = self._replies.get(message_sid)
+            if item is not None and item[0] is None:
+                del self._replies[message_sid]
+
+    def _put(self, message_sid, body, stamp):
+        self._replies[message_sid] = (body, stamp)
+        self._replies.move_to_end(message_sid)
+        while len(self._replies) > self.max_entries:
+            self._replies.popitem(last=False)
+
+
+class MongoReplyCache(ReplyCache):
+    """Replies in a MongoDB collection keyed by MessageSid, expired by a TTL index"""
+
+    def __init__(self, collection, ttl=3600, lease=60):
+        super().__init__(ttl, lease)
+        self.collection = collection
+        collection.create_index('created_at', expireAfterSeconds=ttl)
+
+    def claim(self, message_sid):
+        now = datetime.utcnow()
+        try:
+            self.collection.insert_one({'_id': message_sid, 'reply': None, 'created_at': now})
+            self.misses += 1
+            return None
+        except DuplicateKeyError:
+            pass
+        doc = self.collection.find_one({'_id': message_sid})
+        if doc and doc['reply'] is not None:
+            self.hits += 1
+            return doc['reply']
+        # Take over a claim whose owner never stored a reply
+        taken = self.collection.update_one(
+            {'_id': message_sid, 'reply': None, 'created_at': {'$lt': now - timedelta(seconds=self.lease)}},
+            {'$set': {'created_at': now}}
+        )
+        if taken.modified_count:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return PENDING
+
+    def store(self, message_sid, body):
+        self.collection.update_one(
+            {'_id': message_sid},
+            {'$set': {'reply': body, 'created_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def release(self, message_sid):
+        self.collection.delete_one({'_id': message_sid, 'reply': None})
+
+
+class RedisReplyCache(ReplyCache):
+    """Replies in Redis; the claim is a SET NX that expires after the lease
+
+    `client` only needs get/set(nx=, ex=) and eval, so a local stand-in
+    can be passed instead of a real redis.Redis connection.
+    """
+
+    PENDING_VALUE = b'\x00pending'
+    # Delete the key only while it is still an unanswered claim
+    RELEASE_CLAIM = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, client=None, url=None, ttl=3600, lease=60, prefix='reply:'):
+        super().__init__(ttl, lease)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.prefix = prefix
+
+    def claim(self, message_sid):
+        key = self.prefix + message_sid
+        if self.client.set(key, self.PENDING_VALUE, nx=True, ex=self.lease):
+            self.misses += 1
+            return None
+        raw = self.client.get(key)
+        if raw is None:
+            # Lease expired between the two calls
+            return self.claim(message_sid)
+        self.hits += 1
+        if isinstance(raw, str):
+            raw = raw.encode()
+        return PENDING if raw == self.PENDING_VALUE else raw.decode()
+
+    def store(self, message_sid, body):
+        self.client.set(self.prefix + message_sid, body, ex=self.ttl)
+
+    def release(self, message_sid):
+        self.client.eval(self.RELEASE_CLAIM, 1, self.prefix + message_sid, self.PENDING_VALUE)
+
+
+def create_reply_cache(backend, db=None, ttl=3600, max_entries=100000, redis_url=None):
+    """Build the cache selected by REPLY_CACHE_BACKEND (memory, mongo or redis)"""
+    if backend == 'mongo':
+        return MongoReplyCache(db['webhook_replies'], ttl=ttl)
+    if backend == 'redis':
+        return RedisReplyCache(url=redis_url, ttl=ttl)
+    if backend == 'memory':
+        return MemoryReplyCache(ttl=ttl, max_entries=max_entries)
+    raise ValueError(f"Unknown reply cache backend: {backend}")
+
+
+def claim_reply(cache, message_sid, wait=10.0, interval=0.05):
+    """None if the caller should process the message, else the reply to send.
+
+    Waits up to `wait` seconds for a reply another request is producing;
+    after that returns PENDING so the caller acknowledges without reprocessing.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        reply = cache.claim(message_sid)
+        if reply is not PENDING or time.monotonic() >= deadline:
+            return reply
+        time.sleep(interval)
@@ -0,0 +1,341 @@
+# session_store.py - Pluggable storage for conversation sessions
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from keyed_lock import KeyedLock
+
+
+class SessionStore:
+    """Interface: one load() and at most one save() per incoming message,
+    both inside lock() for that phone number"""
+
+    # Seconds to wait for a sender's previous message, and how long a
+    # shared-backend lock lives if its holder dies
+    lock_timeout = 30
+    lock_lease = 30
+
+    def lock(self, phone_number):
+        """Context manager: messages from one number run one at a time, in order"""
+        return self._local_locks.hold(phone_number, self.lock_timeout)
+
+    def load(self, phone_number):
+        """Return the stored session dict, or None"""
+        raise NotImplementedError
+
+    def save(self, phone_number, session):
+        raise NotImplementedError
+
+    def delete(self, phone_number):
+        raise NotImplementedError
+
+    def count(self):
+        """Number of live sessions (approximate for shared backends)"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU with idle TTL - for single-worker deployments"""
+
+    def __init__(self, ttl=86400, max_sessions=100000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._local_locks = KeyedLock()
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def load(self, phone_number):
+        with self._lock:
+            item = self._sessions.get(phone_number)
+            if item is None:
+                return None
+            if time.monotonic() - item[1] > self.ttl:
+                del self._sessions[phone_number]
+                return None
+            return item[0]
+
+    def save(self, phone_number, session):
+        with self._lock:
+            self._sessions[phone_number] = (session, time.monotonic())
+            self._sessions.move_to_end(phone_number)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, phone_number):
+        with self._lock:
+            self._sessions.pop(phone_number, None)
+
+    def count(self):
+        return len(self._sessions)
+
+
+class MongoSessionStore(SessionStore):
+    """Sessions in a MongoDB collection, expired by a TTL index.
+
+    lock() also takes a lease on the session document, so gunicorn
+    workers in different processes serialise on the same number. Taking
+    the lease returns the document, which load() then reads from, and
+    save() releases the lease in the same write: two round trips per
+    message.
+    """
+
+    def __init__(self, collection, ttl=86400):
+        self.collection = collection
+        self.ttl = ttl
+        self._local_locks = KeyedLock()
+        # phone -> {'owner', 'doc', 'thread'} while this process holds the lease
+        self._held = {}
+        collection.create_index('updated_at', expireAfterSeconds=ttl)
+
+    @contextmanager
+    def lock(self, phone_number):
+        with self._local_locks.hold(phone_number, self.lock_timeout):
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout
+            delay = 0.005
+            while True:
+                doc = self._acquire(phone_number, owner)
+                if doc is not None:
+                    break
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Session lock for {phone_number!r} not acquired")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            held = self._held[phone_number] = {'owner': owner, 'doc': doc, 'thread': threading.get_ident()}
+            try:
+                yield
+            finally:
+                del self._held[phone_number]
+                if held['owner'] is not None:
+                    # Not released by save()
+                    self.collection.update_one({'_id': phone_number, 'lock_owner': owner},
+                                               {'$unset': {'lock_owner': '', 'locked_until': ''}})
+
+    def _acquire(self, phone_number, owner):
+        """The session document with our lease on it, or None if someone else holds one"""
+        now = datetime.utcnow()
+        try:
+            return self.collection.find_one_and_update(
+                {'_id': phone_number, '$or': [{'locked_until': {'$exists': False}},
+                                              {'locked_until': {'$lt': now}}]},
+                {'$set': {'lock_owner': owner, 'locked_until': now + timedelta(seconds=self.lock_lease)},
+                 '$setOnInsert': {'updated_at': now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The document exists and someone else's lease is still valid
+            return None
+
+    def _holding(self, phone_number):
+        held = self._held.get(phone_number)
+        return held if held is not None and held['thread'] == threading.get_ident() else None
+
+    def load(self, phone_number):
+        held = self._holding(phone_number)
+        doc = held['doc'] if held is not None else self.collection.find_one({'_id': phone_number})
+        if not doc or 'session' not in doc:
+            return None
+        # The TTL monitor only runs once a minute
+        if doc['updated_at'] < datetime.utcnow() - timedelta(seconds=self.ttl):
+            return None
+        return doc['session']
+
+    def save(self, phone_number, session):
+        update = {'$set': {'session': session, 'updated_at': datetime.utcnow()}}
+        held = self._holding(phone_number)
+        if held is not None and held['owner'] is not None:
+            # Store the session and release our lease in one write
+            owner, held['owner'] = held['owner'], None
+            released = self.collection.update_one(
+                {'_id': phone_number, 'lock_owner': owner},
+                dict(update, **{'$unset': {'lock_owner': '', 'locked_until': ''}})
+            )
+            if released.matched_count:
+                return
+            # The lease expired and was taken over; keep the session anyway
+        # $set keeps the lock fields of the document
+        self.collection.update_one({'_id': phone_number}, update, upsert=True)
+
+    def delete(self, phone_number):
+        self.collection.delete_one({'_id': phone_number})
+
+    def count(self):
+        return self.collection.estimated_document_count()
+
+
+class RedisSessionStore(SessionStore):
+    """Sessions as JSON strings in Redis (or anything speaking its API)
+
+    `client` needs get/set(ex=, nx=)/delete, eval (Lua) and scan_iter
+    (count), so a local stand-in such as fakeredis can be passed instead
+    of a real redis.Redis connection. lock() holds a `lock:` key with a
+    lease, shared by every process. Like MongoSessionStore, taking the
+    lock returns the session and save() releases it in the same script:
+    two round trips per message.
+    """
+
+    # Take the lock and read the session: {session} (nil inside when there
+    # is none) if acquired, nil if someone else holds the lock
+    ACQUIRE_LOCK = ("if redis.call('set', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then "
+                    "return {redis.call('get', KEYS[2])} end return false")
+    # Delete the lock only if it still holds our token - atomically, as the
+    # lease may expire and be retaken between a GET and a DEL
+    RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # Store the session, then release as RELEASE_LOCK does
+    SAVE_AND_RELEASE = ("redis.call('set', KEYS[2], ARGV[2], 'EX', ARGV[3]) "
+                        "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0")
+
+    def __init__(self, client=None, url=None, ttl=86400, prefix='session:'):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._local_locks = KeyedLock()
+        # phone -> {'owner', 'raw', 'thread'} while this process holds the lock
+        self._held = {}
+
+    @contextmanager
+    def lock(self, phone_number):
+        with self._local_locks.hold(phone_number, self.lock_timeout):
+            key = 'lock:' + self.prefix + phone_number
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout
+            delay = 0.005
+            while True:
+                acquired = self.client.eval(self.ACQUIRE_LOCK, 2, key, self.prefix + phone_number,
+                                            owner, self.lock_lease)
+                if acquired is not None:
+                    break
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Session lock for {phone_number!r} not acquired")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            raw = acquired[0] if acquired else None
+            held = self._held[phone_number] = {'owner': owner, 'raw': raw, 'thread': threading.get_ident()}
+            try:
+                yield
+            finally:
+                del self._held[phone_number]
+                if held['owner'] is not None:
+                    # Not released by save()
+                    self.client.eval(self.RELEASE_LOCK, 1, key, owner)
+
+    def _holding(self, phone_number):
+        held = self._held.get(phone_number)
+        return held if held is not None and held['thread'] == threading.get_ident() else None
+
+    def load(self, phone_number):
+        held = self._holding(phone_number)
+        raw = held['raw'] if held is not None else self.client.get(self.prefix + phone_number)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def save(self, phone_number, session):
+        held = self._holding(phone_number)
+        if held is not None and held['owner'] is not None:
+            # Store the session and release our lock in one script
+            owner, held['owner'] = held['owner'], None
+            self.client.eval(self.SAVE_AND_RELEASE, 2, 'lock:' + self.prefix + phone_number,
+                             self.prefix + phone_number, owner, json.dumps(session), self.ttl)
+            return
+        self.client.set(self.prefix + phone_number, json.dumps(session), ex=self.ttl)
+
+    def delete(self, phone_number):
+        self.client.delete(self.prefix + phone_number)
+
+    def count(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+
+
+def create_session_store(backend, db=None, ttl=86400, max_sessions=100000, redis_url=None):
+    """Build the store selected by SESSION_BACKEND (memory, mongo or redis)"""
+    if backend == 'mongo':
+        return MongoSessionStore(db['sessions'], ttl=ttl)
+    if backend == 'redis':
+        return RedisSessionStore(url=redis_url, ttl=ttl)
+    if backend == 'memory':
+        return MemorySessionStore(ttl=ttl, max_sessions=max_sessions)
+    raise ValueError(f"Unknown session backend: {backend}")
+
+
+# ============================================
+# ASYNCIO VARIANTS
+# ============================================
+
+class AsyncMemorySessionStore:
+    """Awaitable facade over a MemorySessionStore (it never blocks)"""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def load(self, phone_number):
+        return self.store.load(phone_number)
+
+    async def save(self, phone_number, session):
+        self.store.save(phone_number, session)
+
+
+class AsyncMongoSessionStore:
+    """MongoSessionStore on a motor collection"""
+
+    def __init__(self, collection, ttl=86400):
+        self.collection = collection
+        self.ttl = ttl
+
+    async def load(self, phone_number):
+        doc = await self.collection.find_one({'_id': phone_number})
+        if not doc or 'session' not in doc:
+            return None
+        if doc['updated_at'] < datetime.utcnow() - timedelta(seconds=self.ttl):
+            return None
+        return doc['session']
+
+    async def save(self, phone_number, session):
+        await self.collection.update_one(
+            {'_id': phone_number},
+            {'$set': {'session': session, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+
+class AsyncRedisSessionStore:
+    """RedisSessionStore on a redis.asyncio client"""
+
+    def __init__(self, client=None, url=None, ttl=86400, prefix='session:'):
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def load(self, phone_number):
+        raw = await self.client.get(self.prefix + phone_number)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    async def save(self, phone_number, session):
+        await self.client.set(self.prefix + phone_number, json.dumps(session), ex=self.ttl)
+
+
+def create_async_session_store(backend, db=None, ttl=86400, redis_url=None, memory_store=None):
+    """Async counterpart of create_session_store; db is a motor database"""
+    if backend == 'mongo':
+        return AsyncMongoSessionStore(db['sessions'], ttl=ttl)
+    if backend == 'redis':
+        return AsyncRedisSessionStore(url=redis_url, ttl=ttl)
+    if backend == 'memory':
+        return AsyncMemorySessionStore(memory_store or MemorySessionStore(ttl=ttl))
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -0,0 +1,72 @@
+# stats.py - Cached reservation counters for the admin panel
+import threading
+import time
+
+
+class ReservationStats:
+    """Per-business reservation totals and today's count from one $group
+    aggregation, cached for `ttl` seconds and bumped in place on inserts.
+    Totals include the per-business counts in `archived`, if given.
+    """
+
+    def __init__(self, collection, ttl=60, archived=None):
+        self.collection = collection
+        self.archived = archived
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = None
+        self._loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, today):
+        by_business = {}
+        today_by_business = {}
+        for row in self.collection.aggregate([
+            {'$group': {
+                '_id': '$business_id',
+                'total': {'$sum': 1},
+                'today': {'$sum': {'$cond': [{'$eq': ['$date', today]}, 1, 0]}}
+            }}
+        ]):
+            by_business[row['_id']] = row['total']
+            today_by_business[row['_id']] = row['today']
+        if self.archived is not None:
+            for row in self.archived.find({}, {'archived': 1}):
+                by_business[row['_id']] = by_business.get(row['_id'], 0) + row.get('archived', 0)
+        return {'day': today, 'by_business': by_business, 'today_by_business': today_by_business}
+
+    def get(self, today):
+        """{'total', 'today', 'by_business'} for the given date key"""
+        stats = self._stats
+        if stats is None or stats['day'] != today or time.monotonic() - self._loaded_at > self.ttl:
+            self.misses += 1
+            stats = self._load(today)
+            with self._lock:
+                self._stats = stats
+                self._loaded_at = time.monotonic()
+        else:
+            self.hits += 1
+        with self._lock:
+            return {
+                'total': sum(stats['by_business'].values()),
+                'today': sum(stats['today_by_business'].values()),
+                'by_business': dict(stats['by_business'])
+            }
+
+    def record(self, business_id, date_str):
+        """Count a newly inserted reservation without reloading"""
+        with self._lock:
+            if self._stats is None:
+                return
+            by_business = self._stats['by_business']
+            by_business[business_id] = by_business.get(business_id, 0) + 1
+            if date_str == self._stats['day']:
+                today = self._stats['today_by_business']
+                today[business_id] = today.get(business_id, 0) + 1
+
+    def drop_business(self, business_id):
+        with self._lock:
+            if self._stats is not None:
+                self._stats['by_business'].pop(business_id, None)
+                self._stats['today_by_business'].pop(business_id, None)
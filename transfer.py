@@ -0,0 +1,372 @@
+# transfer.py - Bulk import/export of businesses and reservations (CSV or JSONL)
+#
+#   python transfer.py export reservations --format csv --out res.csv [--business salon_x]
+#   python transfer.py export businesses --format jsonl --out - > businesses.jsonl
+#   python transfer.py import businesses salons.csv [--batch 1000] [--dry-run]
+#
+# Both directions stream: imports validate rows as they are read and write
+# them with one bulk_write per batch, exports walk a projected cursor and
+# yield one chunk per batch, so memory does not grow with the file.
+# Businesses are upserted by business_id. Reservations are upserted by _id
+# when the row has one (re-importing an export is a no-op) and inserted
+# otherwise; the calendar days they touch are dropped and rebuilt from
+# reservations on next use. Imported reservations are not checked against
+# slot capacity - they are taken as already booked.
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import sys
+from datetime import date as date_cls, datetime
+
+from bson import ObjectId, json_util
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from catalog import normalize_number, valid_code
+from dates import to_key
+
+TIME_RE = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+MAX_ERRORS = 100
+
+BUSINESS_FIELDS = ['business_id', 'name', 'city', 'address', 'phone', 'email', 'whatsapp_number', 'code',
+                   'services', 'working_hours', 'available_slots', 'capacity', 'active']
+RESERVATION_FIELDS = ['_id', 'business_id', 'business_name', 'service', 'date', 'time', 'client_name',
+                      'client_phone', 'whatsapp_number', 'status', 'created_at']
+STATUSES = ('confirmed', 'pending', 'cancelled')
+
+
+def _text(row, field, required=False):
+    value = row.get(field)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # JSONL numbers, e.g. a phone number written without quotes
+        value = str(value)
+    elif value is not None and not isinstance(value, str):
+        raise ValueError(f"bad {field}: {value!r}")
+    value = value.strip() if isinstance(value, str) else value
+    if required and value in (None, ''):
+        raise ValueError(f"missing {field}")
+    return value if value != '' else None
+
+
+def _list(row, field):
+    """A JSON list, or a comma separated string from CSV"""
+    value = row.get(field)
+    if isinstance(value, str):
+        value = value.split(',')
+    elif value is not None and not isinstance(value, list):
+        raise ValueError(f"bad {field}: {value!r}")
+    items = [str(item).strip() for item in value or [] if str(item).strip()]
+    if not items:
+        raise ValueError(f"missing {field}")
+    return items
+
+
+def _date(text):
+    """'2025-01-05' or '05.01.2025' - no relative dates, an import has no 'today'"""
+    for parse in (date_cls.fromisoformat, lambda t: datetime.strptime(t, '%d.%m.%Y').date()):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    raise ValueError(f"bad date: {text}")
+
+
+def clean_business(row):
+    """Client document for a row, or ValueError"""
+    slots = _list(row, 'available_slots')
+    bad = [slot for slot in slots if not TIME_RE.match(slot)]
+    if bad:
+        raise ValueError(f"bad available_slots: {', '.join(bad)}")
+    code = (_text(row, 'code') or '').lower() or None
+    if code is not None and not valid_code(code):
+        raise ValueError(f"bad code: {code} (one word, not a number or a bot keyword)")
+    active = row.get('active')
+    doc = {
+        'business_id': _text(row, 'business_id', True),
+        'name': _text(row, 'name', True),
+        'city': _text(row, 'city', True),
+        'address': _text(row, 'address', True),
+        'phone': _text(row, 'phone', True),
+        'email': _text(row, 'email'),
+        'whatsapp_number': normalize_number(_text(row, 'whatsapp_number')),
+        'code': code,
+        'services': _list(row, 'services'),
+        'working_hours': _text(row, 'working_hours', True),
+        'available_slots': slots,
+        'active': active if isinstance(active, bool) else str(active).strip().lower() in ('true', '1', 'da'),
+    }
+    if _text(row, 'capacity') is not None:
+        try:
+            doc['capacity'] = int(row['capacity'])
+        except (TypeError, ValueError):
+            raise ValueError(f"bad capacity: {row['capacity']}") from None
+    if isinstance(row.get('slot_capacity'), dict):
+        doc['slot_capacity'] = row['slot_capacity']
+    return doc
+
+
+def clean_reservation(row, businesses):
+    """Reservation document for a row, or ValueError; `businesses` maps id -> client doc"""
+    business_id = _text(row, 'business_id', True)
+    business = businesses.get(business_id)
+    if business is None:
+        raise ValueError(f"unknown business_id {business_id}")
+    date = row.get('date')
+    if isinstance(date, datetime):
+        date = date.date()
+    else:
+        date = _date(_text(row, 'date', True))
+    time_str = _text(row, 'time', True)
+    if not TIME_RE.match(time_str):
+        raise ValueError(f"bad time: {time_str}")
+    status = _text(row, 'status') or 'confirmed'
+    if status not in STATUSES:
+        raise ValueError(f"bad status: {status}")
+    created = row.get('created_at')
+    if not isinstance(created, datetime):
+        created = _text(row, 'created_at')
+        try:
+            created = datetime.fromisoformat(created) if created else datetime.utcnow()
+        except ValueError:
+            raise ValueError(f"bad created_at: {created}") from None
+    doc = {
+        'business_id': business_id,
+        'business_name': _text(row, 'business_name') or business['name'],
+        'business_phone': business.get('phone'),
+        'business_email': business.get('email'),
+        'service': _text(row, 'service', True),
+        'date': to_key(date),
+        'time': time_str,
+        'client_name': _text(row, 'client_name', True),
+        'client_phone': _text(row, 'client_phone', True),
+        'status': status,
+        'created_at': created,
+    }
+    whatsapp = _text(row, 'whatsapp_number')
+    if whatsapp:
+        doc['whatsapp_number'] = whatsapp if whatsapp.startswith('whatsapp:') else f"whatsapp:{whatsapp}"
+    _id = row.get('_id')
+    if isinstance(_id, ObjectId):
+        doc['_id'] = _id
+    elif _text(row, '_id'):
+        if not ObjectId.is_valid(str(_id).strip()):
+            raise ValueError(f"bad _id: {_id}")
+        doc['_id'] = ObjectId(str(_id).strip())
+    return doc
+
+
+def read_rows(lines, fmt):
+    """Yield (line_number, row) from a text stream of CSV or JSONL"""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield number, json_util.loads(line)
+                except (ValueError, TypeError) as e:
+                    yield number, e
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def import_rows(db, kind, rows, batch_size=1000, dry_run=False):
+    """Validate and write (line, row) pairs in batches.
+
+    Returns {'rows', 'inserted', 'updated', 'rejected', 'errors', 'business_ids'};
+    invalid rows are skipped and the first MAX_ERRORS listed as (line, message).
+    """
+    result = {'rows': 0, 'inserted': 0, 'updated': 0, 'rejected': 0, 'errors': [], 'business_ids': set()}
+    businesses = None
+    if kind == 'reservations':
+        businesses = {doc['business_id']: doc for doc in db['clients'].find(
+            {}, {'business_id': 1, 'name': 1, 'phone': 1, 'email': 1})}
+        collection = db['reservations']
+    elif kind == 'businesses':
+        collection = db['clients']
+    else:
+        raise ValueError(f"Unknown kind: {kind}")
+
+    batch = []
+    days = set()
+    salons = set()
+
+    def error(line, message):
+        result['rejected'] += 1
+        if len(result['errors']) < MAX_ERRORS:
+            result['errors'].append((line, message))
+
+    def flush():
+        if batch and not dry_run:
+            try:
+                written = collection.bulk_write(batch, ordered=False)
+                result['inserted'] += written.inserted_count + written.upserted_count
+                result['updated'] += written.matched_count
+            except BulkWriteError as e:
+                details = e.details
+                result['inserted'] += details['nInserted'] + details['nUpserted']
+                result['updated'] += details['nMatched']
+                for err in details['writeErrors']:
+                    error(None, err['errmsg'])
+            if days:
+                # Rebuilt from reservations (including these) when next read
+                db['calendars'].delete_many({'_id': {'$in': [f'{b}|{d}' for b, d in days]}})
+            if salons:
+                # A day's capacity is fixed when it is created; rebuild the
+                # coming ones with the imported capacity and slots
+                db['calendars'].delete_many({'business_id': {'$in': list(salons)},
+                                             'date': {'$gte': date_cls.today().isoformat()}})
+        elif batch:
+            result['inserted'] += len(batch)
+        batch.clear()
+        days.clear()
+        salons.clear()
+
+    for line, row in rows:
+        result['rows'] += 1
+        try:
+            if isinstance(row, Exception):
+                raise ValueError(f"bad JSON: {row}")
+            if not isinstance(row, dict):
+                raise ValueError(f"not an object: {row!r}"[:200])
+            if kind == 'businesses':
+                doc = clean_business(row)
+                salons.add(doc['business_id'])
+                batch.append(UpdateOne(
+                    {'business_id': doc['business_id']},
+                    {'$set': doc, '$setOnInsert': {'created_at': datetime.utcnow()}},
+                    upsert=True
+                ))
+            else:
+                doc = clean_reservation(row, businesses)
+                days.add((doc['business_id'], doc['date']))
+                if '_id' in doc:
+                    batch.append(UpdateOne({'_id': doc['_id']}, {'$set': doc}, upsert=True))
+                else:
+                    batch.append(InsertOne(doc))
+        except (ValueError, TypeError, AttributeError) as e:
+            # Whatever a malformed row trips over rejects that row, never the import
+            error(line, str(e))
+            continue
+        result['business_ids'].add(doc['business_id'])
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return result
+
+
+def export_query(kind, business_id=None, date_from=None, date_to=None):
+    """(collection name, filter, projection, sort) for an export"""
+    query = {}
+    if business_id:
+        query['business_id'] = business_id
+    if kind == 'businesses':
+        return 'clients', query, {field: 1 for field in BUSINESS_FIELDS} | {'_id': 0, 'slot_capacity': 1}, \
+            [('business_id', 1)]
+    if kind != 'reservations':
+        raise ValueError(f"Unknown kind: {kind}")
+    if date_from or date_to:
+        query['date'] = {}
+        if date_from:
+            query['date']['$gte'] = date_from
+        if date_to:
+            query['date']['$lte'] = date_to
+    # One salon: walk its business_date_time index instead of sorting in memory
+    sort = [('date', 1), ('time', 1), ('_id', 1)] if business_id else [('_id', 1)]
+    return 'reservations', query, {field: 1 for field in RESERVATION_FIELDS}, sort
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ', '.join(str(item) for item in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None:
+        return ''
+    return str(value)
+
+
+def export_rows(cursor, kind, fmt, chunk_rows=1000):
+    """Yield the export as text chunks of about `chunk_rows` rows each"""
+    fields = BUSINESS_FIELDS if kind == 'businesses' else RESERVATION_FIELDS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if fmt == 'csv':
+        writer.writerow(fields)
+    elif fmt != 'jsonl':
+        raise ValueError(f"Unknown format: {fmt}")
+    rows = 0
+    for doc in cursor:
+        if writer:
+            writer.writerow([_csv_value(doc.get(field)) for field in fields])
+        else:
+            if '_id' in doc:
+                doc['_id'] = str(doc['_id'])
+            buffer.write(json.dumps(doc, default=_csv_value, ensure_ascii=False))
+            buffer.write('\n')
+        rows += 1
+        if rows % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_cursor(db, kind, business_id=None, date_from=None, date_to=None, batch_size=1000):
+    """Documents to export; reservations include `reservations_archive` first.
+
+    A row caught between archive copy and delete comes out twice, the
+    later line being the live one (see archive.py).
+    """
+    name, query, projection, sort = export_query(kind, business_id, date_from, date_to)
+    cursor = db[name].find(query, projection).sort(sort).batch_size(batch_size)
+    if kind != 'reservations':
+        return cursor
+    archived = db['reservations_archive'].find(query, projection).sort(sort).batch_size(batch_size)
+    return itertools.chain(archived, cursor)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Import or export businesses and reservations')
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('kind', choices=['businesses', 'reservations'])
+    parser.add_argument('file', nargs='?', default='-', help="file to import ('-' for stdin)")
+    parser.add_argument('--db', default='booking_systems')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='default: from the file extension')
+    parser.add_argument('--out', default='-', help="export destination ('-' for stdout)")
+    parser.add_argument('--business', help='export one business only')
+    parser.add_argument('--from', dest='date_from', help='export reservations from YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', help='export reservations up to YYYY-MM-DD')
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help='validate only')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.getenv('MONGODB_URI'))[args.db]
+    path = args.file if args.action == 'import' else args.out
+    fmt = args.format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+    if args.action == 'export':
+        out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8', newline='')
+        with out:
+            cursor = export_cursor(db, args.kind, args.business, args.date_from, args.date_to, args.batch)
+            for chunk in export_rows(cursor, args.kind, fmt, args.batch):
+                out.write(chunk)
+    else:
+        source = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8-sig', newline='')
+        with source:
+            result = import_rows(db, args.kind, read_rows(source, fmt), args.batch, args.dry_run)
+        print(f"{result['rows']} rows: {result['inserted']} inserted, {result['updated']} updated, "
+              f"{result['rejected']} rejected{' (dry run)' if args.dry_run else ''}", file=sys.stderr)
+        for line, message in result['errors']:
+            print(f"  line {line}: {message}", file=sys.stderr)
@@ -0,0 +1,114 @@
+# webhook.py - Twilio webhook over a BookingEngine, and a minimal app factory
+import logging
+
+from flask import Flask, Response, request
+
+import metrics
+from logging_setup import init_app as init_request_ids
+from rendering import TWIML_EMPTY, twiml
+from replies import PENDING, claim_reply
+
+logger = logging.getLogger(__name__)
+
+# webhook_reply() result when the sender's worker queue is full
+BUSY = object()
+# webhook_reply() result when processing raised
+FAILED = object()
+ERROR_TEXT = "Bot greska."
+
+
+def init_app(app, engine, replies=None, reply_wait=10.0, submit=None):
+    """Register POST /webhook on `app`.
+
+    replies     ReplyCache - a retried MessageSid gets the first reply again
+    submit      submit(sender, bot_number, message) -> bool; when given the
+                message is handed to background workers and acknowledged
+                with an empty response. False = queue full: the request
+                gets a 503 for Twilio to retry, since replying inline would
+                overtake the sender's queued messages
+    """
+
+    def webhook_reply():
+        """TwiML for the incoming message"""
+        try:
+            incoming_msg = request.values.get('Body', '').strip()
+            sender = request.values.get('From', '').strip()
+            bot_number = request.values.get('To', '').strip()
+
+            logger.debug("Received: %s", incoming_msg, extra={'phone': sender, 'sampled': True})
+
+            if submit is not None:
+                if submit(sender, bot_number, incoming_msg):
+                    return TWIML_EMPTY
+                logger.warning("Worker queue full, asking for a retry", extra={'phone': sender})
+                return BUSY
+
+            response_text = engine.process_message(sender, incoming_msg, bot_number)
+
+            logger.debug("Response: %s", response_text[:50], extra={'sampled': True})
+
+            return twiml(response_text)
+
+        except Exception as e:
+            logger.exception("Webhook failed: %s", e)
+            return FAILED
+
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        """Twilio webhook - a retried MessageSid gets the first reply again"""
+        message_sid = request.values.get('MessageSid', '') if replies is not None else ''
+        if message_sid:
+            cached = claim_reply(replies, message_sid, wait=reply_wait)
+            if cached is PENDING:
+                logger.warning("Retried message still processing, acknowledging", extra={'message_sid': message_sid})
+                return Response(TWIML_EMPTY, mimetype='text/xml')
+            if cached is not None:
+                logger.info("Replaying reply to retried message", extra={'message_sid': message_sid})
+                return Response(cached, mimetype='text/xml')
+
+        body = webhook_reply()
+        if body is BUSY:
+            if message_sid:
+                # The retry must process the message, not replay a reply
+                replies.release(message_sid)
+            return Response('', status=503, headers={'Retry-After': '5'})
+        if body is FAILED:
+            if message_sid:
+                # Not cached: a retry gets another attempt, not the error
+                replies.release(message_sid)
+            return Response(twiml(ERROR_TEXT), mimetype='text/xml')
+        if message_sid:
+            replies.store(message_sid, body)
+        return Response(body, mimetype='text/xml')
+
+    return app
+
+
+def create_app(engine, replies=None, reply_wait=10.0, name=__name__, readiness=None):
+    """Flask app serving only the bot: /webhook, /health, /metrics.
+
+    readiness   database.Readiness behind /health/ready; without one the
+                app has no database and is ready whenever it is live
+    """
+    app = Flask(name)
+    init_request_ids(app)
+    metrics.init_app(app)
+    init_app(app, engine, replies, reply_wait)
+
+    @app.route('/health')
+    @app.route('/health/live')
+    def health():
+        return {'status': 'ok', 'message': 'Bot running'}
+
+    @app.route('/health/ready')
+    def health_ready():
+        if readiness is None:
+            return {'status': 'ready'}
+        result, ready = readiness.check()
+        return result, 200 if ready else 503
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -0,0 +1,75 @@
+# workers.py - Background processing of incoming messages
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWorkerPool:
+    """Runs handler(key, *args) on background threads.
+
+    Every key (the sender's number) is pinned to one worker queue, so
+    messages from the same sender are handled strictly in arrival order
+    while different senders are spread across the pool. Threads are
+    started on first use so the pool survives a gunicorn --preload fork.
+    """
+
+    def __init__(self, handler, workers=4, max_queue=10000):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queues = []
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._queues:
+                return
+            queues = [queue.Queue(maxsize=self.max_queue) for _ in range(self.workers)]
+            self._threads = [
+                threading.Thread(target=self._run, args=(q,), name=f'message-worker-{i}', daemon=True)
+                for i, q in enumerate(queues)
+            ]
+            for t in self._threads:
+                t.start()
+            self._queues = queues
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            try:
+                self.handler(*item)
+            except Exception as e:
+                logger.exception("Worker error: %s", e)
+            finally:
+                q.task_done()
+
+    def submit(self, key, *args):
+        """Queue a message; returns False if the worker queue is full"""
+        if not self._queues:
+            self._start()
+        q = self._queues[zlib.crc32(key.encode()) % self.workers]
+        try:
+            q.put_nowait((key,) + args)
+            return True
+        except queue.Full:
+            return False
+
+    def join(self):
+        """Block until every queued message has been handled"""
+        for q in self._queues:
+            q.join()
+
+    def shutdown(self):
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+        self._queues = []
+        self._threads = []